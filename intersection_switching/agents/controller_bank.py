@@ -0,0 +1,255 @@
+import os
+import numpy as np
+
+MAX_GREEN = 120 # upper bound on the predicted green time, the loop in Movement.get_green_time diverges when arrivals exceed saturation
+RIGHT_TURN = 1 # Movement.move_type of a right turn
+
+
+class ControllerBank:
+    """
+    Evaluates the analytical baseline policies (max-pressure, fixed-time and green-time priority) for all
+    intersections at once on array state, used as fast baselines and as cheap exploration actions
+    """
+    policies = ('max_pressure', 'fixed_time', 'green_time')
+
+    def __init__(self, env, plan_dir=None, cycle_time=30):
+        """
+        initialises the ControllerBank, flattens the movements and phases of all agents into index arrays
+        :param env: the environment holding the intersections
+        :param plan_dir: the directory holding the signal_inter_{intersection_id}.txt fixed-time plans
+        :param cycle_time: the green time of each phase for intersections without a fixed-time plan
+        """
+        self.env = env
+        self.plan_dir = plan_dir
+        self.cycle_time = cycle_time
+        self.agent_ids = list(env.intersections.keys())
+
+        lane_index = {}
+        self._movements = []
+        in_move, in_lane, out_move, out_lane = [], [], [], []
+        phase_ids, phase_inter, serving = [], [], []
+        pm_move, pm_phase, pm_all_move, pm_all_phase = [], [], [], []
+        self._phase_index = {}
+
+        for i, agent in enumerate(env.intersections.values()):
+            move_index = {}
+            for move_id, movement in agent.movements.items():
+                m = len(self._movements)
+                move_index[move_id] = m
+                self._movements.append(movement)
+                for lane in movement.in_lanes:
+                    in_move.append(m)
+                    in_lane.append(lane_index.setdefault(lane, len(lane_index)))
+                for lane in movement.out_lanes:
+                    out_move.append(m)
+                    out_lane.append(lane_index.setdefault(lane, len(lane_index)))
+
+            clearing_moves = agent.clearing_phase.movements if agent.clearing_phase is not None else []
+            for phase in agent.phases.values():
+                p = len(phase_ids)
+                self._phase_index[(i, phase.ID)] = p
+                phase_ids.append(phase.ID)
+                phase_inter.append(i)
+                serving.append(any(agent.movements[x].move_type != RIGHT_TURN for x in phase.movements))
+                for move_id in phase.movements:
+                    pm_all_move.append(move_index[move_id])
+                    pm_all_phase.append(p)
+                    if move_id not in clearing_moves:
+                        pm_move.append(move_index[move_id])
+                        pm_phase.append(p)
+
+        self.lane_ids = list(lane_index.keys())
+        self.n_movements = len(self._movements)
+        self.n_phases = len(phase_ids)
+
+        self.in_move = np.array(in_move, dtype=int)
+        self.in_lane = np.array(in_lane, dtype=int)
+        self.out_move = np.array(out_move, dtype=int)
+        self.out_lane = np.array(out_lane, dtype=int)
+        self.pm_move = np.array(pm_move, dtype=int)
+        self.pm_phase = np.array(pm_phase, dtype=int)
+        self.pm_all_move = np.array(pm_all_move, dtype=int)
+        self.pm_all_phase = np.array(pm_all_phase, dtype=int)
+
+        moves = self._movements
+        self.in_length = np.array([x.in_length for x in moves], dtype=float)
+        self.out_length = np.array([x.out_length for x in moves], dtype=float)
+        self.out_count = np.bincount(self.out_move, minlength=self.n_movements)
+        self.max_saturation = np.array([x.max_saturation for x in moves], dtype=float)
+        self.clearing_time = np.array([x.clearing_time for x in moves], dtype=float)
+        self.pass_time = np.array([x.pass_time for x in moves], dtype=float)
+
+        # phases of each intersection as rows of a padded table, -1 marks padding
+        self.phase_ids = np.array(phase_ids, dtype=int)
+        phase_inter = np.array(phase_inter, dtype=int)
+        n_phases = np.bincount(phase_inter, minlength=len(self.agent_ids))
+        self.phase_table = -np.ones((len(self.agent_ids), n_phases.max()), dtype=int)
+        slots = np.arange(self.n_phases) - np.repeat(np.cumsum(n_phases) - n_phases, n_phases)
+        self.phase_table[phase_inter, slots] = np.arange(self.n_phases)
+        self.n_inter_phases = n_phases
+
+        # the phases select chooses from, the right turn only and empty phases are left out
+        # unless an intersection has no other phase
+        serving = np.array(serving, dtype=bool)
+        has_serving = np.bincount(phase_inter, weights=serving, minlength=len(self.agent_ids)) > 0
+        self.candidate = serving | ~has_serving[phase_inter]
+
+        self._plans = None
+        self._cache = {}
+
+    def get_state(self):
+        """
+        gathers the array state used by the policies from the environment
+        :returns: a dictionary with the lane counts, cumulative arrived/departed vehicles per movement and the current phase rows
+        """
+        lanes_count = self.env.lanes_count
+        current = np.array([self._phase_index.get((i, agent.phase.ID), -1)
+                            for i, agent in enumerate(self.env.intersections.values())], dtype=int)
+        return {
+            'time': self.env.time,
+            'lanes_count': np.fromiter((lanes_count[x] for x in self.lane_ids), dtype=float, count=len(self.lane_ids)),
+            'arr': np.fromiter((sum(x.arr_vehs_num) for x in self._movements), dtype=float, count=self.n_movements),
+            'dep': np.fromiter((sum(x.dep_vehs_num) for x in self._movements), dtype=float, count=self.n_movements),
+            'current_phase': current,
+        }
+
+    def act(self, policy, state=None):
+        """
+        selects the phases of all intersections with the given baseline policy, results are cached per simulation second
+        :param policy: one of ControllerBank.policies
+        :param state: the array state, gathered from the environment if not given
+        :returns: a dictionary with intersection ids as keys and phase ids as values
+        """
+        key = (policy, self.env.time)
+        if state is None and key in self._cache:
+            return self._cache[key]
+
+        if policy not in self.policies:
+            raise ValueError(f'unknown baseline policy {policy}, expected one of {self.policies}')
+        if state is None:
+            state = self.get_state()
+
+        if policy == 'fixed_time':
+            phases = self.fixed_time(state['time'])
+        else:
+            if policy == 'max_pressure':
+                scores = self.phase_scores(self.pressure(state['lanes_count']))
+            else:
+                scores = self.phase_scores(self.priority(state))
+            phases = self.select(scores)
+
+        actions = dict(zip(self.agent_ids, phases.tolist()))
+        self._cache = {key: actions}
+        return actions
+
+    def pressure(self, lanes_count):
+        """
+        computes the pressure of every movement, as in Movement.get_pressure
+        :param lanes_count: array of vehicle counts indexed like self.lane_ids
+        """
+        pressure = np.bincount(self.in_move, weights=lanes_count[self.in_lane] / self.in_length[self.in_move],
+                               minlength=self.n_movements)
+        out = np.bincount(self.out_move, weights=lanes_count[self.out_lane] / self.out_length[self.out_move],
+                          minlength=self.n_movements)
+        pressure -= np.divide(out, self.out_count, out=np.zeros_like(out), where=self.out_count > 0)
+        return pressure
+
+    def green_time(self, time, arr, dep):
+        """
+        predicts the green time needed to clear every movement, closed form of the loop in Movement.get_green_time
+        :param time: the current time
+        :param arr: the cumulative number of vehicles arrived to each movement
+        :param dep: the cumulative number of vehicles departed from each movement
+        """
+        arr_rate = arr / time if time else np.zeros_like(arr)
+        excess = arr_rate * (time + self.clearing_time - self.pass_time) - dep - 0.1
+        slack = self.max_saturation - arr_rate
+        green_time = np.where(excess > 0, MAX_GREEN, 0).astype(excess.dtype) # capped only where the queue never clears
+        np.divide(excess, slack, out=green_time, where=slack > 0)
+        return np.clip(np.ceil(green_time), 0, MAX_GREEN)
+
+    def priority(self, state):
+        """
+        computes the priority of every movement, as in Agent.update_priority_idx
+        :param state: the array state as returned by get_state
+        """
+        green_time = self.green_time(state['time'], state['arr'], state['dep'])
+
+        current = state['current_phase']
+        is_current = np.zeros(self.n_phases + 1, dtype=bool)
+        is_current[current] = True
+        in_current = np.zeros(self.n_movements, dtype=bool)
+        in_current[self.pm_all_move[is_current[self.pm_all_phase]]] = True
+
+        denom = green_time + self.clearing_time + np.where(in_current, 0, self.clearing_time)
+        return np.divide(green_time * self.max_saturation, denom, out=np.zeros_like(denom), where=denom > 0)
+
+    def phase_scores(self, move_scores):
+        """
+        sums the movement scores over the movements enabled by each phase
+        """
+        return np.bincount(self.pm_phase, weights=move_scores[self.pm_move], minlength=self.n_phases)
+
+    def select(self, phase_scores):
+        """
+        selects the highest scoring phase of every intersection among the phases serving a through or left movement,
+        a phase serving only right turns (the clearing phase of Agent) is not a max-pressure or green time choice,
+        ties go to the first of these phases as in max()
+        :returns: array of phase ids ordered like self.agent_ids
+        """
+        valid = (self.phase_table >= 0) & self.candidate[self.phase_table]
+        table = np.where(valid, phase_scores[self.phase_table], -np.inf)
+        best = table.argmax(axis=1)
+        return self.phase_ids[self.phase_table[np.arange(len(self.agent_ids)), best]]
+
+    def load_plans(self):
+        """
+        loads the fixed-time plans, each line of a plan file is a `time,phase` pair marking a phase change
+        plans of all intersections are stored in one array keyed by intersection index * horizon + time
+        """
+        times, phases, inter = [], [], []
+        for i, agent_id in enumerate(self.agent_ids):
+            if self.plan_dir is None:
+                break
+            path = os.path.join(self.plan_dir, f'signal_inter_{agent_id}.txt')
+            if not os.path.exists(path):
+                continue
+            plan = np.loadtxt(path, delimiter=',', ndmin=2)
+            order = np.argsort(plan[:, 0], kind='stable')
+            plan_phases = plan[order, 1].astype(int)
+            unknown = set(plan_phases.tolist()) - set(self.env.intersections[agent_id].phases)
+            if unknown:
+                raise ValueError(f'plan {path} uses phases {sorted(unknown)} not available at {agent_id}')
+            times.append(plan[order, 0])
+            phases.append(plan_phases)
+            inter.append(np.full(len(plan), i))
+
+        self.has_plan = np.zeros(len(self.agent_ids), dtype=bool)
+        if times:
+            times, phases, inter = map(np.concatenate, (times, phases, inter))
+            self.horizon = times.max() + 1
+            self.has_plan[np.unique(inter)] = True
+            self._plans = (inter * self.horizon + times, phases)
+        else:
+            self.horizon = 1
+            self._plans = (np.zeros(0), np.zeros(0, dtype=int))
+        self._plan_start = np.searchsorted(self._plans[0], np.arange(len(self.agent_ids)) * self.horizon)
+
+    def fixed_time(self, time):
+        """
+        selects the phase of every intersection from its fixed-time plan,
+        intersections without a plan cycle through their phases every self.cycle_time seconds
+        """
+        if self._plans is None:
+            self.load_plans()
+        keys, plan_phases = self._plans
+        n = len(self.agent_ids)
+
+        query = np.arange(n) * self.horizon + min(time, self.horizon - 1)
+        idx = np.searchsorted(keys, query, side='right') - 1
+        idx = np.maximum(idx, self._plan_start)
+        planned = plan_phases[np.minimum(idx, len(plan_phases) - 1)] if len(plan_phases) else np.zeros(n, dtype=int)
+
+        slots = (time // self.cycle_time) % self.n_inter_phases
+        cyclic = self.phase_ids[self.phase_table[np.arange(n), slots]]
+        return np.where(self.has_plan, planned, cyclic)
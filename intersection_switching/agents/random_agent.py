@@ -1,17 +1,17 @@
-from agents.fixed_agent import Fixed_Agent
+from agents.switch_agent import SwitchAgent
 import random
 
-class Random_Agent(Fixed_Agent):
+class Random_Agent(SwitchAgent):
     """
     The random agent selecting phases randomly
     """
     def __init__(self, env, ID='', **kwargs):
-        super().__init__(env, ID)
+        super().__init__(env, ID, **kwargs)
         self.agents_type = 'random'
-    
+
     def choose_act(self, eng, time):
         """
         selects a random phase
         """
-        phaseID = random.randint(1, len(self.phases))
+        phaseID = random.choice(list(self.phases))
         return phaseID
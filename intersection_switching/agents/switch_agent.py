@@ -7,6 +7,7 @@ from agents.agent import Agent
 
 MAXSPEED = 40/3.6 # NOTE: maxspeed is hardcoded
 WAIT_THRESHOLD = 120
+PREFERENCES = ('speed', 'stops', 'wait') # the driver preferences, and the rewards of reward type multi
 
 class SwitchAgent(Agent):
     """
@@ -32,6 +33,7 @@ class SwitchAgent(Agent):
         for phase in self.phases.values():
             for movement_id in phase.movements:
                 self.approach_lanes += self.movements[movement_id].in_lanes
+        self.votes = {} # tallied by the environment
         self.init_phases_vectors()
 
         self.n_actions = len(self.phases)
@@ -58,8 +60,19 @@ class SwitchAgent(Agent):
             phase.vector = vec.tolist()
             idx += 1
 
+    def extend_observation_space(self, n, high=1):
+        """
+        appends n values in [0, high] to the observation space, e.g. the neighbourhood features
+        """
+        self.observation_space = spaces.Box(low=np.append(self.observation_space.low, np.zeros(n)),
+                                            high=np.append(self.observation_space.high, np.full(n, high)),
+                                            dtype=float)
+
     def observe(self, vehs_distance):
         observations = self.phase.vector + self.get_vehicle_approach_states(vehs_distance)
+        extra = [x for x in (self.env.neighbour_obs.get(self.ID), self.env.demand_obs) if x is not None]
+        if extra:
+            return np.concatenate([observations] + extra)
         return np.array(observations)
 
     def get_vehicle_approach_states(self, vehs_distance):
@@ -144,14 +157,22 @@ class SwitchAgent(Agent):
         self.update_arr_dep_veh_num(lane_vehs, lanes_count)
         super().apply_action(eng, action, lane_vehs, lanes_count)
 
+    @property
+    def reward_steps(self):
+        """
+        the number of simulation steps since the last decision of the agent
+        """
+        return self.env.time - self.last_act_time
+
     def get_reward(self, type='speed'):
         if type=='speed':
-            if self.env.speeds[-self.env.stops_idx:]:
-                return np.mean(self.env.speeds[-self.env.stops_idx:])
+            speeds = self.env.speeds_tail.tail(self.reward_steps)
+            if len(speeds):
+                return np.mean(speeds)
             else:
                 return 0
         if type=='stops':
-            return -np.sum(self.env.stops[-self.env.stops_idx:])
+            return -np.sum(self.env.stops_tail.tail(self.reward_steps))
         if type=='delay':
             delays = []
             for veh_id, veh_data in self.env.vehicles.items():
@@ -185,6 +206,11 @@ class SwitchAgent(Agent):
             self.total_rewards += [reward]
             self.reward_count += 1
             
+            return reward
+        elif type == 'multi':
+            reward = [self.get_reward(type=pref) for pref in PREFERENCES]
+            self.total_rewards += [reward]
+            self.reward_count += 1
             return reward
         else:
             reward = self.get_reward(type=type)
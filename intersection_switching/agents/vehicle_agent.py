@@ -2,6 +2,7 @@ from engine.cityflow.intersection import Movement, Phase
 import numpy as np
 from gym import spaces
 import random
+from metrics import RunningStats
 
 class VehicleAgent:
     """
@@ -18,11 +19,14 @@ class VehicleAgent:
 
         self.wait = 0
         self.stops = 0
-        self.speeds = []
-        self.wait_times = []
+        self.steps = 0
+        self.speeds = [] if env.detailed_log else None # the full series are only kept for detailed logs
+        self.wait_times = [] if env.detailed_log else None
+        self.wait_stats = RunningStats()
         self.distance = 0
         self.total_rewards = []
         self.start_time = 0
+        self.preference = None
 
         n_actions = 2 # (binary choice?)
         n_states = 10 # TODO: edit
@@ -32,6 +36,28 @@ class VehicleAgent:
 
         self.action_space = spaces.Discrete(n_actions)
 
+    def add_speed(self, speed):
+        """
+        records the speed of a simulation step, the distance is the sum of the speeds (one step is one second)
+        """
+        self.distance += speed
+        self.steps += 1
+        if self.speeds is not None:
+            self.speeds.append(speed)
+
+    def end_wait(self):
+        """
+        records the current wait and resets it
+        """
+        self.wait_stats.add(self.wait)
+        if self.wait_times is not None:
+            self.wait_times.append(self.wait)
+        self.wait = 0
+
+    @property
+    def mean_speed(self):
+        return self.distance / self.steps if self.steps else np.nan
+
     def get_vote(self):
         # if self.stopped:
         #     return 'wait'
@@ -59,8 +85,10 @@ class VehicleAgent:
         """
         self.wait = 0
         self.stops = []
-        self.speeds = []
-        self.wait_times = []
+        self.steps = 0
+        self.speeds = [] if self.env.detailed_log else None
+        self.wait_times = [] if self.env.detailed_log else None
+        self.wait_stats = RunningStats()
         self.distance = 0
         self.total_rewards = []
         self.start_time = 0
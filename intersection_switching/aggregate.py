@@ -0,0 +1,151 @@
+import os
+import re
+import json
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from run_store import RunStore, load_run_data, RUN_STORE
+
+INDEX_FILE = '.aggregate_index.json'
+LEGACY_FILES = ('veh_speed_hist.pickle', 'veh_stops.pickle', 'veh_wait_time.pickle')
+RUN_NAME = re.compile(r'^(?P<config>.+?)(\((?P<trial>\d+)\))?$')
+
+
+def run_files(run_dir):
+    """
+    returns the data files the summary of a run is computed from, the run store or the legacy pickle files
+    """
+    store = os.path.join(run_dir, RUN_STORE)
+    if os.path.exists(store):
+        return [store]
+    legacy = [os.path.join(run_dir, x) for x in LEGACY_FILES]
+    if all(os.path.exists(x) for x in legacy):
+        return legacy
+    return []
+
+
+def summarise_run(run_dir):
+    """
+    Computes the summary row of a run: the mean over vehicles of the mean speed, number of stops and mean wait time
+    vehicles that never waited count as waiting 0 seconds
+    """
+    if os.path.exists(os.path.join(run_dir, RUN_STORE)):
+        with RunStore(run_dir) as store:
+            vehicles = store.table('vehicles')
+            if 'mean_speed' in vehicles:
+                speeds = np.asarray(vehicles['mean_speed'], dtype=float)
+                waits = np.where(vehicles['n_waits'] > 0, vehicles['mean_wait'], 0)
+            else:
+                speeds = vehicles['speeds'].means()
+                waits = vehicles['wait_times'].means(empty=0)
+            stops = np.asarray(vehicles['stops'], dtype=float)
+    else:
+        speeds = load_run_data(run_dir, 'veh_speed_hist')
+        speeds = np.array([np.mean(x) if len(x) else np.nan for x in speeds.values()])
+        stops = np.array([np.mean(x) for x in load_run_data(run_dir, 'veh_stops').values()])
+        waits = np.array([np.mean(x) if x else 0 for x in load_run_data(run_dir, 'veh_wait_time').values()])
+
+    return {
+        'speed': float(np.mean(speeds)),
+        'speed_std': float(np.std(speeds)),
+        'stops': float(np.mean(stops)),
+        'stops_std': float(np.std(stops)),
+        'wait': float(np.mean(waits)),
+        'wait_std': float(np.std(waits)),
+        'n_vehicles': int(len(speeds)),
+    }
+
+
+def parse_run_name(name):
+    """
+    splits a run directory name such as 11_6_0.0_0.5_0.5(3) into its config, trial and the n_vehs prefix
+    """
+    match = RUN_NAME.match(name)
+    config = match.group('config')
+    trial = int(match.group('trial') or 0)
+    tokens = config.split('_')
+    try:
+        n_vehs = [int(tokens[0]), int(tokens[1])]
+        label = '_'.join(tokens[2:])
+    except (ValueError, IndexError):
+        n_vehs = None
+        label = config
+    return {'config': config, 'trial': trial, 'n_vehs': n_vehs, 'label': label}
+
+
+def _summarise(job):
+    run_dir, mtime = job
+    row = summarise_run(run_dir)
+    row['mtime'] = mtime
+    return run_dir, row
+
+
+def scan_runs(root, workers=None, refresh=False):
+    """
+    Scans a tree of run directories and returns one summary row per run
+    summaries are computed in a process pool and cached in an index file in `root` keyed by run path and mtime,
+    so only new or rewritten runs are read again
+    :param root: the directory to scan, e.g. ../runs/proportional
+    :param workers: the number of worker processes, defaults to the number of cpus
+    :param refresh: ignore the cached summaries
+    :returns: list of dictionaries with the run path, group (parent directory relative to root), config, trial,
+              n_vehs, label and summary values
+    """
+    index_path = os.path.join(root, INDEX_FILE)
+    index = {}
+    if os.path.exists(index_path) and not refresh:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+
+    runs = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        files = run_files(dirpath)
+        if files:
+            runs[os.path.relpath(dirpath, root)] = max(os.path.getmtime(x) for x in files)
+            dirnames[:] = []
+
+    stale = [(os.path.join(root, path), mtime) for path, mtime in runs.items()
+             if path not in index or index[path]['mtime'] != mtime]
+    if len(stale) == 1 or workers == 1:
+        results = list(map(_summarise, stale))
+    elif stale:
+        chunksize = max(1, len(stale) // (4 * (workers or os.cpu_count() or 1)))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_summarise, stale, chunksize=chunksize))
+    else:
+        results = []
+    for run_dir, row in results:
+        index[os.path.relpath(run_dir, root)] = row
+
+    index = {path: row for path, row in index.items() if path in runs}
+    if stale or len(index) != len(runs):
+        tmp_path = f'{index_path}.tmp{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+
+    rows = []
+    for path, summary in index.items():
+        group, name = os.path.split(path)
+        row = {'path': os.path.join(root, path), 'group': group}
+        row.update(parse_run_name(name))
+        row.update(summary)
+        rows.append(row)
+    rows.sort(key=lambda x: (x['group'], x['config'], x['trial']))
+    return rows
+
+
+def select(rows, **filters):
+    """
+    returns the rows whose values equal all the given filters, e.g. select(rows, config='11_11_0.0_1.0_0.0')
+    """
+    return [x for x in rows if all(x.get(k) == v for k, v in filters.items())]
+
+
+def to_columns(rows, keys=None):
+    """
+    converts rows to a dictionary of columns
+    """
+    if keys is None:
+        keys = list(dict.fromkeys(k for x in rows for k in x))
+    return {k: [x.get(k) for x in rows] for k in keys}
@@ -0,0 +1,376 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+SCENARIOS = {
+    'loop': '../scenarios/loop_intersection/rings.config',
+    'atlanta': '../scenarios/atlanta/1.config',
+    'hangzhou': '../scenarios/hangzhou/1.config',
+}
+BASELINE_DIR = '../benchmarks'
+SEED = 2
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="benchmarks the environment step, decision and logging hot paths")
+
+    parser.add_argument("--scenarios", default=list(SCENARIOS), type=str, nargs='+', choices=list(SCENARIOS),
+                        help="the scenarios to benchmark")
+    parser.add_argument("--engine", default='mock', type=str,
+                        help="the simulation engine, mock (default), cityflow or replay")
+    parser.add_argument("--trace_dir", default=None, type=str,
+                        help="directory of engine traces named <scenario>.trace, recorded with cityflow/mock and read with replay")
+    parser.add_argument("--steps", default=300, type=int,
+                        help="the number of environment steps (decisions) timed per scenario")
+    parser.add_argument("--calls", default=200, type=int,
+                        help="the number of calls timed for the per-call latencies")
+    parser.add_argument("--baseline_dir", default=BASELINE_DIR, type=str,
+                        help="the directory of the json baselines")
+    parser.add_argument("--save", action='store_true',
+                        help="save the results as the new baselines")
+    parser.add_argument("--threshold", default=0.2, type=float,
+                        help="relative change from the baseline flagged as a regression")
+    parser.add_argument("--cores", default=None, type=int,
+                        help="the core budget of the benchmarked jobs, see resources.core_budget")
+    parser.add_argument("--thread_sweep", action='store_true',
+                        help="time a training workload with every split of the cores between engine and torch threads, needs --engine cityflow")
+    parser.add_argument("--import_budget", default=1.5, type=float,
+                        help="the time in seconds importing runner may take, -1 skips the import check")
+
+    args = parser.parse_args(argv)
+    if args.thread_sweep and args.engine != 'cityflow':
+        parser.error(f'--thread_sweep needs --engine cityflow, the {args.engine} engine ignores the engine threads')
+    return args
+
+
+def time_calls(fn, n):
+    """
+    calls fn n times and returns the duration of every call in seconds
+    """
+    durations = np.empty(n)
+    for i in range(n):
+        start = time.perf_counter()
+        fn()
+        durations[i] = time.perf_counter() - start
+    return durations
+
+
+def metric(value, unit, higher_is_better):
+    return {'value': float(value), 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def latency(durations):
+    return metric(np.median(durations) * 1e3, 'ms', False)
+
+
+def cycle_actions(environ, k):
+    """
+    deterministic actions cycling through the phases of every agent, so runs and replays apply the same actions
+    """
+    actions = {}
+    for agent in environ.agents:
+        phases = list(agent.phases)
+        actions[agent.ID] = phases[k % len(phases)]
+    return actions
+
+
+def bench_environment(environ, steps):
+    """
+    times whole environment steps and then the parts of a step: applying the actions, the simulation sub steps,
+    the reward and the observation
+    """
+    results = {}
+    environ.reset()
+    assigned = list(environ.vehicles)
+    environ.assign_driver_preferences(assigned, environ.pref_types, environ.weights)
+
+    sim_start = environ.time
+    start = time.perf_counter()
+    for k in range(steps):
+        environ.step(cycle_actions(environ, k))
+    results['env.step_rate'] = metric((environ.time - sim_start) / (time.perf_counter() - start), 'sim_s/s', True)
+
+    parts = {'apply': [], 'sub_steps': [], 'reward': [], 'observation': []}
+    sim_time = 0
+    for k in range(steps):
+        actions = cycle_actions(environ, k)
+        t0 = time.perf_counter()
+        environ._apply_actions(actions)
+        t1 = time.perf_counter()
+        sim_start = environ.time
+        environ.sub_steps()
+        sim_time += environ.time - sim_start
+        t2 = time.perf_counter()
+        environ._compute_rewards(environ.ready_agents)
+        t3 = time.perf_counter()
+        environ._get_obs(environ.ready_agents)
+        t4 = time.perf_counter()
+        environ._compute_dones(environ.ready_agents)
+        parts['apply'].append(t1 - t0)
+        parts['sub_steps'].append(t2 - t1)
+        parts['reward'].append(t3 - t2)
+        parts['observation'].append(t4 - t3)
+
+    results['env.sub_steps_rate'] = metric(sim_time / np.sum(parts['sub_steps']), 'sim_s/s', True)
+    results['env.apply_ms'] = latency(parts['apply'])
+    results['env.reward_ms'] = latency(parts['reward'])
+    results['env.observation_ms'] = latency(parts['observation'])
+    return results
+
+
+def bench_dqn(environ, calls):
+    """
+    times DQN.act, the per-decision latency of its inference-only copies (one agent and all agents in a batch),
+    adding to and sampling from the replay memory and DQN.optimize_model, nothing without torch
+    """
+    try:
+        import torch
+        from models.dqn import DQN
+        from models.inference import InferencePolicy
+    except ImportError as error:
+        print(f'  skipping the DQN and inference metrics: {error}')
+        return {}
+
+    results = {}
+    policy = DQN(environ.observation_space, environ.action_space, seed=SEED)
+    obs = [torch.FloatTensor(x) for x in environ.observations.values()]
+    state = obs[0]
+    results['dqn.act_ms'] = latency(time_calls(lambda: policy.act(state, epsilon=0), calls))
+
+    states = np.array([x.numpy() for x in obs])
+    for name, kwargs in [('torch', {}), ('numpy', {'backend': 'numpy'}), ('int8', {'quantize': True})]:
+        try:
+            inference = InferencePolicy.from_policy(policy, **kwargs)
+        except RuntimeError as error: # no quantized engine on this platform
+            print(f'  skipping {name} inference: {error}')
+            continue
+        results[f'inference.{name}_act_ms'] = latency(time_calls(lambda: inference.act(states[0]), calls))
+        results[f'inference.{name}_batch_ms'] = latency(time_calls(lambda: inference.act_batch(states), calls))
+
+    rng = np.random.default_rng(SEED)
+    n_transitions = max(10 * policy.batch_size, calls)
+    transitions = [(obs[i % len(obs)], torch.tensor([rng.integers(policy.num_actions)]),
+                    torch.tensor([rng.normal()], dtype=torch.float), obs[(i + 1) % len(obs)],
+                    torch.tensor([False], dtype=torch.bool)) for i in range(n_transitions)]
+    start = time.perf_counter()
+    for transition in transitions:
+        policy.memory.add(*transition)
+    results['replay.add_rate'] = metric(n_transitions / (time.perf_counter() - start), 'transitions/s', True)
+
+    durations = time_calls(policy.memory.sample, calls)
+    results['replay.sample_rate'] = metric(policy.batch_size / np.median(durations), 'transitions/s', True)
+    results['dqn.optimize_ms'] = latency(time_calls(lambda: policy.optimize_model(gamma=0.8, tau=1e-3), calls))
+    return results
+
+
+def bench_logging(environ, args):
+    """
+    times Environment.get_mfd_data and Logger.serialise_data on the episode simulated by bench_environment,
+    the run is written to a temporary directory
+    """
+    from logger import Logger
+
+    results = {}
+    num_sim_steps = environ.num_sim_steps
+    environ.num_sim_steps = environ.time # the mfd is computed over the simulated steps only
+    with tempfile.TemporaryDirectory() as tmp:
+        log_args = argparse.Namespace(**vars(args))
+        log_args.mode, log_args.path, log_args.ID = 'vote', tmp, None
+        logger = Logger(log_args)
+        logger.log_measures(environ)
+        logger.log_delays(args.sim_config, environ)
+
+        start = time.perf_counter()
+        environ.get_mfd_data()
+        results['log.mfd_s'] = metric(time.perf_counter() - start, 's', False)
+
+        start = time.perf_counter()
+        logger.serialise_data(environ)
+        results['log.serialise_s'] = metric(time.perf_counter() - start, 's', False)
+        logger.stream.close()
+    environ.num_sim_steps = num_sim_steps
+    return results
+
+
+def scenario_argv(scenario, bench_args):
+    argv = ['--sim_config', SCENARIOS[scenario], '--engine', bench_args.engine]
+    if bench_args.trace_dir:
+        argv += ['--trace', os.path.join(bench_args.trace_dir, f'{scenario}.trace')]
+    if bench_args.cores:
+        argv += ['--cores', str(bench_args.cores)]
+    return argv
+
+
+def thread_splits(cores):
+    """
+    the numbers of engine threads of the sweep, the rest of the cores go to torch
+    """
+    return sorted({x for x in (1, 2, cores // 4, cores // 2, cores - 1) if 1 <= x <= max(1, cores - 1)})
+
+
+def bench_threads(scenario, bench_args):
+    """
+    times a fixed training workload, an environment step and a DQN optimisation step per decision, with every split
+    of the core budget between the engine threads and the torch threads
+    :returns: the core budget, the step rate of every split and the split with the best step rate
+    """
+    import torch
+    from runner import parse_args as runner_args
+    from environ import Environment
+    from resources import ThreadBudget
+    from models.dqn import DQN
+
+    cores = ThreadBudget(bench_args.cores).cores
+    splits = []
+    for engine_threads in thread_splits(cores):
+        args = runner_args(scenario_argv(scenario, bench_args) + ['--engine_threads', str(engine_threads)])
+        budget = ThreadBudget(cores, engine_threads=engine_threads, uses_torch=True)
+        budget.apply_torch(torch)
+        environ = Environment(args, reward_type=args.reward_type)
+        environ.reset()
+        policy = DQN(environ.observation_space, environ.action_space, seed=SEED)
+        obs = [torch.FloatTensor(x) for x in environ.observations.values()]
+        for i in range(10 * policy.batch_size):
+            policy.memory.add(obs[i % len(obs)], torch.tensor([i % policy.num_actions]), torch.tensor([0.0]),
+                              obs[(i + 1) % len(obs)], torch.tensor([False], dtype=torch.bool))
+
+        sim_start = environ.time
+        start = time.perf_counter()
+        for k in range(bench_args.steps):
+            environ.step(cycle_actions(environ, k))
+            policy.optimize_model(gamma=0.8, tau=1e-3)
+        duration = time.perf_counter() - start
+        step_rate = (environ.time - sim_start) / duration
+        splits.append({'engine_threads': budget.engine_threads, 'torch_threads': budget.torch_threads,
+                       'step_rate': step_rate})
+    best = max(splits, key=lambda x: x['step_rate'])
+    return {'cores': cores, 'splits': splits, 'best': best['engine_threads']}
+
+
+def run_scenario(scenario, bench_args):
+    from runner import parse_args as runner_args
+    from environ import Environment
+
+    args = runner_args(scenario_argv(scenario, bench_args))
+
+    start = time.perf_counter()
+    environ = Environment(args, reward_type=args.reward_type)
+    results = {'env.setup_s': metric(time.perf_counter() - start, 's', False)}
+    results.update(bench_environment(environ, bench_args.steps))
+    results.update(bench_dqn(environ, bench_args.calls))
+    results.update(bench_logging(environ, args))
+    output = {
+        'scenario': scenario,
+        'engine': bench_args.engine,
+        'steps': bench_args.steps,
+        'agents': len(environ.agents),
+        'lanes': len(environ.lanes),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'metrics': results,
+    }
+    if bench_args.thread_sweep:
+        output['threads'] = bench_threads(scenario, bench_args)
+    return output
+
+
+def bench_imports(module='runner'):
+    """
+    imports a module in a fresh interpreter with -X importtime
+    :returns: the total import time in seconds (including the interpreter's own startup imports)
+              and the heavy packages it loaded
+    """
+    from profiling import HEAVY_MODULES
+
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    if output.returncode:
+        raise RuntimeError(f'importing {module} failed:\n{output.stderr}')
+    total = 0
+    loaded = set()
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue # header
+        if not name.startswith('  '): # top level imports, nested ones are indented
+            total += int(cumulative)
+        loaded.add(name.strip().split('.')[0])
+    return total / 1e6, [x for x in HEAVY_MODULES if x in loaded]
+
+
+def compare(result, baseline, threshold):
+    """
+    compares the metrics of a result to its baseline
+    :returns: list of (metric, baseline value, value, relative change, is regression)
+    """
+    rows = []
+    for name, base in baseline['metrics'].items():
+        if name not in result['metrics'] or not base['value']:
+            continue
+        value = result['metrics'][name]['value']
+        change = (value - base['value']) / base['value']
+        regression = -change > threshold if base['higher_is_better'] else change > threshold
+        rows.append((name, base['value'], value, change, regression))
+    return rows
+
+
+def baseline_path(baseline_dir, scenario, engine):
+    return os.path.join(baseline_dir, f'{scenario}_{engine}.json')
+
+
+def main(argv=None):
+    bench_args = parse_args(argv)
+    if bench_args.trace_dir:
+        os.makedirs(bench_args.trace_dir, exist_ok=True)
+    regressions = 0
+    if bench_args.import_budget >= 0:
+        seconds, heavy = bench_imports()
+        print(f"importing runner: {seconds:.3f} s (budget {bench_args.import_budget:.3f} s), heavy modules: {', '.join(heavy) or 'none'}")
+        if seconds > bench_args.import_budget or heavy:
+            print('  REGRESSION')
+            regressions += 1
+
+    for scenario in bench_args.scenarios:
+        print(f'benchmarking {scenario} on {bench_args.engine}')
+        result = run_scenario(scenario, bench_args)
+        path = baseline_path(bench_args.baseline_dir, scenario, bench_args.engine)
+
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                baseline = json.load(f)
+            for name, base, value, change, regression in compare(result, baseline, bench_args.threshold):
+                flag = 'REGRESSION' if regression else ''
+                print(f'  {name:<22}{base:>12.4g} -> {value:<12.4g}{change:+8.1%} {flag}')
+                regressions += regression
+        else:
+            for name, value in result['metrics'].items():
+                print(f"  {name:<22}{value['value']:>12.4g} {value['unit']}")
+
+        if 'threads' in result:
+            threads = result['threads']
+            for split in threads['splits']:
+                print(f"  {split['engine_threads']:>3} engine + {split['torch_threads']:>3} torch threads: "
+                      f"{split['step_rate']:>10.1f} sim_s/s")
+            print(f"  best split of {threads['cores']} cores: {threads['best']} engine threads")
+
+        if bench_args.save:
+            os.makedirs(bench_args.baseline_dir, exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(result, f, indent=2)
+            print(f'  saved baseline {path}')
+
+    if regressions:
+        print(f'{regressions} regression(s) beyond {bench_args.threshold:.0%}')
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+import os
+import io
+import copy
+import random
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+CHECKPOINT = 'checkpoint.pt'
+MAX_PENDING = 8
+
+
+def atomic_save(obj, path):
+    """
+    torch.saves obj to a temporary file next to path, syncs it and moves it in place,
+    a killed run leaves either the previous file or the new one, never a partial file
+    """
+    _write_file(_serialise(obj), path)
+    return path
+
+
+def _serialise(obj):
+    import torch
+    buffer = io.BytesIO()
+    torch.save(obj, buffer)
+    return buffer.getvalue()
+
+
+def _write_file(data, path):
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def snapshot(obj):
+    """
+    a copy of obj that later training steps cannot change, tensors are copied to the cpu,
+    e.g. a state dict sharing the storage of the parameters of a network
+    """
+    import torch
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        copied = type(obj)((key, snapshot(value)) for key, value in obj.items())
+        if hasattr(obj, '_metadata'): # the versions of the modules of a state dict
+            copied._metadata = copy.deepcopy(obj._metadata)
+        return copied
+    if type(obj) in (list, tuple):
+        return type(obj)(snapshot(x) for x in obj)
+    return copy.deepcopy(obj)
+
+
+class CheckpointWriter:
+    """
+    Writes torch files from a background thread so training never waits on the filesystem,
+    objects are snapshot in memory when submitted, a newer object submitted for a path still pending replaces the
+    pending one, and submit only blocks when `max_pending` paths are pending,
+    a payload identical to a file already written is hardlinked to it instead of written again,
+    every file is written to a temporary file and moved in place
+    """
+
+    def __init__(self, max_pending=MAX_PENDING):
+        self.max_pending = max(1, max_pending)
+        self.written = 0
+        self.linked = 0
+        self.skipped = 0
+        self._pending = OrderedDict() # path -> snapshot
+        self._digests = {} # path -> sha1 of the payload written to it
+        self._busy = False
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, path, obj):
+        """
+        snapshots obj and queues it to be torch.saved to path
+        """
+        obj = snapshot(obj)
+        with self._cond:
+            self._raise()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+                self._thread.start()
+            while len(self._pending) >= self.max_pending and path not in self._pending:
+                self._cond.wait()
+            self._pending[path] = obj
+            self._cond.notify_all()
+
+    def flush(self):
+        """
+        waits until every submitted object is written
+        """
+        with self._cond:
+            while (self._pending or self._busy) and self._error is None:
+                self._cond.wait()
+            self._raise()
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('writing a checkpoint failed') from error
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                path, obj = self._pending.popitem(last=False)
+                self._busy = True
+                self._cond.notify_all()
+            try:
+                self._write(path, obj)
+            except Exception as error:
+                self._error = error
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def _write(self, path, obj):
+        data = _serialise(obj)
+        digest = hashlib.sha1(data).hexdigest()
+        if self._digests.get(path) == digest and os.path.exists(path):
+            self.skipped += 1
+            return
+        source = next((other for other, other_digest in self._digests.items()
+                       if other_digest == digest and other != path and os.path.exists(other)), None)
+        if source is not None:
+            tmp_path = f'{path}.tmp{os.getpid()}'
+            try:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                os.link(source, tmp_path)
+                os.replace(tmp_path, path)
+                self._digests[path] = digest
+                self.linked += 1
+                return
+            except OSError: # no hardlinks on this filesystem
+                pass
+        _write_file(data, path)
+        self._digests[path] = digest
+        self.written += 1
+
+    def __str__(self):
+        return f'{self.written} files written, {self.linked} hardlinked, {self.skipped} unchanged'
+
+
+def rng_state(sampler=None):
+    """
+    the states of the python, numpy and torch random generators and of the traffic condition sampler
+    """
+    import torch
+    state = {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    if sampler is not None:
+        state['sampler'] = sampler.rng.bit_generator.state
+    return state
+
+
+def set_rng_state(state, sampler=None):
+    import torch
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+    if sampler is not None and 'sampler' in state:
+        sampler.rng.bit_generator.state = state['sampler']
+
+
+def memory_state(memory):
+    """
+    the transitions of a replay memory as one stacked tensor per field
+    """
+    import torch
+    if not len(memory):
+        return None
+    return {name: torch.stack(values).cpu() for name, values in zip(memory.experiences._fields, zip(*memory.memory))}
+
+
+def restore_memory(memory, state, device=None):
+    memory.memory.clear()
+    if state is None:
+        return
+    fields = [state[name].to(device) if device is not None else state[name] for name in memory.experiences._fields]
+    for values in zip(*fields):
+        memory.add(*values)
+
+
+def training_state(policy, environ, logger, episode, best, step=0, sampler=None):
+    """
+    everything needed to continue a training run after `episode`: the networks, optimizer and replay memory of the
+    policy, epsilon, the random generators, the best-so-far trackers and the logger series
+    :param episode: the index of the next episode
+    :param best: dictionary of the best-so-far trackers of run_exp
+    :param step: the position of run_exp in the update_freq cycle of the optimisation steps
+    """
+    return {
+        'episode': episode,
+        'step': step,
+        'args': vars(logger.args),
+        'policy': {
+            'net_local': policy.net_local.state_dict(),
+            'net_target': policy.net_target.state_dict(),
+            'optimizer': policy.optimizer.state_dict(),
+            'step_count': policy.step_count,
+        },
+        'memory': memory_state(policy.memory),
+        'eps': environ.eps,
+        'agent_history': list(environ.agent_history),
+        'best': dict(best),
+        'rng': rng_state(sampler),
+        'logger': logger.state(),
+    }
+
+
+def save_checkpoint(log_path, policy, environ, logger, episode, best, step=0, sampler=None, writer=None):
+    """
+    writes the full training state of the run to <log_path>/checkpoint.pt
+    :param writer: a CheckpointWriter writing it in the background, written before returning by default
+    """
+    logger.stream.flush()
+    path = os.path.join(log_path, CHECKPOINT)
+    state = training_state(policy, environ, logger, episode, best, step, sampler)
+    if writer is not None:
+        writer.submit(path, state)
+        return path
+    return atomic_save(state, path)
+
+
+def load_checkpoint(log_path):
+    """
+    :returns: the training state saved in <log_path>/checkpoint.pt, None if the run has no checkpoint
+    """
+    import torch
+    path = os.path.join(log_path, CHECKPOINT)
+    if not os.path.exists(path):
+        return None
+    return torch.load(path, map_location=torch.device('cpu'), weights_only=False)
+
+
+def restore_training(state, policy, environ, logger, sampler=None, device=None):
+    """
+    restores a training state saved by save_checkpoint
+    :returns: the index of the next episode, the best-so-far trackers and the update_freq step
+    """
+    policy.net_local.load_state_dict(state['policy']['net_local'])
+    policy.net_target.load_state_dict(state['policy']['net_target'])
+    policy.optimizer.load_state_dict(state['policy']['optimizer'])
+    policy.step_count = state['policy']['step_count']
+    restore_memory(policy.memory, state['memory'], device)
+    environ.eps = state['eps']
+    environ.agent_history = list(state['agent_history'])
+    logger.restore(state['logger'])
+    set_rng_state(state['rng'], sampler)
+    return state['episode'], state['best'], state['step']
@@ -0,0 +1,59 @@
+import numpy as np
+
+# the vehicles of the two flows of the loop scenario, as trained by run_train.py
+TRAFFIC_CONDITIONS = {
+    'low_balanced': (11, 11),
+    'low_unbalanced': (11, 6),
+    'medium_balanced': (22, 22),
+    'medium_unbalanced': (22, 11),
+    'high_balanced': (32, 32),
+    'high_unbalanced': (32, 16),
+}
+MAX_VEHS = 32 # the demand features are the vehicles of each flow divided by MAX_VEHS
+SAMPLING = ('random', 'cycle')
+
+
+def parse_condition(condition):
+    """
+    :param condition: the name of one of TRAFFIC_CONDITIONS or the vehicles of the flows, e.g. 22,11
+    :returns: tuple of the vehicles of each flow
+    """
+    if condition in TRAFFIC_CONDITIONS:
+        return TRAFFIC_CONDITIONS[condition]
+    return tuple(int(x) for x in condition.split(','))
+
+
+def condition_name(n_vehs):
+    return '_'.join(map(str, n_vehs))
+
+
+def demand_features(n_vehs):
+    """
+    the demand features appended to the observations of a traffic conditioned policy
+    """
+    return np.array(n_vehs, dtype=float) / MAX_VEHS
+
+
+class ConditionSampler:
+    """
+    Selects the traffic condition of every training episode, uniformly at random or cycling through the conditions,
+    parallel workers cycling through the same conditions start at different offsets
+    """
+
+    def __init__(self, conditions, sampling='random', worker=0, seed=None):
+        """
+        :param conditions: list of the vehicles of each flow of every condition
+        :param sampling: random or cycle
+        :param worker: the index of the worker, offsets the cycle
+        """
+        if sampling not in SAMPLING:
+            raise ValueError(f'unknown sampling {sampling}, expected one of {SAMPLING}')
+        self.conditions = [tuple(x) for x in conditions]
+        self.sampling = sampling
+        self.worker = worker or 0
+        self.rng = np.random.default_rng(seed)
+
+    def sample(self, i_episode):
+        if self.sampling == 'cycle':
+            return self.conditions[(i_episode + self.worker) % len(self.conditions)]
+        return self.conditions[self.rng.integers(len(self.conditions))]
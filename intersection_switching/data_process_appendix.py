@@ -1,8 +1,7 @@
-import pickle
 import numpy as np
 import matplotlib.pyplot as plt
-import glob
 from radar_plot import ComplexRadar 
+from aggregate import scan_runs, select
 
 low_balanced = [11, 11]
 low_unbalanced = [11, 6]
@@ -51,193 +50,145 @@ categories = [*categories, categories[0]]
 vote_types = [vote_uniform_3, ['both']]
 
 
-# all_data = {}
-# all_names = {}
+if __name__ == "__main__":
+    all_data = {}
+    all_names = {}
 
-# for j, (label, traffic) in enumerate(traffic_dict.items()):
-#     data = []
-#     names = []
-#     for folder in ['proportional_100','both_lin_combo_test', 'both_cobb_doug_test']:
-#         if 'both' in folder:
-#             vote = ['both']
-#         else:
-#             vote = vote_uniform_3
-#         avg_total_waits = []
-#         avg_total_stops = []
-#         avg_total_speeds = []
+    folder_runs = {folder: scan_runs(f"../{folder}") for folder in ['proportional_100','both_lin_combo_test', 'both_cobb_doug_test']}
 
+    for j, (label, traffic) in enumerate(traffic_dict.items()):
+        data = []
+        names = []
+        for folder, runs in folder_runs.items():
+            if 'both' in folder:
+                vote = ['both']
+            else:
+                vote = vote_uniform_3
 
-#         _path = f"../{folder}/{'_'.join(map(str,traffic))}_{'_'.join(map(str,vote))}"
+            trials = select(runs, config=f"{'_'.join(map(str,traffic))}_{'_'.join(map(str,vote))}")
 
-#         # for trial, path in enumerate([_path]):
-#         for trial, path in enumerate(glob.glob(f'{_path}*')):
-#             print('globbing', path)
-#             speeds_path = path + "/veh_speed_hist.pickle"
-#             stops_path = path + "/veh_stops.pickle"
-#             wait_path = path + "/veh_wait_time.pickle"
+            avg_total_waits = [x['wait'] for x in trials]
+            avg_total_stops = [x['stops'] for x in trials]
+            avg_total_speeds = [x['speed'] for x in trials]
 
-#             with open(speeds_path, "rb") as f:
-#                 speeds = pickle.load(f)
+            result = [np.mean(avg_total_speeds), np.mean(avg_total_stops), np.mean(avg_total_waits)]
+            result = [*result, result[0]]
+            data.append(result)
 
-#             avg_speed = np.mean([np.mean(speeds[x]) for x in speeds.keys()])
-#             var_speed = np.std(([np.mean(speeds[x]) for x in speeds.keys()]))
+            if vote == vote_uniform_3:
+                name = "Prop S+W"
+            elif vote == ['both']:
+                if folder == 'both_lin_combo_test':
+                    name = "Linear comb."
+                elif folder == 'both_cobb_doug_test':
+                    name = "Cobb Doug"
 
-#             with open(stops_path, "rb") as f:
-#                 stops = pickle.load(f)
+            names.append(name)
 
-#             avg_stops = np.mean([np.mean(stops[x]) for x in stops.keys()])
-#             var_stops = np.std(([np.mean(stops[x]) for x in stops.keys()]))
+        key = f"{'_'.join(map(str,traffic))}"
+        all_data.update({key:data})
+        all_names.update({key:names})
 
-#             with open(wait_path, "rb") as f:
-#                 wait = pickle.load(f)
+    plt.rcParams.update({'font.size': 12})
+    b1,b2, b3 = 0,0,0
 
-#             wait = {k:v if v else [0] for k,v in wait.items()}
+    for label, traffic in traffic_dict.items():
 
-#             avg_wait = np.mean([np.mean(wait[x]) for x in wait.keys()])
-#             var_wait = np.std(([np.mean(wait[x]) for x in wait.keys()]))
+        _labels = [f"{'_'.join(map(str,traffic))}"]
 
-#             avg_total_waits.append(avg_wait)
-#             avg_total_stops.append(avg_stops)
-#             avg_total_speeds.append(avg_speed)
+        b1 = max(b1, max([x[0] for ll in _labels for x in all_data[ll] ]))
+        b2 = max(b2, max([x[1] for ll in _labels for x in all_data[ll] ]))
+        b3 = max(b3, max([x[2] for ll in _labels for x in all_data[ll] ]))
+    ranges = [(0, b1),
+                (b2, 0),
+                (b3, 0)]
 
-#         result = [np.mean(avg_total_speeds), np.mean(avg_total_stops), np.mean(avg_total_waits)]
-#         result = [*result, result[0]]
-#         data.append(result)
+    # for key, data in all_data.items():
+    for label, traffic in traffic_dict.items():
+        _labels = f"{'_'.join(map(str,traffic))}"
 
-#         if vote == vote_uniform_3:
-#             name = "Prop S+W"
-#         elif vote == ['both']:
-#             if folder == 'both_lin_combo_test':
-#                 name = "Linear comb."
-#             elif folder == 'both_cobb_doug_test':
-#                 name = "Cobb Doug"
+        fig1, axes = plt.subplots(1,1, subplot_kw={'projection':'polar'})
 
-#         names.append(name)
+        # for name in ["Prop S+W", "Linear comb.", "Cobb Doug"]:
+        key = f"{'_'.join(map(str,traffic))}"
+        data = all_data[key]
+        names = all_names[key]
 
+        b1 = max([x[0] for x in data ])
+        b2 = max([x[1] for x in data ])
+        b3 = max([x[2] for x in data ])
+        ranges = [(0, b1),
+                    (b2, 0),
+                    (b3, 0)]
 
-#     key = f"{'_'.join(map(str,traffic))}"
-#     all_data.update({key:data})
-#     all_names.update({key:names})
+        save_name = f"../figs/{'_'.join(map(str,traffic))}_appendix.pdf"
+        print(save_name, ranges)
+        print(data)
+        # save_name = f"../figs/figure1.pdf"
 
-#     variables = ('Speed', 'Stops', 'Wait Time')
-#     ranges = [(0, max([x[0] for x in data])), (max([x[1] for x in data]), 0), (max([x[2] for x in data]), 0)]            
-#     # plotting
 
-    
+        variables = ('Speed', 'Stops', 'Wait Time')
+        radar = ComplexRadar(axes, variables, ranges)
 
-# data = {'all_data': all_data, 
-#         'all_names': all_names}
+        for d, name in zip(data, names):
+            radar.plot(d, label=name)
+            radar.fill(d, alpha=0.2)
 
-# with open('data.pickle', 'wb') as f:
-#     pickle.dump(data, f)
+        fig1.legend()
 
-with open('data.pickle', "rb") as f:
-    data = pickle.load(f)
-all_data = data['all_data']
-all_names = data['all_names']
+        # if traffic[0] == 11:
+        #     if traffic[1] == 11:
+        #         axes.set_title("Low Balanced")
+        #     else:
+        #         axes.set_title("Low Unbalanced")
+        # elif traffic[0] == 22:
+        #     if traffic[1] == 22:
+        #         axes.set_title("Medium Balanced")
+        #     else:
+        #         axes.set_title("Medium Unbalanced")
+        # elif traffic[0] == 32:
+        #     if traffic[1] == 32:
+        #         axes.set_title("High Balanced")
+        #     else:
+        #         axes.set_title("High Unbalanced")
+        axes.set_title(' '.join(label))
 
-plt.rcParams.update({'font.size': 12})
-b1,b2, b3 = 0,0,0
 
-for label, traffic in traffic_dict.items():
+        fig1.savefig(save_name, format='pdf', bbox_inches='tight')
 
-    _labels = [f"{'_'.join(map(str,traffic))}"]
+        #####################
 
-    b1 = max(b1, max([x[0] for ll in _labels for x in all_data[ll] ]))
-    b2 = max(b2, max([x[1] for ll in _labels for x in all_data[ll] ]))
-    b3 = max(b3, max([x[2] for ll in _labels for x in all_data[ll] ]))
-ranges = [(0, b1),
-            (b2, 0),
-            (b3, 0)]
-    
-# for key, data in all_data.items():
-for label, traffic in traffic_dict.items():
-    _labels = f"{'_'.join(map(str,traffic))}"
 
-    fig1, axes = plt.subplots(1,1, subplot_kw={'projection':'polar'})
-    
-    # for name in ["Prop S+W", "Linear comb.", "Cobb Doug"]:
-    key = f"{'_'.join(map(str,traffic))}"
-    data = all_data[key]
-    names = all_names[key]
+    #     fig1, axes = plt.subplots(1,1, subplot_kw={'projection':'polar'})
 
-    b1 = max([x[0] for x in data ])
-    b2 = max([x[1] for x in data ])
-    b3 = max([x[2] for x in data ])
-    ranges = [(0, b1),
-                (b2, 0),
-                (b3, 0)]
+    #     radar = ComplexRadar(axes, variables, ranges)
+
+    #     for d, name in zip(data, names):
+    #         radar.plot(d, label=name)
+
+    #         radar.fill(d, alpha=0.2)
+
+
+    #     save_name = f"../figs/{traffic[0]}_{traffic[1]}.pdf"
+    #     # save_name = f"../figs/figure1.pdf"
+    #     fig1.legend()
+
+    #     if traffic[0] == 11:
+    #         if traffic[1] == 11:
+    #             axes.set_title("Low Balanced")
+    #         else:
+    #             axes.set_title("Low Unbalanced")
+    #     elif traffic[0] == 22:
+    #         if traffic[1] == 22:
+    #             axes.set_title("Medium Balanced")
+    #         else:
+    #             axes.set_title("Medium Unbalanced")
+    #     elif traffic[0] == 32:
+    #         if traffic[1] == 32:
+    #             axes.set_title("High Balanced")
+    #         else:
+    #             axes.set_title("High Unbalanced")
 
-    save_name = f"../figs/{'_'.join(map(str,traffic))}_appendix.pdf"
-    print(save_name, ranges)
-    print(data)
-    # save_name = f"../figs/figure1.pdf"
-
-
-    variables = ('Speed', 'Stops', 'Wait Time')
-    radar = ComplexRadar(axes, variables, ranges)
-
-    for d, name in zip(data, names):
-        radar.plot(d, label=name)
-        radar.fill(d, alpha=0.2)
-
-    fig1.legend()
-
-    # if traffic[0] == 11:
-    #     if traffic[1] == 11:
-    #         axes.set_title("Low Balanced")
-    #     else:
-    #         axes.set_title("Low Unbalanced")
-    # elif traffic[0] == 22:
-    #     if traffic[1] == 22:
-    #         axes.set_title("Medium Balanced")
-    #     else:
-    #         axes.set_title("Medium Unbalanced")
-    # elif traffic[0] == 32:
-    #     if traffic[1] == 32:
-    #         axes.set_title("High Balanced")
-    #     else:
-    #         axes.set_title("High Unbalanced")
-    axes.set_title(' '.join(label))
-
-
-    fig1.savefig(save_name, format='pdf', bbox_inches='tight')
-    
-    #####################
-
-    
-#     fig1, axes = plt.subplots(1,1, subplot_kw={'projection':'polar'})
-
-#     radar = ComplexRadar(axes, variables, ranges)
-
-#     for d, name in zip(data, names):
-#         radar.plot(d, label=name)
-
-#         radar.fill(d, alpha=0.2)
-        
-    
-#     save_name = f"../figs/{traffic[0]}_{traffic[1]}.pdf"
-#     # save_name = f"../figs/figure1.pdf"
-#     fig1.legend()
-
-#     if traffic[0] == 11:
-#         if traffic[1] == 11:
-#             axes.set_title("Low Balanced")
-#         else:
-#             axes.set_title("Low Unbalanced")
-#     elif traffic[0] == 22:
-#         if traffic[1] == 22:
-#             axes.set_title("Medium Balanced")
-#         else:
-#             axes.set_title("Medium Unbalanced")
-#     elif traffic[0] == 32:
-#         if traffic[1] == 32:
-#             axes.set_title("High Balanced")
-#         else:
-#             axes.set_title("High Unbalanced")
-
-                    
-        
-#     fig1.savefig(save_name, format='pdf', bbox_inches='tight')
 
 
+    #     fig1.savefig(save_name, format='pdf', bbox_inches='tight')
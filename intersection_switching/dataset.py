@@ -0,0 +1,158 @@
+import os
+import glob
+import time
+import numpy as np
+from run_store import RunStore, write_run_store
+
+CHUNK_SIZE = 10000
+
+
+class TransitionWriter:
+    """
+    Writes the transitions of a run into a dataset directory in chunks of `chunk_size` transitions,
+    every chunk is a run store named <run>_obs<observation size>_<chunk>.npz holding a transitions table
+    (obs, action, rewards with one column per reward component, next_obs, done, agent, episode, time, n_vehs)
+    and the metadata needed to read it on its own, so several runs can write to the same directory,
+    the agents of a network may observe different numbers of lanes, their transitions are chunked by observation size
+    """
+
+    def __init__(self, directory, reward_names, n_actions, chunk_size=CHUNK_SIZE, meta=None):
+        """
+        :param directory: the dataset directory, created if needed
+        :param reward_names: the names of the reward components, e.g. switch_agent.PREFERENCES
+        :param n_actions: the number of actions of the agents
+        :param chunk_size: the number of transitions per chunk
+        :param meta: json serialisable metadata saved with every chunk, e.g. the arguments of the run
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.reward_names = list(reward_names)
+        self.n_actions = n_actions
+        self.chunk_size = chunk_size
+        self.meta = meta or {}
+        self.run = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self._agent_idx = {}
+        self.n_chunks = {} # observation size -> number of chunks written
+        self.count = 0
+        self._buffers = {} # observation size -> buffered transitions
+
+    def _new_buffer(self):
+        return {'obs': [], 'action': [], 'rewards': [], 'next_obs': [], 'done': [],
+                'agent': [], 'episode': [], 'time': [], 'n_vehs': []}
+
+    def add(self, obs, action, rewards, next_obs, done, agent_id, episode=0, time=0, n_vehs=None):
+        """
+        adds a transition
+        :param rewards: the value of every reward component
+        :param n_vehs: the vehicles of each flow of the traffic condition, if fixed
+        """
+        obs_size = len(obs)
+        buffer = self._buffers.setdefault(obs_size, self._new_buffer())
+        buffer['obs'].append(obs)
+        buffer['action'].append(action)
+        buffer['rewards'].append(rewards)
+        buffer['next_obs'].append(next_obs)
+        buffer['done'].append(done)
+        buffer['agent'].append(self._agent_idx.setdefault(agent_id, len(self._agent_idx)))
+        buffer['episode'].append(episode)
+        buffer['time'].append(time)
+        buffer['n_vehs'].append(n_vehs if n_vehs is not None else (-1, -1))
+        if len(buffer['obs']) >= self.chunk_size:
+            self._write_chunk(obs_size)
+
+    def flush(self):
+        """
+        writes the buffered transitions of every observation size as new chunks
+        :returns: the paths of the chunks
+        """
+        return [self._write_chunk(obs_size) for obs_size in list(self._buffers)]
+
+    def _write_chunk(self, obs_size):
+        buffer = self._buffers.pop(obs_size)
+        transitions = {
+            'obs': np.array(buffer['obs'], dtype=np.float32),
+            'action': np.array(buffer['action'], dtype=np.int64),
+            'rewards': np.array(buffer['rewards'], dtype=np.float32).reshape(len(buffer['obs']), -1),
+            'next_obs': np.array(buffer['next_obs'], dtype=np.float32),
+            'done': np.array(buffer['done'], dtype=bool),
+            'agent': np.array(buffer['agent'], dtype=np.int32),
+            'episode': np.array(buffer['episode'], dtype=np.int32),
+            'time': np.array(buffer['time'], dtype=np.int32),
+            'n_vehs': np.array(buffer['n_vehs'], dtype=np.int32),
+        }
+        meta = dict(self.meta, reward_names=self.reward_names, n_actions=self.n_actions, obs_size=obs_size,
+                    agent_ids=list(self._agent_idx), run=self.run)
+        k = self.n_chunks.get(obs_size, 0)
+        path = os.path.join(self.directory, f'{self.run}_obs{obs_size}_{k:05d}.npz')
+        write_run_store(path, {'transitions': transitions}, meta=meta, compress=False)
+        self.n_chunks[obs_size] = k + 1
+        self.count += len(buffer['obs'])
+        return path
+
+    def close(self):
+        self.flush()
+
+
+class TransitionDataset:
+    """
+    Reads the chunks written by TransitionWriter in one or more dataset directories, columns are memory-mapped,
+    only the transitions of one observation size are read, networks have a fixed number of inputs
+    """
+
+    def __init__(self, directories, obs_size=None):
+        """
+        :param directories: the dataset directories
+        :param obs_size: the observation size of the transitions, needed when the chunks hold several sizes
+        """
+        if isinstance(directories, str):
+            directories = [directories]
+        paths = sorted(path for directory in directories for path in glob.glob(os.path.join(directory, '*.npz')))
+        if not paths:
+            raise FileNotFoundError(f'no transition chunks in {directories}')
+        stores = [RunStore(path, mmap=True) for path in paths]
+        sizes = sorted({store.meta['obs_size'] for store in stores})
+        if obs_size is None and len(sizes) == 1:
+            obs_size = sizes[0]
+        self.obs_size = obs_size
+        self.paths = [path for path, store in zip(paths, stores) if store.meta['obs_size'] == obs_size]
+        self.stores = [store for store in stores if store.meta['obs_size'] == obs_size]
+        for store in stores:
+            if store.meta['obs_size'] != obs_size:
+                store.close()
+        if obs_size is None:
+            raise ValueError(f'{directories} hold transitions of the observation sizes {sizes}, select one of them')
+        if not self.stores:
+            raise ValueError(f'no transitions of observation size {obs_size} in {directories}, found sizes {sizes}')
+        self.meta = self.stores[0].meta
+        self.reward_names = self.meta['reward_names']
+        self.n_actions = self.meta['n_actions']
+        for store in self.stores:
+            if store.meta['reward_names'] != self.reward_names or store.meta['n_actions'] != self.n_actions:
+                raise ValueError(f'{store.path} does not match the reward components and actions of {self.paths[0]}')
+
+    def column(self, name):
+        """
+        the column of all chunks, concatenated
+        """
+        return np.concatenate([store.column('transitions', name) for store in self.stores])
+
+    def load(self, columns=('obs', 'action', 'rewards', 'next_obs', 'done')):
+        return {name: self.column(name) for name in columns}
+
+    def rewards(self, weights=None):
+        """
+        the rewards of all transitions, one column per component, or their weighted sum
+        :param weights: dictionary of reward component -> weight, or None for every component
+        """
+        rewards = self.column('rewards')
+        if weights is None:
+            return rewards
+        vector = np.array([weights.get(name, 0.0) for name in self.reward_names], dtype=np.float32)
+        return rewards @ vector
+
+    def __len__(self):
+        return sum(len(store.column('transitions', 'action')) for store in self.stores)
+
+    def close(self):
+        for store in self.stores:
+            store.close()
@@ -1,4 +1,3 @@
-import cityflow
 import numpy as np
 
 class Movement:
@@ -187,6 +186,8 @@ class Lane:
         self.dep_vehs_num = []
         self.arr_vehs_num = []
         self.prev_vehs = set()
+        self.arrived = set() # the vehicles that entered and left the lane in the last step
+        self.departed = set()
         self.speeds = []
 
         self.length = eng.get_lane_length(self.ID)
@@ -204,9 +205,9 @@ class Lane:
         current_vehs = set()
         current_vehs.update(lanes_vehs[self.ID])
 
-        dep_vehs = len(self.prev_vehs - current_vehs)
-        arr_vehs = len(current_vehs - self.prev_vehs)
-        self.dep_vehs_num.append(dep_vehs)
-        self.arr_vehs_num.append(arr_vehs)        
+        self.departed = self.prev_vehs - current_vehs
+        self.arrived = current_vehs - self.prev_vehs
+        self.dep_vehs_num.append(len(self.departed))
+        self.arr_vehs_num.append(len(self.arrived))
         self.prev_vehs = current_vehs
 
@@ -0,0 +1,31 @@
+ENGINES = ('cityflow', 'mock', 'replay')
+
+
+def make_engine(sim_config, engine='cityflow', thread_num=1, trace=None):
+    """
+    creates the simulation engine, cityflow is only imported when it is used so the mock engine runs without it
+    :param sim_config: the path of the cityflow simulation config
+    :param engine: the engine type, cityflow, mock (the in-memory stand-in in engine.mock)
+                   or replay (serves the query results of a recorded trace)
+    :param thread_num: the number of threads used by the engine
+    :param trace: the path of the trace file, recorded for cityflow and mock and read for replay
+    """
+    if engine == 'replay':
+        if trace is None:
+            raise ValueError('the replay engine needs a trace file')
+        from engine.trace import ReplayEngine
+        return ReplayEngine(trace, thread_num=thread_num)
+
+    if engine == 'cityflow':
+        import cityflow
+        eng = cityflow.Engine(sim_config, thread_num=thread_num)
+    elif engine == 'mock':
+        from engine.mock.engine import Engine
+        eng = Engine(sim_config, thread_num=thread_num)
+    else:
+        raise ValueError(f'unknown engine {engine}, expected one of {ENGINES}')
+
+    if trace is not None:
+        from engine.trace import RecordingEngine
+        eng = RecordingEngine(eng, trace, config=sim_config)
+    return eng
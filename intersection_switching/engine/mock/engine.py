@@ -0,0 +1,446 @@
+import os
+import json
+from collections import deque
+import numpy as np
+
+LINK_TYPES = {'turn_right': 1, 'turn_left': 2, 'go_straight': 3}
+STOP_SPEED = 0.1
+
+
+class Engine:
+    """
+    An in-memory stand-in for cityflow.Engine implementing the subset of its api used by the project,
+    it reads the same config, roadnet and flow files and moves vehicles with simple queueing dynamics:
+    vehicles accelerate up to the speed limit, keep a gap of vehicle length + min gap to their leader,
+    and the front vehicle of a lane passes the intersection if its road link is green and the next lane has room
+    lane changes, turning times and replays are not simulated
+    """
+
+    def __init__(self, config_file, thread_num=1):
+        """
+        :param config_file: the path of the cityflow simulation config
+        :param thread_num: accepted for compatibility with cityflow.Engine, the mock engine is single threaded
+        """
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+
+        self.interval = float(config.get('interval', 1.0))
+        self.seed = config.get('seed', 0)
+        self.rl_traffic_light = config.get('rlTrafficLight', True)
+        self.save_replay = config.get('saveReplay', False)
+        self.replay_file = config.get('replayLogFile')
+
+        with open(os.path.join(config['dir'], config['roadnetFile']), 'r') as f:
+            self._init_roadnet(json.load(f))
+        with open(os.path.join(config['dir'], config['flowFile']), 'r') as f:
+            self._init_flows(json.load(f))
+
+        self._rng = np.random.default_rng(self.seed)
+        self.reset()
+
+    def _init_roadnet(self, roadnet):
+        self._road_ids = []
+        self._road_index = {}
+        self._road_lanes = []
+        self._road_start = {}
+        self._road_end = {}
+        lane_ids, lane_length, lane_speed = [], [], []
+
+        for road in roadnet['roads']:
+            idx = len(self._road_ids)
+            self._road_ids.append(road['id'])
+            self._road_index[road['id']] = idx
+            self._road_start[road['id']] = road['startIntersection']
+            self._road_end[road['id']] = road['endIntersection']
+
+            points = np.array([[p['x'], p['y']] for p in road['points']], dtype=float)
+            length = float(np.linalg.norm(np.diff(points, axis=0), axis=1).sum())
+            lanes = []
+            for k, lane in enumerate(road['lanes']):
+                lanes.append(len(lane_ids))
+                lane_ids.append(f"{road['id']}_{k}")
+                lane_length.append(length)
+                lane_speed.append(lane.get('maxSpeed', np.inf))
+            self._road_lanes.append(lanes)
+
+        self._lane_ids = lane_ids
+        self._lane_index = {lane_id: idx for idx, lane_id in enumerate(lane_ids)}
+        self._lane_length = np.array(lane_length, dtype=float)
+        self._lane_max_speed = np.array(lane_speed, dtype=float)
+
+        self._inter_ids = []
+        self._inter_index = {}
+        self._virtual = []
+        self._in_roads = []
+        self._out_roads = []
+        self._lane_links = []
+        self._phases = []
+        self._phase_links = []
+        self._phase_time = []
+        self._links = {}
+        self._lane_next_roads = [set() for _ in lane_ids]
+
+        for inter in roadnet['intersections']:
+            idx = len(self._inter_ids)
+            self._inter_ids.append(inter['id'])
+            self._inter_index[inter['id']] = idx
+            self._virtual.append(inter['virtual'])
+            self._in_roads.append([x for x in inter['roads'] if self._road_end.get(x) == inter['id']])
+            self._out_roads.append([x for x in inter['roads'] if self._road_start.get(x) == inter['id']])
+
+            lane_links = []
+            for link_idx, link in enumerate(inter['roadLinks']):
+                start, end = link['startRoad'], link['endRoad']
+                pairs = [(f"{start}_{x['startLaneIndex']}", f"{end}_{x['endLaneIndex']}") for x in link['laneLinks']]
+                lane_links.append(((start, end), pairs))
+
+                lane_map = {}
+                for in_lane, out_lane in pairs:
+                    lane_map.setdefault(self._lane_index[in_lane], []).append(self._lane_index[out_lane])
+                    self._lane_next_roads[self._lane_index[in_lane]].add(self._road_index[end])
+                self._links.setdefault((self._road_index[start], self._road_index[end]), (idx, link_idx, lane_map))
+            self._lane_links.append(lane_links)
+
+            phases, phase_links, phase_time = [], [], []
+            if not inter['virtual']:
+                for phase in inter['trafficLight']['lightphases']:
+                    links = [inter['roadLinks'][x] for x in phase['availableRoadLinks']]
+                    phases.append(([[x['startRoad'], x['endRoad']] for x in links],
+                                   [LINK_TYPES[x['type']] for x in links]))
+                    phase_links.append(frozenset(phase['availableRoadLinks']))
+                    phase_time.append(phase['time'])
+            self._phases.append(phases)
+            self._phase_links.append(phase_links)
+            self._phase_time.append(phase_time)
+
+    def _init_flows(self, flows):
+        self._flow_routes = []
+        vmax, acc, gap, start, end, interval = [], [], [], [], [], []
+        for flow in flows:
+            vehicle = flow['vehicle']
+            self._flow_routes.append(np.array([self._road_index[x] for x in flow['route']], dtype=np.int64))
+            vmax.append(vehicle['maxSpeed'])
+            acc.append(vehicle['maxPosAcc'])
+            gap.append(vehicle['length'] + vehicle['minGap'])
+            start.append(flow['startTime'])
+            end.append(flow['endTime'] if flow['endTime'] >= 0 else np.inf)
+            interval.append(flow['interval'] if flow['interval'] > 0 else np.inf)
+
+        self._flow_vmax = np.array(vmax, dtype=float)
+        self._flow_acc = np.array(acc, dtype=float)
+        self._flow_gap = np.array(gap, dtype=float)
+        self._flow_start = np.array(start, dtype=float)
+        self._flow_end = np.array(end, dtype=float)
+        self._flow_interval = np.array(interval, dtype=float)
+
+    def reset(self, seed=False):
+        """
+        removes all vehicles and sets the time and traffic lights back to the start of the simulation
+        :param seed: also reset the random generator to the seed of the config
+        """
+        if seed:
+            self._rng = np.random.default_rng(self.seed)
+        self._time = 0.0
+        self._phase = np.zeros(len(self._inter_ids), dtype=np.int64)
+        self._phase_elapsed = np.zeros(len(self._inter_ids), dtype=float)
+        self._green = [None if self._virtual[i] or not self._phase_links[i] else self._phase_links[i][0]
+                       for i in range(len(self._inter_ids))]
+
+        self._next_spawn = self._flow_start.copy()
+        self._spawned = np.zeros(len(self._flow_routes), dtype=np.int64)
+        self._waiting = {}
+
+        self._n_vehs = 0
+        self._v_ids = []
+        self._v_flow = np.zeros(0, dtype=np.int64)
+        self._v_lane = np.zeros(0, dtype=np.int64)
+        self._v_route_pos = np.zeros(0, dtype=np.int64)
+        self._v_pos = np.zeros(0, dtype=float)
+        self._v_speed = np.zeros(0, dtype=float)
+        self._v_enter = np.zeros(0, dtype=float)
+        self._finished = 0
+        self._finished_travel_time = 0.0
+        self._cache = {}
+
+    def set_random_seed(self, seed):
+        self._rng = np.random.default_rng(seed)
+
+    def set_save_replay(self, open):
+        """
+        accepted for compatibility, the mock engine does not write replays
+        """
+        self.save_replay = open
+
+    def set_replay_file(self, replay_file):
+        self.replay_file = replay_file
+
+    def next_step(self):
+        """
+        advances the simulation by one interval: generates the vehicles of the flows, moves the vehicles
+        on the network and inserts the generated vehicles on the first road of their route if there is room
+        """
+        self._time += self.interval
+        if not self.rl_traffic_light:
+            self._advance_lights()
+        self._generate()
+        self._move()
+        self._insert()
+        self._cache = {}
+
+    def _advance_lights(self):
+        for idx, times in enumerate(self._phase_time):
+            if not times:
+                continue
+            self._phase_elapsed[idx] += self.interval
+            if self._phase_elapsed[idx] >= times[self._phase[idx]]:
+                self._phase_elapsed[idx] = 0
+                self._phase[idx] = (self._phase[idx] + 1) % len(times)
+                self._green[idx] = self._phase_links[idx][self._phase[idx]]
+
+    def _generate(self):
+        due = np.flatnonzero((self._next_spawn <= self._time) & (self._next_spawn <= self._flow_end))
+        for flow in due.tolist():
+            while self._next_spawn[flow] <= min(self._time, self._flow_end[flow]):
+                self._add_vehicle(flow, self._next_spawn[flow])
+                self._next_spawn[flow] += self._flow_interval[flow]
+
+    def _add_vehicle(self, flow, time):
+        if self._n_vehs == len(self._v_flow):
+            size = max(64, 2 * self._n_vehs)
+            self._v_flow = np.resize(self._v_flow, size)
+            self._v_lane = np.resize(self._v_lane, size)
+            self._v_route_pos = np.resize(self._v_route_pos, size)
+            self._v_pos = np.resize(self._v_pos, size)
+            self._v_speed = np.resize(self._v_speed, size)
+            self._v_enter = np.resize(self._v_enter, size)
+
+        idx = self._n_vehs
+        self._n_vehs += 1
+        self._v_ids.append(f'flow_{flow}_{self._spawned[flow]}')
+        self._spawned[flow] += 1
+        self._v_flow[idx] = flow
+        self._v_lane[idx] = -1
+        self._v_route_pos[idx] = 0
+        self._v_pos[idx] = 0
+        self._v_speed[idx] = 0
+        self._v_enter[idx] = time
+        self._waiting.setdefault(flow, deque()).append(idx)
+
+    def _rear(self):
+        """
+        the position of the last vehicle on each lane, inf for empty lanes
+        """
+        rear = np.full(len(self._lane_ids), np.inf)
+        active = np.flatnonzero(self._v_lane[:self._n_vehs] >= 0)
+        np.minimum.at(rear, self._v_lane[active], self._v_pos[active])
+        return rear.tolist()
+
+    def _choose_lane(self, candidates, next_road, rear):
+        """
+        chooses the lane with the most room among the candidates, preferring lanes linked to the next road of the route
+        ties are broken randomly
+        :returns: the lane and the position of the last vehicle on it
+        """
+        if next_road >= 0:
+            candidates = [x for x in candidates if next_road in self._lane_next_roads[x]] or candidates
+        room = max(rear[x] for x in candidates)
+        best = [x for x in candidates if rear[x] == room]
+        return best[self._rng.integers(len(best))] if len(best) > 1 else best[0], room
+
+    def _insert(self):
+        if not self._waiting:
+            return
+        rear = self._rear()
+        full = set()
+        for flow, queue in list(self._waiting.items()):
+            route = self._flow_routes[flow]
+            key = (route[0], route[1] if len(route) > 1 else -1)
+            if key in full:
+                continue
+            lane, room = self._choose_lane(self._road_lanes[key[0]], key[1], rear)
+            if room < self._flow_gap[flow]:
+                full.add(key)
+                continue
+            idx = queue.popleft()
+            rear[lane] = 0
+            self._v_lane[idx] = lane
+            self._v_pos[idx] = 0
+            self._v_speed[idx] = min(self._flow_vmax[flow], self._lane_max_speed[lane])
+            if not queue:
+                del self._waiting[flow]
+
+    def _move(self):
+        active = np.flatnonzero(self._v_lane[:self._n_vehs] >= 0)
+        if not len(active):
+            return
+        order = np.lexsort((-self._v_pos[active], self._v_lane[active]))
+        idx = active[order]
+        lane = self._v_lane[idx]
+        pos = self._v_pos[idx]
+        flow = self._v_flow[idx]
+        gap = self._flow_gap[flow]
+        length = self._lane_length[lane]
+
+        vmax = np.minimum(self._flow_vmax[flow], self._lane_max_speed[lane])
+        speed = np.minimum(vmax, self._v_speed[idx] + self._flow_acc[flow] * self.interval)
+        front = np.ones(len(idx), dtype=bool)
+        front[1:] = lane[1:] != lane[:-1]
+        limit = np.full(len(idx), np.inf)
+        limit[1:] = pos[:-1] - gap[1:]
+        limit[front] = np.inf
+        new_pos = np.maximum(pos, np.minimum(pos + speed * self.interval, limit))
+        moved = np.zeros(len(idx))
+        transferred = np.zeros(len(idx), dtype=bool)
+
+        last = np.ones(len(idx), dtype=bool)
+        last[:-1] = lane[:-1] != lane[1:]
+        rear = np.full(len(self._lane_ids), np.inf)
+        rear[lane[last]] = np.minimum(new_pos[last], length[last])
+        rear = rear.tolist()
+
+        for i in np.flatnonzero(front & (new_pos >= length)).tolist():
+            veh = idx[i]
+            route = self._flow_routes[flow[i]]
+            k = self._v_route_pos[veh]
+            if k + 1 >= len(route):
+                self._finished += 1
+                self._finished_travel_time += self._time - self._v_enter[veh]
+                self._v_lane[veh] = -1
+                new_pos[i] = np.nan
+                continue
+
+            link = self._links.get((route[k], route[k + 1]))
+            if link is None: # consecutive roads of the route are not linked, e.g. periodic routes, move the vehicle over
+                candidates = self._road_lanes[route[k + 1]]
+            else:
+                inter, link_idx, lane_map = link
+                green = self._green[inter]
+                if green is not None and link_idx not in green:
+                    new_pos[i] = length[i]
+                    continue
+                candidates = lane_map.get(lane[i]) or sorted(set(x for y in lane_map.values() for x in y))
+
+            next_road = route[k + 2] if k + 2 < len(route) else -1
+            target, room = self._choose_lane(candidates, next_road, rear)
+            if room < gap[i]:
+                new_pos[i] = length[i]
+                continue
+            placed = min(new_pos[i] - length[i], room - gap[i])
+            moved[i] = length[i] - pos[i] + placed
+            transferred[i] = True
+            new_pos[i] = placed
+            rear[target] = placed
+            self._v_lane[veh] = target
+            self._v_route_pos[veh] = k + 1
+
+        on_network = ~np.isnan(new_pos)
+        stayed = on_network & ~transferred
+        moved[stayed] = new_pos[stayed] - pos[stayed]
+        self._v_pos[idx[on_network]] = new_pos[on_network]
+        self._v_speed[idx] = moved / self.interval
+
+    def _active(self):
+        if 'active' not in self._cache:
+            active = np.flatnonzero(self._v_lane[:self._n_vehs] >= 0)
+            order = np.lexsort((-self._v_pos[active], self._v_lane[active]))
+            self._cache['active'] = active[order]
+        return self._cache['active']
+
+    def get_current_time(self):
+        return self._time
+
+    def get_vehicles(self, include_waiting=False):
+        ids = [self._v_ids[x] for x in self._active().tolist()]
+        if include_waiting:
+            ids += [self._v_ids[x] for queue in self._waiting.values() for x in queue]
+        return ids
+
+    def get_vehicle_count(self):
+        return len(self._active())
+
+    def get_vehicle_speed(self):
+        active = self._active()
+        return dict(zip(self.get_vehicles(), self._v_speed[active].tolist()))
+
+    def get_vehicle_distance(self):
+        """
+        returns the distance of each vehicle from the start of its current lane
+        """
+        active = self._active()
+        return dict(zip(self.get_vehicles(), self._v_pos[active].tolist()))
+
+    def get_lane_vehicles(self):
+        """
+        returns the ids of the vehicles on each lane ordered from the front of the lane,
+        the dictionary is shared until the next step and should not be modified
+        """
+        if 'lane_vehicles' not in self._cache:
+            ids = self.get_vehicles()
+            offsets = np.concatenate([[0], np.cumsum(self._lane_counts())]).tolist()
+            self._cache['lane_vehicles'] = {lane_id: ids[offsets[i]:offsets[i+1]]
+                                            for i, lane_id in enumerate(self._lane_ids)}
+        return self._cache['lane_vehicles']
+
+    def _lane_counts(self):
+        return np.bincount(self._v_lane[self._active()], minlength=len(self._lane_ids))
+
+    def get_lane_vehicle_count(self):
+        return dict(zip(self._lane_ids, self._lane_counts().tolist()))
+
+    def get_lane_waiting_vehicle_count(self):
+        active = self._active()
+        waiting = active[self._v_speed[active] < STOP_SPEED]
+        return dict(zip(self._lane_ids, np.bincount(self._v_lane[waiting], minlength=len(self._lane_ids)).tolist()))
+
+    def get_lane_length(self, lane_id):
+        return float(self._lane_length[self._lane_index[lane_id]])
+
+    def get_road_lanes(self, road_id):
+        return [self._lane_ids[x] for x in self._road_lanes[self._road_index[road_id]]]
+
+    def get_road_lanes_length(self, road_id):
+        return [(self._lane_ids[x], float(self._lane_length[x])) for x in self._road_lanes[self._road_index[road_id]]]
+
+    def get_intersection_ids(self):
+        return list(self._inter_ids)
+
+    def is_intersection_virtual(self, intersection_id):
+        return self._virtual[self._inter_index[intersection_id]]
+
+    def get_intersection_in_roads(self, intersection_id):
+        return list(self._in_roads[self._inter_index[intersection_id]])
+
+    def get_intersection_out_roads(self, intersection_id):
+        return list(self._out_roads[self._inter_index[intersection_id]])
+
+    def get_intersection_lane_links(self, intersection_id):
+        """
+        returns a list of ((in_road, out_road), [(in_lane, out_lane), ...]) for every road link of the intersection
+        """
+        return [(roads, list(pairs)) for roads, pairs in self._lane_links[self._inter_index[intersection_id]]]
+
+    def get_intersection_phases(self, intersection_id):
+        """
+        returns a list of ([[in_road, out_road], ...], [type, ...]) for every phase of the intersection,
+        the type of a road link is 1 -> turn right, 2 -> turn left, 3 -> go straight
+        """
+        return [([list(x) for x in moves], list(types)) for moves, types in self._phases[self._inter_index[intersection_id]]]
+
+    def set_tl_phase(self, intersection_id, phase_id):
+        idx = self._inter_index[intersection_id]
+        self._phase[idx] = phase_id
+        self._phase_elapsed[idx] = 0
+        self._green[idx] = self._phase_links[idx][phase_id]
+
+    def get_finished_vehicle_count(self):
+        return self._finished
+
+    def get_average_travel_time(self):
+        """
+        returns the average travel time of the finished vehicles and the vehicles still on the network
+        """
+        active = self._active()
+        n = self._finished + len(active)
+        if not n:
+            return 0
+        return (self._finished_travel_time + (self._time - self._v_enter[active]).sum()) / n
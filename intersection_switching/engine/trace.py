@@ -0,0 +1,212 @@
+import atexit
+import pickle
+import struct
+import zlib
+
+TRACE_VERSION = 1
+
+# query results that do not change during a run, recorded once
+STATIC_QUERIES = ('get_intersection_ids', 'is_intersection_virtual', 'get_intersection_in_roads',
+                  'get_intersection_out_roads', 'get_intersection_lane_links', 'get_intersection_phases',
+                  'get_road_lanes', 'get_road_lanes_length', 'get_lane_length')
+# query results that change with every step, recorded once per step
+DYNAMIC_QUERIES = ('get_vehicles', 'get_vehicle_count', 'get_vehicle_speed', 'get_vehicle_distance',
+                   'get_lane_vehicles', 'get_lane_vehicle_count', 'get_lane_waiting_vehicle_count',
+                   'get_current_time', 'get_average_travel_time', 'get_finished_vehicle_count')
+# calls without results, not checked on replay
+SETTINGS = ('set_random_seed', 'set_save_replay', 'set_replay_file')
+
+_FRAME = struct.Struct('<I')
+
+
+def _key(args, kwargs):
+    return args + tuple(sorted(kwargs.items()))
+
+
+class RecordingEngine:
+    """
+    Wraps a simulation engine and records the results of the queries made between two steps into a trace file,
+    the trace is a sequence of frames, one per step, each frame holds the results of the queries made in the step,
+    the set_tl_phase actions and the static query results first seen in the step
+    frames are pickled and written through a single zlib stream flushed after every frame, so repeated ids across
+    steps compress well and a trace cut short by a crash stays readable up to the last complete frame
+    """
+
+    def __init__(self, eng, path, config=None):
+        """
+        :param eng: the engine to record, cityflow.Engine or engine.mock.engine.Engine
+        :param path: the path of the trace file
+        :param config: the simulation config the engine was created with, saved in the trace header
+        """
+        self.eng = eng
+        self.path = path
+        self._f = open(path, 'wb')
+        self._compressor = zlib.compressobj(level=6)
+        self._static = {}
+        self._write({'version': TRACE_VERSION, 'config': config})
+        self._new_frame('start')
+        atexit.register(self.close)
+
+    def _write(self, obj):
+        chunk = self._compressor.compress(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+        chunk += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self._f.write(_FRAME.pack(len(chunk)))
+        self._f.write(chunk)
+
+    def _new_frame(self, op):
+        self._frame = {'op': op, 'queries': {}, 'actions': [], 'static': {}}
+
+    def _end_frame(self, op):
+        self._write(self._frame)
+        self._new_frame(op)
+
+    def close(self):
+        if not self._f.closed:
+            self._write(self._frame)
+            self._f.close()
+
+    def next_step(self):
+        self.eng.next_step()
+        self._end_frame('next_step')
+
+    def reset(self, *args, **kwargs):
+        self.eng.reset(*args, **kwargs)
+        self._end_frame('reset')
+
+    def set_tl_phase(self, intersection_id, phase_id):
+        self.eng.set_tl_phase(intersection_id, phase_id)
+        self._frame['actions'].append((intersection_id, int(phase_id)))
+
+    def __getattr__(self, name):
+        attr = getattr(self.eng, name)
+        if name in STATIC_QUERIES:
+            def query(*args, **kwargs):
+                key = (name, _key(args, kwargs))
+                if key not in self._static:
+                    self._static[key] = self._frame['static'][key] = attr(*args, **kwargs)
+                return self._static[key]
+        elif name in DYNAMIC_QUERIES:
+            def query(*args, **kwargs):
+                key = (name, _key(args, kwargs))
+                queries = self._frame['queries']
+                if key not in queries:
+                    queries[key] = attr(*args, **kwargs)
+                return queries[key]
+        else:
+            return attr
+        setattr(self, name, query) # later calls skip __getattr__
+        return query
+
+
+def read_trace(path):
+    """
+    Reads the frames of a trace written by RecordingEngine, a partially written last frame is ignored
+    :returns: the header and a generator over the frames
+    """
+    f = open(path, 'rb')
+    decompressor = zlib.decompressobj()
+
+    def frames():
+        with f:
+            while True:
+                size = f.read(_FRAME.size)
+                if len(size) < _FRAME.size:
+                    return
+                size, = _FRAME.unpack(size)
+                chunk = f.read(size)
+                if len(chunk) < size:
+                    return
+                yield pickle.loads(decompressor.decompress(chunk))
+
+    frames = frames()
+    header = next(frames)
+    if header['version'] != TRACE_VERSION:
+        raise ValueError(f"unsupported trace version {header['version']}")
+    return header, frames
+
+
+class ReplayEngine:
+    """
+    Serves the query results of a trace recorded by RecordingEngine without simulating,
+    so the environment, agents and logger can be run and timed on exactly the same traffic
+    the replay is only valid for the recorded actions, a set_tl_phase call that differs from the trace raises a ValueError
+    returned results are shared with the trace and should not be modified
+    """
+
+    def __init__(self, path, thread_num=1, preload=True):
+        """
+        :param path: the path of the trace file
+        :param thread_num: accepted for compatibility with cityflow.Engine
+        :param preload: decompress all frames on creation, so replaying does not include the decompression time
+        """
+        self.path = path
+        self.preload = preload
+        self.rewind()
+
+    def rewind(self):
+        """
+        restarts the replay from the start of the trace
+        """
+        if self.preload and hasattr(self, '_frames'):
+            frames = iter(self._frames)
+        else:
+            self.header, frames = read_trace(self.path)
+            if self.preload:
+                self._frames = list(frames)
+                frames = iter(self._frames)
+        self._iter = frames
+        self._static = {}
+        self._step = 0
+        self._load(next(self._iter), 'start')
+
+    def _load(self, frame, op):
+        if frame['op'] != op:
+            raise ValueError(f"replay diverged at step {self._step}: expected {frame['op']}, got {op}")
+        self._frame = frame
+        self._static.update(frame['static'])
+        self._action_idx = 0
+
+    def _advance(self, op):
+        actions = self._frame['actions']
+        if self._action_idx != len(actions):
+            raise ValueError(f'replay diverged at step {self._step}: recorded actions {actions[self._action_idx:]} '
+                             f'were not applied')
+        try:
+            frame = next(self._iter)
+        except StopIteration:
+            raise ValueError(f'the trace ends at step {self._step}')
+        self._step += 1
+        self._load(frame, op)
+
+    def next_step(self):
+        self._advance('next_step')
+
+    def reset(self, *args, **kwargs):
+        self._advance('reset')
+
+    def set_tl_phase(self, intersection_id, phase_id):
+        actions = self._frame['actions']
+        action = (intersection_id, int(phase_id))
+        if self._action_idx >= len(actions) or actions[self._action_idx] != action:
+            recorded = actions[self._action_idx] if self._action_idx < len(actions) else None
+            raise ValueError(f'replay diverged at step {self._step}: recorded action {recorded}, got {action}')
+        self._action_idx += 1
+
+    def __getattr__(self, name):
+        if name in STATIC_QUERIES:
+            results = lambda: self._static
+        elif name in DYNAMIC_QUERIES:
+            results = lambda: self._frame['queries']
+        elif name in SETTINGS:
+            return lambda *args, **kwargs: None
+        else:
+            raise AttributeError(name)
+
+        def query(*args, **kwargs):
+            key = (name, _key(args, kwargs))
+            try:
+                return results()[key]
+            except KeyError:
+                raise KeyError(f'{name}{key[1]} was not recorded at step {self._step}')
+        setattr(self, name, query) # later calls skip __getattr__
+        return query
@@ -1,19 +1,25 @@
-import cityflow
-
 import numpy as np
 import random
 import os
-import functools
+import heapq
+import itertools
 from utils import flow_creator, config_creator
 from collections import Counter
 
 from engine.cityflow.intersection import Lane
-from gym import utils
+from engine.factory import make_engine
 import gym
-from pettingzoo.utils.env import ParallelEnv, AECEnv
-from pettingzoo.utils import agent_selector
 from agents.vehicle_agent import VehicleAgent
-from agents.switch_agent import SwitchAgent 
+from agents.switch_agent import SwitchAgent, PREFERENCES
+from agents.controller_bank import ControllerBank
+from profiling import PhaseTimer
+from neighbourhood import Neighbourhood
+from replay import ReplayOutput
+from resources import ThreadBudget
+from conditions import parse_condition, demand_features
+from metrics import RunningStats, QuantileSketch, RingBuffer
+
+VOTE_TYPES = ('speed', 'wait', 'stops')
 
 class Environment(gym.Env):
     """
@@ -30,19 +36,20 @@ class Environment(gym.Env):
         :param n_actions: the number of possible actions for the learning agent, corresponds to the number of available phases
         :param n_states: the size of the state space for the learning agent
         """
+        # a traffic conditioned policy observes the demand, its first condition is used until set_traffic is called
+        self.conditioned = args.conditioned
         self.n_vehs = args.n_vehs
+        if self.n_vehs is None and self.conditioned:
+            self.n_vehs = list(parse_condition(args.conditions[0]))
+        self.fixed_num_vehicles = self.n_vehs is not None
+        self.base_config = args.sim_config
+        self.reward_type = reward_type
 
-        if args.n_vehs is not None:
-            print('we are here', args.n_vehs)
-            sim_config = config_creator(os.path.dirname(os.path.abspath(args.sim_config)), n_vehs=args.n_vehs, reward=reward_type)
-            flow_creator(os.path.dirname(os.path.abspath(args.sim_config)), n_vehs=args.n_vehs, reward=reward_type)
-            self.fixed_num_vehicles = True
-        else:
-            self.fixed_num_vehicles = False
-            sim_config = args.sim_config
-
-
-        self.eng = cityflow.Engine(sim_config, thread_num=os.cpu_count())
+        self.sim_config = self._scenario_config(self.n_vehs)
+        self.engine_type = args.engine
+        self.engine_threads = ThreadBudget.from_args(args).engine_threads
+        self.trace = args.trace
+        self.eng = make_engine(self.sim_config, engine=self.engine_type, thread_num=self.engine_threads, trace=self.trace)
         self.ID = ID
         self.num_sim_steps = args.num_sim_steps
         self.update_freq = args.update_freq      # how often to update the network
@@ -54,8 +61,10 @@ class Environment(gym.Env):
         self.eps_update = args.eps_update
 
         self.eps = self.eps_start
-        self.reward_type = reward_type
+        self.timer = PhaseTimer(enabled=args.timers)
+        self.detailed_log = args.detailed_log # keep the full per step and per vehicle series
 
+        self.eng.set_save_replay(False) # replays are only written for the episodes selected by --replay_mode
         self._warmup()
 
         self.time = 0
@@ -83,8 +92,31 @@ class Environment(gym.Env):
         self.agents = list(self.intersections.values())
         self.agent_ids = list(self.intersections.keys())
         self._agents_dict = self.intersections
+        self.controller_bank = ControllerBank(self, plan_dir=os.path.join(
+            os.path.dirname(os.path.abspath(args.sim_config)), 'lights'))
+
+        self.lanes = {}
+
+        for lane_id in self.eng.get_lane_vehicles().keys():
+            self.lanes[lane_id] = Lane(self.eng, ID=lane_id)
+
+        # the pooled features of the k-hop neighbours appended to the observations
+        self.neighbourhood = Neighbourhood(self, args.neighbour_hops) if args.neighbour_hops else None
+        self.neighbour_obs = {}
+        if self.neighbourhood:
+            for agent in self.agents:
+                agent.extend_observation_space(self.neighbourhood.size)
+
+        # the demand of the traffic condition appended to the observations of a conditioned policy
+        self.demand_obs = None
+        if self.conditioned:
+            self.demand_obs = demand_features(self.n_vehs)
+            for agent in self.agents:
+                agent.extend_observation_space(len(self.demand_obs))
 
         n_states = self.agents[0].observation_space.shape[0]
+        self.replay = ReplayOutput(self, mode=args.replay_mode, every=args.replay_every,
+                                   stride=args.replay_stride, format=args.replay_format)
 
         self.observations = {agent_id: np.zeros(n_states) for agent_id in self.agent_ids}
         self.actions = {agent_id: None for agent_id in self.agent_ids}
@@ -99,17 +131,50 @@ class Environment(gym.Env):
         self.mfd_data = []
         self.agent_history = []
 
-        self.lanes = {}
-
-        for lane_id in self.eng.get_lane_vehicles().keys():
-            self.lanes[lane_id] = Lane(self.eng, ID=lane_id)
+        # driver preferences and the votes of the vehicles on the approach lanes of each intersection,
+        # the votes are only tallied when the run votes
+        self.pref_types = ['speed', 'stops', 'wait']
+        self.weights = args.vote_weights
+        self.count_votes = args.mode == 'vote'
+        self._lane_voters = {}
+        for intersection in self.intersections.values():
+            for lane_id, n in Counter(intersection.approach_lanes).items():
+                self._lane_voters.setdefault(lane_id, []).append((intersection, n))
+        self._reset_vote_tallies()
 
         # metrics
-        self.speeds = []
-        self.stops = []
-        self.stops_idx = 0 # start measuring reward from this index
-        self.speeds_idx = 0 # start measuring reward from this index
-        self.waiting_times = []
+        self._reset_metrics()
+        self._reset_schedule()
+
+    def _scenario_config(self, n_vehs):
+        """
+        the simulation config of a number of vehicles per flow, generated in the scenario's cache,
+        the config given by the user if n_vehs is None
+        """
+        if n_vehs is None:
+            return self.base_config
+        scenario_dir = os.path.dirname(os.path.abspath(self.base_config))
+        flow_file = flow_creator(scenario_dir, n_vehs=n_vehs, reward=self.reward_type)
+        return config_creator(scenario_dir, n_vehs=n_vehs, reward=self.reward_type, flow_file=flow_file)
+
+    def set_traffic(self, n_vehs):
+        """
+        switches to another number of vehicles per flow, the engine is recreated from the config of the condition
+        and the demand features of a conditioned policy are updated, takes effect at the next reset
+        :param n_vehs: the number of vehicles of each flow
+        """
+        n_vehs = list(n_vehs)
+        if n_vehs == self.n_vehs:
+            return
+        if self.trace:
+            raise ValueError('the traffic condition cannot change while recording or replaying a trace')
+        self.n_vehs = n_vehs
+        self.fixed_num_vehicles = True
+        self.sim_config = self._scenario_config(n_vehs)
+        self.eng = make_engine(self.sim_config, engine=self.engine_type, thread_num=self.engine_threads)
+        self.eng.set_save_replay(False)
+        if self.conditioned:
+            self.demand_obs = demand_features(n_vehs)
 
     def _warmup(self):
         for _ in range(1000):
@@ -142,91 +207,149 @@ class Environment(gym.Env):
 
     def step(self, actions):
         assert actions is not None
-        self._apply_actions(actions)
+        with self.timer.phase('agents'):
+            self._apply_actions(actions)
         self.sub_steps()
 
-        rewards = self._compute_rewards()
-        observations = self._get_obs()
+        # only the agents due to act observe and are rewarded, as in PettingZoo's parallel API
+        with self.timer.phase('reward'):
+            rewards = self._compute_rewards(self.ready_agents)
+        with self.timer.phase('observation'):
+            observations = self._get_obs(self.ready_agents)
         info = self.infos
-        dones = self._compute_dones()
+        dones = self._compute_dones(self.ready_agents)
+        self.timer.tick()
 
         return observations, rewards, dones, info
 
     def sub_steps(self):
         time_to_act = False
-        self.stops_idx = 0
-        self.speeds_idx = 0
+        timer = self.timer
         while not time_to_act:
-            self.eng.next_step()
-            self.time += 1
-
-            stops = 0
-            self.veh_speeds = self.eng.get_vehicle_speed()
-            self.lane_vehs = self.eng.get_lane_vehicles()
-            self.lanes_count = self.eng.get_lane_vehicle_count()
-
-            # required to track distance of periodic trips
-            for veh_id, speed in self.veh_speeds.items():
+            with timer.phase('engine'):
+                self.eng.next_step()
+                self.time += 1
+
+                self.veh_speeds = self.eng.get_vehicle_speed()
+                self.lane_vehs = self.eng.get_lane_vehicles()
+                self.lanes_count = self.eng.get_lane_vehicle_count()
+                if self.replay.active:
+                    self.replay.step()
+
+            with timer.phase('vehicles'):
+                stops = 0
+                # required to track distance of periodic trips
                 new_vehs = []
-                if veh_id not in self.vehicles:
-                    self.vehicles[veh_id] = VehicleAgent(self, veh_id) # TODO: remove old vehicles
-                    new_vehs.append(veh_id)
-                    self.assign_driver_preferences(new_vehs, self.pref_types, self.weights)
-                self.vehicles[veh_id].distance += speed
-                self.vehicles[veh_id].speeds.append(speed)
-
-            for lane_id, lane in self.lanes.items():
-                lane.update_flow_data(self.eng, self.lane_vehs)
-                lane.update_speeds(self, self.lane_vehs[lane_id], self.veh_speeds)
-
-            for veh_id, speed in self.veh_speeds.items():
-                veh = self.vehicles[veh_id]
-                if speed <= 0.1:
-                    veh.wait += 1
-                    if veh.wait == 1:
-                        stops += 1  # first stop
-                        veh.stops += 1
-                elif speed > 0.1 and veh.wait:
-                    self.waiting_times.append(veh.wait)
-                    veh.wait_times.append(veh.wait)
-                    veh.wait = 0
-            self.speeds.append(np.mean(list(self.veh_speeds.values())))
-            self.stops.append(stops)
-            self.stops_idx += 1
-            self.speeds_idx += 1
+                for veh_id, speed in self.veh_speeds.items():
+                    if veh_id not in self.vehicles:
+                        self.vehicles[veh_id] = VehicleAgent(self, veh_id) # TODO: remove old vehicles
+                        new_vehs.append(veh_id)
+                    self.vehicles[veh_id].add_speed(speed)
+                if new_vehs: # not on the lanes yet, counted when they enter one
+                    self._draw_preferences(new_vehs, self.pref_types, self.weights)
+
+            with timer.phase('lanes'):
+                for lane_id, lane in self.lanes.items():
+                    lane.update_flow_data(self.eng, self.lane_vehs)
+                    lane.update_speeds(self, self.lane_vehs[lane_id], self.veh_speeds)
+                if self.count_votes:
+                    self._update_vote_tallies()
+
+            with timer.phase('stops'):
+                for veh_id, speed in self.veh_speeds.items():
+                    veh = self.vehicles[veh_id]
+                    if speed <= 0.1:
+                        veh.wait += 1
+                        if veh.wait == 1:
+                            stops += 1  # first stop
+                            veh.stops += 1
+                    elif speed > 0.1 and veh.wait:
+                        self.add_wait(veh.wait)
+                        veh.end_wait()
+                speed = np.mean(list(self.veh_speeds.values())) if self.veh_speeds else np.nan
+                self.speed_stats.add(speed)
+                self.stop_stats.add(stops)
+                self.speeds_tail.append(speed)
+                self.stops_tail.append(stops)
+                if self.detailed_log:
+                    self.speeds.append(speed)
+                    self.stops.append(stops)
 
             if self.time % self.update_freq == 0:  # TODO: move outside to training
                 self.eps = max(self.eps-self.eps_decay, self.eps_end)
 
-            for intersection in self.intersections.values():
-                intersection.update()
-                if intersection.time_to_act:
-                    time_to_act = True
+            with timer.phase('agents'):
+                schedule = self._schedule
+                while schedule and schedule[0][0] <= self.time:
+                    _, _, agent_id, event = heapq.heappop(schedule)
+                    if event == 'clear':
+                        self.intersections[agent_id].update()
+                    else:
+                        self.ready_agents.append(agent_id)
+                time_to_act = bool(self.ready_agents)
+
+    def _reset_schedule(self):
+        """
+        every agent decides at the start of an episode, the following decisions and the ends of the clearing phases
+        are kept in a heap of (time, order, agent id, event) so only the due agents are touched
+        """
+        self._schedule = []
+        self._event_order = itertools.count() # events due at the same time are handled in the order they were scheduled
+        self.ready_agents = list(self.agent_ids)
+
+    def _schedule_event(self, time, agent_id, event):
+        heapq.heappush(self._schedule, (time, next(self._event_order), agent_id, event))
 
     def _apply_actions(self, actions):
-        for intersection in self.intersections.values():
-            # lane_vehicles = self.eng.get_lane_vehicles()
-            # votes = []
-            # for lane_id in intersection.approach_lanes:
-            #     for veh_id in lane_vehicles[lane_id]:
-            #         votes.append(self.vehicles[veh_id].get_vote())
-            intersection.apply_action(self.eng, actions[intersection.ID],
+        """
+        applies the actions of the agents due to act, the actions of the other agents are ignored
+        :param actions: dictionary of agent id -> action, holding at least the ready agents
+        """
+        for agent_id in self.ready_agents:
+            intersection = self.intersections[agent_id]
+            intersection.apply_action(self.eng, actions[agent_id],
                                    self.lane_vehs, self.lanes_count)
+            if intersection.action_type == 'update':
+                self._schedule_event(intersection.last_act_time + intersection.clearing_time, agent_id, 'clear')
+            self._schedule_event(intersection.next_act_time, agent_id, 'act')
+        self.ready_agents = []
 
-    def _get_obs(self):
+    def _get_obs(self, agent_ids=None):
+        """
+        :param agent_ids: the agents to observe, all agents by default
+        :returns: dictionary of agent id -> observation of the given agents
+        """
         vehs_distance = self.eng.get_vehicle_distance()
 
-        self.observations = {tl.ID: tl.observe(vehs_distance) for tl in self.intersections.values()}
-        return self.observations
+        if self.neighbourhood:
+            self.neighbour_obs = self.neighbourhood.observe(self.lanes_count)
+        agent_ids = self.agent_ids if agent_ids is None else agent_ids
+        observations = {agent_id: self.intersections[agent_id].observe(vehs_distance) for agent_id in agent_ids}
+        self.observations.update(observations)
+        return observations
 
-    def _compute_dones(self):
-        dones = {ts_id: False for ts_id in self.intersection_ids}
+    def _compute_dones(self, agent_ids=None):
+        agent_ids = self.agent_ids if agent_ids is None else agent_ids
+        dones = {ts_id: False for ts_id in agent_ids}
         dones['__all__'] = self.time > self.num_sim_steps
         return dones
 
-    def _compute_rewards(self):
-        self.rewards = {tl.ID: tl.calculate_reward(self.lanes_count, type=self.reward_type) for tl in self.intersections.values()}
-        return self.rewards
+    def _compute_rewards(self, agent_ids=None):
+        agent_ids = self.agent_ids if agent_ids is None else agent_ids
+        rewards = {agent_id: self.intersections[agent_id].calculate_reward(self.lanes_count, type=self.reward_type)
+                   for agent_id in agent_ids}
+        self.rewards.update(rewards)
+        return rewards
+
+    def reward_components(self, agent_ids):
+        """
+        the reward of every driver preference (switch_agent.PREFERENCES) of the agents, over the same steps as the
+        rewards returned by the last step, whatever the reward type of the run
+        """
+        if self.reward_type == 'multi':
+            return {agent_id: self.rewards[agent_id] for agent_id in agent_ids}
+        return {agent_id: [self.intersections[agent_id].get_reward(type=pref) for pref in PREFERENCES]
+                for agent_id in agent_ids}
 
     def observe(self, agent):
         """
@@ -246,10 +369,11 @@ class Environment(gym.Env):
         self.eng.reset(seed=False)
         self.eng.set_random_seed(seed)
 
+        self.eng.set_save_replay(False) # the warmup is never recorded
         self._warmup()
-        self.eng.set_save_replay(True)
 
         self.time = 0
+        self.replay.begin()
         for agent in self.agents:
             agent.reset()
 
@@ -258,20 +382,42 @@ class Environment(gym.Env):
             lane.dep_vehs_num = []
             lane.arr_vehs_num = []
             lane.prev_vehs = set()
+            lane.arrived = set()
+            lane.departed = set()
 
         self.veh_speeds = self.eng.get_vehicle_speed()
         self.lane_vehs = self.eng.get_lane_vehicles()
         self.lanes_count = self.eng.get_lane_vehicle_count()
-        self.waiting_times = []
-        self.speeds = []
-        self.stops = []
-
+        self._reset_metrics()
+        self._reset_vote_tallies()
+        self._reset_schedule()
 
         obs = self._get_obs()
         info = {}
 
         return obs
 
+    def _reset_metrics(self):
+        """
+        network metrics are kept as streaming statistics, the per step series only with detailed_log
+        the tails hold the per step values the rewards read since the last decision
+        """
+        self.speed_stats = RunningStats() # network mean speed per step
+        self.stop_stats = RunningStats() # new stops per step
+        self.wait_stats = RunningStats() # completed waits
+        self.wait_sketch = QuantileSketch()
+        self.speeds_tail = RingBuffer(max(self.num_sim_steps, 1))
+        self.stops_tail = RingBuffer(max(self.num_sim_steps, 1))
+        self.speeds = [] if self.detailed_log else None
+        self.stops = [] if self.detailed_log else None
+        self.waiting_times = [] if self.detailed_log else None
+
+    def add_wait(self, wait):
+        self.wait_stats.add(wait)
+        self.wait_sketch.add(wait)
+        if self.detailed_log:
+            self.waiting_times.append(wait)
+
     def get_mfd_data(self, time_window=60):
         mfd_detailed = {}
 
@@ -298,21 +444,73 @@ class Environment(gym.Env):
 
         return mfd_detailed
 
-    def vote_drivers(self):
-        votes = {'speed': 0, 'wait': 0, 'stops': 0}
-        # votes = []
-        for intersection in self.intersections.values():
-            lane_vehicles = self.eng.get_lane_vehicles()
-            for lane_id in intersection.approach_lanes:
-                for veh_id in lane_vehicles[lane_id]:
-                    # votes[self.vehicles[veh_id].get_vote()] += 1
-                    votes[self.vehicles[veh_id].preference] += 1
-
-        # return Counter(votes)
-        return votes
+    def vote_drivers(self, per_intersection=False):
+        """
+        returns the votes of the drivers on the approach lanes, as tallied by _update_vote_tallies every step of a
+        run that votes
+        :param per_intersection: if True returns the votes of each intersection keyed by intersection id instead of the global count
+        """
+        if per_intersection:
+            return {intersection.ID: dict(intersection.votes) for intersection in self.intersections.values()}
+        return dict(self.votes)
 
     def assign_driver_preferences(self, vehicle_ids, pref_types, weights):
-        preferences_dict = {id: np.random.choice(pref_types, p=weights) for id in vehicle_ids}
-
-        for veh_id, preference in preferences_dict.items():
+        """
+        assigns preferences to the vehicles in a single draw and recounts the votes, the vehicles may already be on
+        the approach lanes
+        :param vehicle_ids: the ids of the vehicles to assign preferences to
+        :param pref_types: the preference types to choose from
+        :param weights: the probability of each preference type
+        """
+        self._draw_preferences(vehicle_ids, pref_types, weights)
+        if self.count_votes:
+            self._recount_votes()
+
+    def _draw_preferences(self, vehicle_ids, pref_types, weights):
+        vehicle_ids = list(vehicle_ids)
+        preferences = np.random.choice(pref_types, size=len(vehicle_ids), p=weights)
+        for veh_id, preference in zip(vehicle_ids, preferences.tolist()):
             self.vehicles[veh_id].preference = preference
+
+    def _reset_vote_tallies(self):
+        self.votes = dict.fromkeys(VOTE_TYPES, 0)
+        for intersection in self.intersections.values():
+            intersection.votes = dict.fromkeys(VOTE_TYPES, 0)
+        self._voted_vehs = {lane_id: set() for lane_id in self._lane_voters}
+
+    def _recount_votes(self):
+        """
+        counts the votes of the vehicles on the approach lanes from scratch
+        """
+        self._reset_vote_tallies()
+        for lane_id, voters in self._lane_voters.items():
+            self._add_votes(self.lane_vehs[lane_id], self._voted_vehs[lane_id], voters)
+
+    def _update_vote_tallies(self):
+        """
+        updates the vote tallies with the vehicles that entered and left the approach lanes in the last step
+        (Lane.update_flow_data), a lane appearing n times in the approach lanes of an intersection counts its vehicles
+        n times, vehicles without a preference are not counted
+        """
+        for lane_id, voters in self._lane_voters.items():
+            lane = self.lanes[lane_id]
+            if not lane.departed and not lane.arrived:
+                continue
+            voted = self._voted_vehs[lane_id]
+            for veh_id in lane.departed:
+                if veh_id in voted:
+                    voted.discard(veh_id)
+                    self._count_vote(self.vehicles[veh_id].preference, voters, -1)
+            self._add_votes(lane.arrived, voted, voters)
+
+    def _add_votes(self, veh_ids, voted, voters):
+        for veh_id in veh_ids:
+            preference = self.vehicles[veh_id].preference
+            if preference is not None and veh_id not in voted:
+                voted.add(veh_id)
+                self._count_vote(preference, voters, 1)
+
+    def _count_vote(self, preference, voters, sign):
+        for intersection, n in voters:
+            intersection.votes[preference] = intersection.votes.get(preference, 0) + sign*n
+            self.votes[preference] = self.votes.get(preference, 0) + sign*n
@@ -0,0 +1,50 @@
+import numpy as np
+
+
+def segment_lengths(x, y, offsets):
+    """
+    the lengths of the segments of ragged polylines, polyline i has the points x[offsets[i]:offsets[i+1]]
+    :returns: array of len(x) lengths, the length at j is the one of the segment from point j to j+1,
+              it is 0 for the last point of every polyline
+    """
+    lengths = np.zeros(len(x))
+    lengths[:-1] = np.hypot(np.diff(x), np.diff(y))
+    lengths[offsets[1:] - 1] = 0
+    return lengths
+
+
+def polyline_lengths(x, y, offsets):
+    """
+    the total length of every polyline
+    """
+    cumsum = np.concatenate([[0], np.cumsum(segment_lengths(x, y, offsets))])
+    return cumsum[offsets[1:]] - cumsum[offsets[:-1]]
+
+
+def parallel_shift(x, y, offsets, h):
+    """
+    shifts every segment of the polylines by h parallel to itself (to the right of the direction of travel),
+    the shifted polyline is made of the shifted start point of every segment and the shifted end point of the last one
+    :returns: the shifted x and y, with the same offsets
+    """
+    if not h:
+        return np.array(x, dtype=float), np.array(y, dtype=float)
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    # the segment of every point, the last point of a polyline is shifted with the segment ending at it
+    last = np.zeros(len(x), dtype=bool)
+    last[offsets[1:] - 1] = True
+    start = np.arange(len(x)) - last
+    end = start + 1
+
+    theta = np.arctan((x[start] - x[end]) / (y[start] - y[end] + 1e-9))
+    sign = np.where(y[start] < y[end], -1, 1)
+    return x + sign * h * np.cos(theta), y - sign * h * np.sin(theta)
+
+
+def to_linestrings(x, y, offsets):
+    """
+    converts the polylines to shapely LineStrings, shapely is only imported here
+    """
+    from shapely.geometry import LineString
+    points = np.stack([x, y], axis=1)
+    return [LineString(points[offsets[i]:offsets[i+1]]) for i in range(len(offsets) - 1)]
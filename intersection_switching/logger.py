@@ -1,12 +1,13 @@
 import os
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
-import torch
-import random
-import pickle
-import dill
-# from network_parser import get_network
+from collections import deque
+from run_store import Ragged, write_run_store, RUN_STORE
+from stream_log import StreamLog, read_columns, STREAM_LOG
+from metrics import RunningStats
+from conditions import condition_name
+from network_index import load_network_index
+from checkpoint import CheckpointWriter, CHECKPOINT
+from agents.switch_agent import PREFERENCES
 
 class Logger:
     """
@@ -21,17 +22,19 @@ class Logger:
 
         self.args = args
 
-        self.veh_count = []
-        self.travel_time = []
+        # only the latest episode is kept in memory, every episode and decision is appended to the stream log
+        self.veh_count = deque(maxlen=1)
+        self.travel_time = deque(maxlen=1)
         self.losses = []
-        self.plot_rewards = []
-        self.episode_losses = []
-        self.delays = []
-        self.travel_times = []
-
-        self.objective_alignment = []
+        self.plot_rewards = deque(maxlen=1)
+        self.episode_losses = deque(maxlen=1)
+        self.delays = deque(maxlen=1)
+        self.travel_times = deque(maxlen=1)
 
         self.reward = 0
+        # reward type multi logs the mean reward of every head, their units differ
+        self.reward_heads = list(PREFERENCES) if args.reward_type == 'multi' else None
+        self.condition_stats = {} # condition -> measure -> RunningStats over the episodes run with the condition
 
         config_dir, config_file = os.path.split(args.sim_config)
         scenario_name = os.path.basename(config_dir)
@@ -40,6 +43,8 @@ class Logger:
         else: 
             n_vehs = args.n_vehs
         exp_name = f"{n_vehs[0]}_{n_vehs[1]}_{args.reward_type}"
+        if args.conditioned and args.n_vehs is None: # one model for all traffic conditions
+            exp_name = f"conditioned_{args.reward_type}"
 
         if args.load != None or args.load_cluster != None:
             scenario_name += "_load"
@@ -49,6 +54,8 @@ class Logger:
             self.log_path = os.path.join(args.path, exp_name)
         elif args.mode == 'train':
             self.log_path = os.path.join("../saved_models", exp_name)
+        else: # test runs evaluate a model, logged next to the vote runs
+            self.log_path = os.path.join(args.path, f"test_{exp_name}")
 
         head, tail = os.path.split(self.log_path)
         i = 1
@@ -56,26 +63,105 @@ class Logger:
         if args.ID:
             self.log_path = os.path.join(head, f'{tail}({args.ID})')
         else:
+            latest = None
             while os.path.exists(self.log_path):
+                latest = self.log_path
                 self.log_path = os.path.join(head, f'{tail}({i})')
                 i += 1
-        print(f'saving to {self.log_path}')
-        os.makedirs(self.log_path)
+            if latest is not None and self._resumable(latest): # continue the latest run of the experiment
+                self.log_path = latest
+        # only a training run with a checkpoint is continued, others start over
+        self.resuming = self._resumable(self.log_path)
+        print(f'{"resuming" if self.resuming else "saving to"} {self.log_path}')
+        os.makedirs(self.log_path, exist_ok=args.resume)
+        stream_path = os.path.join(self.log_path, STREAM_LOG)
+        if not self.resuming and os.path.exists(stream_path): # a reused --ID directory without a checkpoint
+            os.remove(stream_path)
+        self.stream = StreamLog(stream_path, flush_every=args.log_flush)
+        self.checkpoints = CheckpointWriter() # models and checkpoints are written in the background
+
+    def reward_names(self):
+        """
+        the names of the logged rewards, reward or reward_<head> for every head of reward type multi
+        """
+        if self.reward_heads:
+            return [f'reward_{head}' for head in self.reward_heads]
+        return ['reward']
+
+    def format_reward(self):
+        if self.reward_heads:
+            return ' '.join(f'{head}: {value:.4f}' for head, value in zip(self.reward_heads, self.reward))
+        return f'{self.reward:.4f}'
+
+    def _resumable(self, log_path):
+        return self.args.resume and self.args.mode == 'train' and os.path.exists(os.path.join(log_path, CHECKPOINT))
 
     def log_measures(self, environ):
         """
         Logs measures such as reward, vehicle count, average travel time and q losses, works for learning agents and aggregates over episodes
         :param environ: the environment in which the model was run
         """
-        self.reward = 0
-        for agent in environ.agents:
-            self.reward += np.mean(agent.total_rewards)
+        if self.reward_heads:
+            self.reward = np.zeros(len(self.reward_heads))
+            for agent in environ.agents:
+                self.reward += np.mean(np.reshape(agent.total_rewards, (-1, len(self.reward_heads))), axis=0)
+            self.reward = self.reward.tolist()
+        else:
+            self.reward = 0
+            for agent in environ.agents:
+                self.reward += np.mean(agent.total_rewards)
 
         self.plot_rewards.append(self.reward)
         self.veh_count.append(environ.eng.get_finished_vehicle_count())
         self.travel_time.append(environ.eng.get_average_travel_time())
         self.episode_losses.append(np.mean(self.losses))
 
+        condition = condition_name(environ.n_vehs) if environ.n_vehs else None
+        stats = self.condition_stats.setdefault(condition, {name: RunningStats() for name in
+                                                            self.reward_names() + ['veh_count', 'travel_time']})
+        for name, value in zip(self.reward_names(), np.atleast_1d(self.reward)):
+            stats[name].add(value)
+        stats['veh_count'].add(self.veh_count[-1])
+        stats['travel_time'].add(self.travel_time[-1])
+
+        self.stream.write('episode', episode=self.stream.counts.get('episode', 0), reward=self.reward,
+                          veh_count=self.veh_count[-1], travel_time=self.travel_time[-1],
+                          loss=self.episode_losses[-1], condition=condition)
+        self.stream.flush()
+
+    def state(self):
+        """
+        the series of the logger and the position of the stream log, saved in training checkpoints
+        """
+        return {
+            'series': {name: list(getattr(self, name)) for name in
+                       ('veh_count', 'travel_time', 'plot_rewards', 'episode_losses', 'delays', 'travel_times')},
+            'reward': self.reward,
+            'condition_stats': self.condition_stats,
+            'stream_counts': dict(self.stream.counts),
+            'stream_size': os.path.getsize(self.stream.path),
+        }
+
+    def restore(self, state):
+        """
+        restores a state returned by state, the records appended to the stream log after it was taken are dropped
+        """
+        for name, values in state['series'].items():
+            getattr(self, name).extend(values)
+        self.reward = state['reward']
+        self.condition_stats = state['condition_stats']
+        self.stream.close()
+        os.truncate(self.stream.path, state['stream_size'])
+        self.stream = StreamLog(self.stream.path, flush_every=self.args.log_flush)
+        self.stream.counts = dict(state['stream_counts'])
+
+    def log_decision(self, record):
+        """
+        Logs a per-decision record, e.g. the actions preferred by each objective and the chosen one
+        :param record: dictionary of json serialisable values
+        """
+        self.stream.write('decision', episode=self.stream.counts.get('episode', 0), **record)
+
     def log_mfd(self, environ, time_window=60):
         data = environ.get_mfd_data(time_window=time_window)
         road_dict = {}
@@ -95,99 +181,142 @@ class Logger:
 
         self.mfd = output
 
+    def format_conditions(self):
+        """
+        formats the mean measures of the episodes of every traffic condition as a table
+        """
+        rewards = self.reward_names()
+        lines = [f"{'condition':<12}{'episodes':>9}" + ''.join(f'{name:>14}' for name in rewards) +
+                 f"{'vehicles':>10}{'travel time':>13}"]
+        for condition, stats in self.condition_stats.items():
+            lines.append(f"{str(condition):<12}{stats['veh_count'].count:>9}" +
+                         ''.join(f"{stats[name].mean:>14.4f}" for name in rewards) +
+                         f"{stats['veh_count'].mean:>10.1f}{stats['travel_time'].mean:>13.2f}")
+        return '\n'.join(lines)
+
     def log_delays(self, config, environ):
-        # network, roads, flows = get_network(config)
-        delays = []
-        travel_times = []
-        for veh_id, veh_data in environ.vehicles.items():
-
-            tt = environ.time - veh_data.start_time
-            dist = veh_data.distance
-            delay = (tt - dist/16.67)#/dist # NOTE: maxspeed is hardcoded
-            # delay *= 1000 # convert to secs/km
-            delays.append(delay)
-            travel_times.append(tt)
+        """
+        logs the delay of every vehicle, the time it spent in the network minus the free-flow time of the distance it
+        travelled at the pace of its route (see network_index.NetworkIndex.flow_pace)
+        :param config: the simulation config, the config the environment was created with is used if it has one
+        """
+        index = load_network_index(getattr(environ, 'sim_config', config))
+        veh_ids = list(environ.vehicles)
+        pace = index.flow_pace(veh_ids)
+        travel_times = [environ.time - veh_data.start_time for veh_data in environ.vehicles.values()]
+        distances = np.array([veh_data.distance for veh_data in environ.vehicles.values()], dtype=float)
+        delays = (np.array(travel_times, dtype=float) - distances * pace).tolist()
         self.delays.append(delays)
         self.travel_times.append(travel_times)
+        self.stream.write('delays', episode=self.stream.counts.get('delays', 0),
+                          delays=delays, travel_times=travel_times)
+        self.stream.flush()
         return delays, travel_times
 
     def serialise_data(self, environ, policy=None):
         """
-        Serialises the waiting times data and rewards for the agents as dictionaries with agent ID as a key
+        Serialises the per-vehicle, per-step, per-movement, mfd and per-agent data of the run into a single run store,
+        see run_store.load_run_data for reading it back in the layout of the former pickle files
         """
-        waiting_time_dict = {}
-        reward_dict = {}
-
         self.log_mfd(environ, time_window=60)
 
-        for agent in environ.agents:
-            waiting_time_dict.update({agent.ID: {}})
-            reward_dict.update({agent.ID: agent.total_rewards})
-            for move in agent.movements.values():
-                waiting_time_dict[agent.ID].update(
-                    {move.ID: (move.max_waiting_time, move.waiting_time_list)})
-
-        veh_wait_times = {}
-        veh_speed_hist = {}
-        veh_stops = {}
-        veh_delays = {}
-
-        for i, (veh_id, veh) in enumerate(environ.vehicles.items()):
+        veh_ids = list(environ.vehicles.keys())
+        for veh in environ.vehicles.values():
             if veh.wait: # account for vehicles still waiting at the end of a simulation
-                veh.wait_times.append(veh.wait)
-                veh.wait = 0
-            veh_wait_times[veh_id] = veh.wait_times
-            veh_speed_hist[veh_id] = veh.speeds
-            veh_stops[veh_id] = veh.stops
-            veh_delays[veh_id] = self.delays[-1]
+                veh.end_wait()
+        vehicles = list(environ.vehicles.values())
+
+        tables = {
+            'vehicles': {
+                'id': np.array(veh_ids, dtype=str),
+                'stops': np.array([veh.stops for veh in vehicles], dtype=int),
+                'distance': np.array([veh.distance for veh in vehicles], dtype=float),
+                'delay': np.array(self.delays[-1], dtype=float),
+                'travel_time': np.array(self.travel_times[-1], dtype=float),
+                'mean_speed': np.array([veh.mean_speed for veh in vehicles], dtype=float),
+                'n_waits': np.array([veh.wait_stats.count for veh in vehicles], dtype=int),
+                'mean_wait': np.array([veh.wait_stats.mean for veh in vehicles], dtype=float),
+            },
+            'agents': {
+                'id': np.array([agent.ID for agent in environ.agents], dtype=str),
+            },
+            'agent_history': {
+                'action': np.array(environ.agent_history, dtype=int),
+            },
+        }
+
+        if self.reward_heads: # one column per head
+            rewards = [np.reshape(agent.total_rewards, (-1, len(self.reward_heads))) for agent in environ.agents]
+            for k, head in enumerate(self.reward_heads):
+                tables['agents'][f'rewards_{head}'] = Ragged.from_rows([x[:, k] for x in rewards])
+        else:
+            tables['agents']['rewards'] = Ragged.from_rows([agent.total_rewards for agent in environ.agents])
+
+        if environ.detailed_log:
+            tables['vehicles']['speeds'] = Ragged.from_rows([veh.speeds for veh in vehicles])
+            tables['vehicles']['wait_times'] = Ragged.from_rows([veh.wait_times for veh in vehicles])
+            tables['network'] = {
+                'speeds': np.array(environ.speeds, dtype=float),
+                'stops': np.array(environ.stops, dtype=int),
+            }
+
+        moves = [(agent.ID, move) for agent in environ.agents for move in agent.movements.values()]
+        tables['movements'] = {
+            'agent_id': np.array([agent_id for agent_id, _ in moves], dtype=str),
+            'move_id': np.array([move.ID for _, move in moves], dtype=int),
+            'max_waiting_time': np.array([move.max_waiting_time for _, move in moves], dtype=float),
+            'waiting_times': Ragged.from_rows([move.waiting_time_list for _, move in moves]),
+        }
+
+        self.stream.flush()
+        episodes = read_columns(self.stream.path, 'episode', keys=['reward', 'veh_count', 'travel_time', 'loss'])
+        delays = read_columns(self.stream.path, 'delays', keys=['delays', 'travel_times'])
+        tables['episodes'] = {
+            'reward': np.array(episodes['reward'], dtype=float), # (episodes, heads) with reward type multi
+            'veh_count': np.array(episodes['veh_count'], dtype=int),
+            'travel_time': np.array(episodes['travel_time'], dtype=float),
+            'loss': np.array(episodes['loss'], dtype=float),
+            'delays': Ragged.from_rows(delays['delays']),
+            'travel_times': Ragged.from_rows(delays['travel_times']),
+        }
+
+        if self.mfd:
+            road_ids = list(self.mfd.keys())
+            tables['mfd'] = {
+                'road_id': np.array(road_ids, dtype=str),
+                'speed': np.vstack([self.mfd[x]['speed'] for x in road_ids]),
+                'density': np.vstack([self.mfd[x]['density'] for x in road_ids]),
+            }
+
+        alignment = read_columns(self.stream.path, 'decision')
+        alignment.pop('episode', None)
+        if alignment:
+            tables['alignment'] = {k: np.array([-1 if x is None else x for x in v], dtype=int)
+                                   for k, v in alignment.items()}
+
+        meta = {
+            'args': vars(self.args),
+            'agents_type': environ.agents_type,
+            'num_vehicles': len(veh_ids),
+            'time': environ.time,
+            'detailed_log': environ.detailed_log,
+            'reward_heads': self.reward_heads,
+            'conditions': {str(condition): {name: x.summary() for name, x in stats.items()}
+                           for condition, stats in self.condition_stats.items()},
+            'network': {
+                'speed': environ.speed_stats.summary(),
+                'stops': environ.stop_stats.summary(),
+                'wait': environ.wait_stats.summary(),
+                'wait_quantiles': environ.wait_sketch.summary(),
+            },
+        }
+        write_run_store(os.path.join(self.log_path, RUN_STORE), tables, meta=meta)
 
         if policy:
+            import dill
             with open(os.path.join(self.log_path, "memory.dill"), "wb") as f:
                 dill.dump(policy.memory.memory, f)
-
-        with open(os.path.join(self.log_path, "agent_history.dill"), "wb") as f:
-            pickle.dump(environ.agent_history, f)
-        with open(os.path.join(self.log_path, "waiting_time.pickle"), "wb") as f:
-            pickle.dump(waiting_time_dict, f)
-
-        with open(os.path.join(self.log_path, "veh_speed_hist.pickle"), "wb") as f:
-            pickle.dump(veh_speed_hist, f)
-        with open(os.path.join(self.log_path, "veh_wait_time.pickle"), "wb") as f:
-            pickle.dump(veh_wait_times, f)
-        with open(os.path.join(self.log_path, "veh_stops.pickle"), "wb") as f:
-            pickle.dump(veh_stops, f)
-        with open(os.path.join(self.log_path, "veh_delays.pickle"), "wb") as f:
-            pickle.dump(veh_delays, f)
-
-        with open(os.path.join(self.log_path, "agents_rewards.pickle"), "wb") as f:
-            pickle.dump(reward_dict, f)
-
-        with open(os.path.join(self.log_path, "mfd.pickle"), "wb") as f:
-            pickle.dump(self.mfd, f)
-
-        with open(os.path.join(self.log_path, "stops.pickle"), "wb") as f:
-            pickle.dump(environ.stops, f)
-        with open(os.path.join(self.log_path, "speeds.pickle"), "wb") as f:
-            pickle.dump(environ.speeds, f)
-
-        with open(os.path.join(self.log_path, "delays.pickle"), "wb") as f:
-            pickle.dump(self.delays, f)
-
-        with open(os.path.join(self.log_path, "travel_times.pickle"), "wb") as f:
-            pickle.dump(self.travel_times, f)
-
-        with open(os.path.join(self.log_path, "obj_alignment.pickle"), "wb") as f:
-            pickle.dump(self.objective_alignment, f)        
-            
-        if environ.agents_type in ['learning', 'hybrid', 'presslight', 'policy', 'denflow']:
-            with open(os.path.join(self.log_path, "episode_rewards.pickle"), "wb") as f:
-                pickle.dump(self.plot_rewards, f)
-
-            with open(os.path.join(self.log_path, "episode_veh_count.pickle"), "wb") as f:
-                pickle.dump(self.veh_count, f)
-
-            with open(os.path.join(self.log_path, "episode_travel_time.pickle"), "wb") as f:
-                pickle.dump(self.travel_time, f)
+        self.checkpoints.close()
 
     def save_log_file(self, environ):
         """
@@ -195,6 +324,9 @@ class Logger:
         :param environ: the environment in which the model was run
         """
         log_file = open(self.log_path + "/logs.txt", "w+")
+        episodes = read_columns(self.stream.path, 'episode', keys=['veh_count', 'travel_time'])
+        veh_count = episodes['veh_count']
+        travel_time = episodes['travel_time']
 
         log_file.write(str(self.args.sim_config))
         log_file.write("\n")
@@ -209,11 +341,11 @@ class Logger:
         log_file.write(str(self.args.lr))
         log_file.write("\n")
 
-        log_file.write("mean vehicle count: " + str(np.mean(self.veh_count[self.args.num_episodes-10:])) + " with sd: " + str(np.std(self.veh_count[self.args.num_episodes-10:])) +
-                       "\nmean travel time: " + str(np.mean(self.travel_time[self.args.num_episodes-10:])) +
-                       " with sd: " + str(np.std(self.travel_time[self.args.num_episodes-10:])) +
-                       "\nmax vehicle time: " + str(np.max(self.veh_count)) +
-                       "\nmin travel time: " + str(np.min(self.travel_time))
+        log_file.write("mean vehicle count: " + str(np.mean(veh_count[self.args.num_episodes-10:])) + " with sd: " + str(np.std(veh_count[self.args.num_episodes-10:])) +
+                       "\nmean travel time: " + str(np.mean(travel_time[self.args.num_episodes-10:])) +
+                       " with sd: " + str(np.std(travel_time[self.args.num_episodes-10:])) +
+                       "\nmax vehicle time: " + str(np.max(veh_count)) +
+                       "\nmin travel time: " + str(np.min(travel_time))
                        )
         log_file.write("\n")
         log_file.write("best epoch: " + str(environ.best_epoch))
@@ -237,14 +369,16 @@ class Logger:
 
     def save_models(self, policies, flag):
         """
-        Saves machine learning models (for now just neural networks)
+        Saves machine learning models (for now just neural networks), written in the background by self.checkpoints
         :param environ: the environment in which the model was run
         :param flag: the flag indicating which model to save - throughput based or avg. travel time based
         """
         for policy in policies:
-            policy.save(self.log_path, flag)
+            policy.save(self.log_path, flag, writer=self.checkpoints)
 
     def save_clusters(self, environ):
+        import torch
+        import dill
         if not os.path.isdir(self.log_path + '/cluster_nets'):
             os.mkdir(self.log_path + '/cluster_nets')
         for key, model in zip(environ.cluster_models.model_dict.keys(), environ.cluster_models.model_dict.values()):
@@ -267,6 +401,8 @@ class Logger:
         plots pressure as a function of time, both avg pressure of all intersections and individual pressure
         :param environ: the environment, after some simulation steps
         """
+        import pickle
+        import matplotlib.pyplot as plt
         plot_avg = []
         plot_std = []
         for data in environ.log_pressure:
@@ -0,0 +1,168 @@
+import math
+import numpy as np
+
+
+class RunningStats:
+    """
+    Streaming count, sum, mean, variance, min and max of a series (Welford's algorithm), nan values are skipped
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        if value != value: # nan
+            return
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values):
+            other = RunningStats()
+            other.count = len(values)
+            other.total = float(values.sum())
+            other.mean = float(values.mean())
+            other._m2 = float(((values - other.mean)**2).sum())
+            other.min = float(values.min())
+            other.max = float(values.max())
+            self.merge(other)
+
+    def merge(self, other):
+        """
+        adds the values summarised by another RunningStats (Chan et al. parallel update)
+        """
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self._m2 += other._m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def var(self):
+        return self._m2 / self.count if self.count else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.var)
+
+    def __len__(self):
+        return self.count
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0, 'sum': 0.0, 'mean': math.nan, 'std': math.nan, 'min': math.nan, 'max': math.nan}
+        return {'count': self.count, 'sum': self.total, 'mean': self.mean, 'std': self.std,
+                'min': self.min, 'max': self.max}
+
+
+class QuantileSketch:
+    """
+    A quantile sketch over log spaced buckets of relative width 2*alpha, quantiles are estimated with a relative
+    error below alpha whatever the number of values, values <= min_value (e.g. zero waits) share one bucket
+    """
+
+    def __init__(self, alpha=0.01, min_value=1e-9):
+        self.alpha = alpha
+        self.min_value = min_value
+        self._gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value <= self.min_value:
+            self.zeros += 1
+            return
+        idx = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.zeros += other.zeros
+        for idx, n in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + n
+
+    def quantile(self, q):
+        """
+        returns the estimated q-th quantile, nan if the sketch is empty
+        """
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen > rank:
+                return 2 * self._gamma**idx / (self._gamma + 1)
+        return 2 * self._gamma**max(self.buckets) / (self._gamma + 1)
+
+    def __len__(self):
+        return self.count
+
+    def summary(self, quantiles=(0.5, 0.9, 0.95, 0.99)):
+        output = {'count': self.count, 'mean': self.total / self.count if self.count else math.nan}
+        output.update({f'p{round(q*100)}': self.quantile(q) for q in quantiles})
+        return output
+
+
+class RingBuffer:
+    """
+    A fixed capacity buffer of the latest values of a series, e.g. the per step values since the last decision
+    """
+
+    def __init__(self, capacity, dtype=float):
+        self.capacity = int(capacity)
+        self._data = np.zeros(self.capacity, dtype=dtype)
+        self._next = 0
+        self._size = 0
+
+    def append(self, value):
+        self._data[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def clear(self):
+        self._next = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def tail(self, n):
+        """
+        returns the latest n values in order, or all held values if fewer (at most capacity values are held)
+        """
+        n = min(n, self._size)
+        start = self._next - n
+        if start >= 0:
+            return self._data[start:self._next].copy()
+        return np.concatenate([self._data[start:], self._data[:self._next]])
+
+    def values(self):
+        return self.tail(self._size)
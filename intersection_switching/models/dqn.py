@@ -80,6 +80,18 @@ class DQN:
         return action
 
     def optimize_model(self, gamma=GAMMA, tau=TAU, criterion=None):
+        """Update value parameters using a batch of experience tuples sampled from the replay memory.
+
+        Params
+        =======
+
+        gamma (float): discount factor
+        """
+        if len(self.memory) < self.batch_size:
+            return 0
+        return self.learn(self.memory.sample(), gamma=gamma, tau=tau, criterion=criterion)
+
+    def learn(self, experiences, gamma=GAMMA, tau=TAU, criterion=None):
         """Update value parameters using given batch of experience tuples.
 
         Params
@@ -89,12 +101,10 @@ class DQN:
 
         gamma (float): discount factor
         """
-        if len(self.memory) < self.batch_size:
-            return 0
         if criterion is None:
             criterion = nn.MSELoss()
 
-        states, actions, rewards, next_states, dones = self.memory.sample()
+        states, actions, rewards, next_states, dones = experiences
 
         self.net_local.train()
         self.net_target.eval()
@@ -116,17 +126,24 @@ class DQN:
         self.optimizer.step()
 
         # ------------------- update target network ------------------- #
-        soft_update(self.net_local, self.net_target, TAU)
+        soft_update(self.net_local, self.net_target, tau)
 
         return loss.item()
 
-    def save(self, log_path, flag):
+    def save(self, log_path, flag, writer=None):
+        """
+        :param writer: a checkpoint.CheckpointWriter writing the networks in the background
+        """
         if flag is None:
             prefix = 'reward'
         elif flag:
             prefix = 'throughput'
         else:
             prefix = 'time'
+        if writer is not None:
+            writer.submit(log_path + f'/{prefix}_q_net.pt', self.net_local.state_dict())
+            writer.submit(log_path + f'/{prefix}_target_net.pt', self.net_target.state_dict())
+            return
         torch.save(self.net_local.state_dict(),
                    log_path + f'/{prefix}_q_net.pt')
         torch.save(self.net_target.state_dict(),
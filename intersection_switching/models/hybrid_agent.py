@@ -2,7 +2,6 @@ from models.dqn import DQN, device
 import numpy as np
 import torch
 import random
-import operator
 
 
 class Hybrid(DQN):
@@ -19,21 +18,7 @@ class Hybrid(DQN):
                 action = np.random.choice(self.num_actions)
             else:
                 agent = kwargs.get('agent')
-                time = agent.env.time
-                eng = agent.env.eng
-                agent.update_clear_green_time(time, eng)
-                agent.update_priority_idx(time)
-
-                phases_priority = {}
-                for phase in agent.phases.values():
-                    movements = [
-                        x for x in phase.movements if x not in agent.clearing_phase.movements]
-                    phase_prioirty = 0
-                    for moveID in movements:
-                        phase_prioirty += agent.movements[moveID].priority
-
-                    phases_priority.update({phase.ID: phase_prioirty})
-                action = max(phases_priority.items(), key=operator.itemgetter(1))[0]
+                action = agent.env.controller_bank.act('green_time')[agent.ID]
         else:
             state = state.unsqueeze(0)
             self.net_local.eval()
@@ -0,0 +1,134 @@
+import copy
+import numpy as np
+
+import torch
+import torch.nn as nn
+
+INFERENCE_BACKENDS = ('torch', 'numpy')
+
+
+class InferencePolicy:
+    """
+    Inference-only copy of the network of a trained DQN or MultiHeadDQN, for test and vote runs,
+    the torch backend runs a traced and frozen copy of the network under torch.inference_mode,
+    optionally with dynamic int8 quantization of the linear layers,
+    the numpy backend runs the linear layers as float32 matmuls, faster than torch for these small networks,
+    both take numpy observations and batches of them
+    """
+
+    def __init__(self, net, num_actions, heads=None, backend='torch', quantize=False):
+        """
+        :param net: models.mlp.MLP or models.multihead_dqn.MultiHeadMLP, linear layers with relu in between
+        :param num_actions: the number of actions
+        :param heads: the names of the heads of a MultiHeadMLP, None for an MLP
+        :param backend: torch or numpy
+        :param quantize: quantize the linear layers to int8 (torch backend only)
+        """
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(f'unknown inference backend {backend}, expected one of {INFERENCE_BACKENDS}')
+        if quantize and backend != 'torch':
+            raise ValueError('int8 quantization is only available with the torch backend')
+        self.num_actions = num_actions
+        self.heads = list(heads) if heads else None
+        self.backend = backend
+        self.quantize = quantize
+
+        net = copy.deepcopy(net).cpu().eval()
+        linears = [module for module in net.modules() if isinstance(module, nn.Linear)]
+        self.num_observations = linears[0].in_features
+        if backend == 'numpy':
+            self.weights = [module.weight.detach().numpy().T.astype(np.float32, copy=True) for module in linears]
+            self.biases = [module.bias.detach().numpy().astype(np.float32, copy=True) for module in linears]
+            return
+        if quantize:
+            net = torch.ao.quantization.quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8)
+        with torch.no_grad():
+            example = torch.zeros(1, self.num_observations)
+            self.module = torch.jit.freeze(torch.jit.trace(net, example).eval())
+
+    @classmethod
+    def from_policy(cls, policy, backend='torch', quantize=False):
+        """
+        :param policy: a trained DQN or MultiHeadDQN
+        """
+        return cls(policy.net_local, policy.num_actions, heads=getattr(policy, 'heads', None),
+                   backend=backend, quantize=quantize)
+
+    def _forward(self, states):
+        if self.backend == 'numpy':
+            x = states
+            for weight, bias in zip(self.weights[:-1], self.biases[:-1]):
+                x = np.maximum(x @ weight + bias, 0)
+            return x @ self.weights[-1] + self.biases[-1]
+        with torch.inference_mode():
+            return self.module(torch.from_numpy(states)).numpy()
+
+    def q_values(self, states):
+        """
+        :param states: one observation or a batch of observations
+        :returns: array of (actions) or (heads, actions) for a multi-head network, with a leading batch axis for a batch
+        """
+        states = np.asarray(states, dtype=np.float32)
+        values = self._forward(states.reshape(-1, self.num_observations))
+        if self.heads:
+            values = values.reshape(-1, len(self.heads), self.num_actions)
+        return values[0] if states.ndim == 1 else values
+
+    def act(self, state, epsilon=0, head=None, **kwargs):
+        """
+        epsilon-greedy action as DQN.act and MultiHeadDQN.act, for a numpy or torch observation
+        :param head: the name or index of the head of a multi-head network, a random head by default
+        """
+        if epsilon > np.random.random():
+            return np.random.choice(self.num_actions)
+        if torch.is_tensor(state):
+            state = state.cpu().numpy()
+        values = self.q_values(state)
+        if self.heads:
+            if head is None:
+                head = np.random.randint(len(self.heads))
+            elif not isinstance(head, int):
+                head = self.heads.index(head)
+            values = values[head]
+        if kwargs.get('as_probs'):
+            return values
+        return int(np.argmax(values))
+
+    def act_batch(self, states, head=None):
+        """
+        the greedy actions of a batch of observations in one forward pass
+        :param head: as in act, a random head for every observation by default
+        """
+        values = self.q_values(np.asarray(states, dtype=np.float32).reshape(-1, self.num_observations))
+        if self.heads:
+            if head is None:
+                heads = np.random.randint(len(self.heads), size=len(values))
+            else:
+                heads = np.full(len(values), head if isinstance(head, int) else self.heads.index(head))
+            values = values[np.arange(len(values)), heads]
+        return np.argmax(values, axis=1)
+
+
+def load_inference_policy(path, heads=None, backend='torch', quantize=False):
+    """
+    an InferencePolicy of a network saved by DQN.save or MultiHeadDQN.save, the sizes of the network are read from
+    the shapes of its weights
+    :param heads: the names of the heads of a multi-head network, the driver preferences by default
+    """
+    from models.mlp import MLP
+    from models.multihead_dqn import MultiHeadMLP
+    from agents.switch_agent import PREFERENCES
+
+    state = torch.load(path, map_location=torch.device('cpu'))
+    num_observations = state['fc1.weight'].shape[1]
+    layers = (state['fc1.weight'].shape[0], state['fc2.weight'].shape[0])
+    if 'heads.weight' in state:
+        heads = list(heads or PREFERENCES)
+        num_actions = state['heads.weight'].shape[0] // len(heads)
+        net = MultiHeadMLP(num_observations, num_actions, len(heads), layers=layers)
+    else:
+        heads = None
+        num_actions = state['fc3.weight'].shape[0]
+        net = MLP(num_observations, num_actions, layers=layers)
+    net.load_state_dict(state)
+    return InferencePolicy(net, num_actions, heads=heads, backend=backend, quantize=quantize)
@@ -0,0 +1,170 @@
+import numpy as np
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.optim as optim
+from gym.spaces import Box, Discrete
+from models.dqn import ReplayMemory, soft_update, GAMMA, TAU
+from agents.switch_agent import PREFERENCES
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+class MultiHeadMLP(nn.Module):
+    def __init__(self, num_observations, num_actions, num_heads, seed=42, layers=(128, 64)):
+        """
+        Initialize parameters and build model, the layers of models.mlp.MLP shared by one output layer per head
+        Params
+        =======
+            num_observations (int): Dimension of each state
+            num_actions (int): Dimension of each action
+            num_heads (int): Number of Q-value heads, one per reward
+            seed (int): Random seed
+            layers (tuple): Number of nodes in the hidden layers
+        """
+        super().__init__()
+        self.seed = torch.manual_seed(seed)
+        self.num_heads = num_heads
+        self.num_actions = num_actions
+        self.fc1 = nn.Linear(num_observations, layers[0])
+        self.fc2 = nn.Linear(layers[0], layers[1])
+        self.heads = nn.Linear(layers[1], num_heads * num_actions)
+
+    def forward(self, x):
+        """
+        Build a network that maps state -> action values of every head, of shape (batch, heads, actions)
+        """
+        x = F.relu(self.fc1(x))
+        x = F.relu(self.fc2(x))
+        return self.heads(x).view(-1, self.num_heads, self.num_actions)
+
+
+class MultiHeadDQN:
+    """
+    DQN with one Q-value head per driver preference, trained at once from vectors of the rewards of all preferences,
+    e.g. with --reward_type multi, every head learns the greedy policy of its reward from the shared transitions
+    """
+
+    def __init__(self, observation_space, action_space, heads=PREFERENCES, seed=2, gamma=0.99, lr=5e-4,
+                 epsilon_min=0.05, epsilon_max=1, batch_size=64, buffer_size=5e5,
+                 load=False):
+        num_observations = observation_space.shape[0]
+        if isinstance(action_space, Box):
+            num_actions = action_space.shape[0]
+        elif isinstance(action_space, Discrete):
+            num_actions = action_space.n
+        self.num_observations = num_observations
+        self.num_actions = num_actions
+        self.heads = list(heads)
+        self.gamma = gamma
+        self.epsilon_min = epsilon_min
+        self.epsilon_max = epsilon_max
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+
+        self.net_local = MultiHeadMLP(num_observations, num_actions, len(self.heads), seed=seed).to(device)
+        self.net_target = MultiHeadMLP(num_observations, num_actions, len(self.heads), seed=seed).to(device)
+        self.net_target.load_state_dict(self.net_local.state_dict())
+
+        if load:
+            self.net_local.load_state_dict(torch.load(
+                load, map_location=torch.device('cpu')))
+            self.net_local.eval()
+
+            self.net_target.load_state_dict(torch.load(
+                load, map_location=torch.device('cpu')))
+            self.net_target.eval()
+
+        self.optimizer = optim.Adam(
+            self.net_local.parameters(), lr=lr, amsgrad=True)
+        self.memory = ReplayMemory(batch_size=batch_size)
+        self.step_count = 0
+
+    def q_values(self, states):
+        """
+        the Q-values of every head in one forward pass
+        :param states: tensor of one state or of a batch of states
+        :returns: array of shape (heads, actions), or (batch, heads, actions) for a batch
+        """
+        self.net_local.eval()
+        with torch.no_grad():
+            values = self.net_local(states)
+        self.net_local.train()
+        values = values.cpu().numpy()
+        return values[0] if states.dim() == 1 else values
+
+    def act(self, state, epsilon=0, head=None, **kwargs):
+        """
+        epsilon-greedy action of one head, a random head for every call by default so the replay memory holds
+        transitions of the greedy policies of all heads
+        :param head: the name or index of the head
+        """
+        if epsilon > np.random.random():
+            return np.random.choice(self.num_actions)
+        if head is None:
+            head = np.random.randint(len(self.heads))
+        elif not isinstance(head, int):
+            head = self.heads.index(head)
+        action_probs = torch.from_numpy(self.q_values(state)[head]).unsqueeze(0)
+        if kwargs.get('as_probs'):
+            return action_probs
+        return action_probs.max(1)[1].item()
+
+    def optimize_model(self, gamma=GAMMA, tau=TAU, criterion=None):
+        """
+        Update value parameters using a batch of (s, a, r, s', done) with one reward per head from the replay memory
+        """
+        if len(self.memory) < self.batch_size:
+            return 0
+        return self.learn(self.memory.sample(), gamma=gamma, tau=tau, criterion=criterion)
+
+    def learn(self, experiences, gamma=GAMMA, tau=TAU, criterion=None):
+        """
+        Update value parameters using a batch of (s, a, r, s', done), rewards of shape (batch, heads)
+        """
+        if criterion is None:
+            criterion = nn.MSELoss()
+
+        states, actions, rewards, next_states, dones = experiences
+
+        self.net_local.train()
+        self.net_target.eval()
+
+        # the Q-value of the taken action in every head, (batch, heads)
+        index = actions.view(-1, 1, 1).expand(-1, len(self.heads), 1)
+        predicted_targets = self.net_local(states).gather(2, index).squeeze(2)
+
+        with torch.no_grad():
+            labels_next = self.net_target(next_states).max(2)[0]
+
+        labels = rewards + (gamma * labels_next * ~dones)
+
+        loss = criterion(predicted_targets, labels).to(device)
+        self.optimizer.zero_grad()
+        loss.backward()
+
+        self.optimizer.step()
+
+        soft_update(self.net_local, self.net_target, tau)
+
+        return loss.item()
+
+    def save(self, log_path, flag, writer=None):
+        """
+        :param writer: a checkpoint.CheckpointWriter writing the networks in the background
+        """
+        if flag is None:
+            prefix = 'reward'
+        elif flag:
+            prefix = 'throughput'
+        else:
+            prefix = 'time'
+        if writer is not None:
+            writer.submit(log_path + f'/{prefix}_q_net.pt', self.net_local.state_dict())
+            writer.submit(log_path + f'/{prefix}_target_net.pt', self.net_target.state_dict())
+            return
+        torch.save(self.net_local.state_dict(),
+                   log_path + f'/{prefix}_q_net.pt')
+        torch.save(self.net_target.state_dict(),
+                   log_path + f'/{prefix}_target_net.pt')
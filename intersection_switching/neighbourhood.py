@@ -0,0 +1,127 @@
+import numpy as np
+from network_index import load_network_index
+
+VEHLENGTH = 5 # meters, hardcoded as in the agents' observations
+N_FEATURES = 4 # mean and max approach lane density, green share of the approach lanes, clearing phase
+
+
+def csr(rows):
+    """
+    :param rows: list of lists of column indices
+    :returns: the row offsets and column indices of the rows in compressed sparse rows
+    """
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in rows], out=offsets[1:])
+    indices = np.array([x for row in rows for x in row], dtype=np.int64)
+    return offsets, indices
+
+
+def k_hop_rings(adjacency, hops):
+    """
+    the nodes at exactly 1, 2, ..., hops hops from every node, found by a breadth first search from every node once
+    :param adjacency: list of sets of neighbour indices
+    :returns: list of one CSR (offsets, indices) per hop
+    """
+    rings = [[] for _ in range(hops)]
+    for node in range(len(adjacency)):
+        seen = {node}
+        frontier = [node]
+        for hop in range(hops):
+            frontier = sorted({x for y in frontier for x in adjacency[y]} - seen)
+            seen.update(frontier)
+            rings[hop].append(frontier)
+    return [csr(ring) for ring in rings]
+
+
+def mean_pool(values, offsets, indices):
+    """
+    averages the rows of values gathered by every CSR row, empty rows are zero
+    """
+    output = np.zeros((len(offsets) - 1,) + values.shape[1:])
+    lengths = np.diff(offsets)
+    if len(indices):
+        sums = np.add.reduceat(values[indices], offsets[:-1][lengths > 0], axis=0)
+        output[lengths > 0] = sums / lengths[lengths > 0, None]
+    return output
+
+
+class Neighbourhood:
+    """
+    Computes the features of the k-hop neighbours of every agent from one array of lane states per step,
+    the features of every intersection (approach lane densities and the green share of its phase) are mean pooled
+    over the intersections exactly 1, ..., k hops away in the road graph of the network index, so an agent observes
+    hops * N_FEATURES extra values and the cost is linear in the number of lanes and neighbours
+    """
+
+    def __init__(self, env, hops):
+        """
+        :param env: the environment, its agents, lanes and simulation config are used
+        :param hops: the number of hops
+        """
+        self.env = env
+        self.hops = hops
+        self.agents = env.agents
+        agent_idx = {agent.ID: i for i, agent in enumerate(self.agents)}
+
+        # the intersections of the agents are connected by the roads between them, in either direction
+        index = load_network_index(env.sim_config)
+        adjacency = [set() for _ in self.agents]
+        starts = [index.intersection_ids[x] for x in index.roads['start'].tolist()]
+        ends = [index.intersection_ids[x] for x in index.roads['end'].tolist()]
+        for start, end in zip(starts, ends):
+            if start in agent_idx and end in agent_idx and start != end:
+                adjacency[agent_idx[start]].add(agent_idx[end])
+                adjacency[agent_idx[end]].add(agent_idx[start])
+        self.rings = k_hop_rings(adjacency, hops)
+
+        # the approach lanes of every agent as rows into the lane state array
+        self.lane_ids = list(env.lanes)
+        lane_idx = {lane_id: i for i, lane_id in enumerate(self.lane_ids)}
+        approach_lanes = [sorted(agent.in_lanes) for agent in self.agents]
+        self.lane_offsets, self.lane_indices = csr([[lane_idx[x] for x in lanes] for lanes in approach_lanes])
+        self._lane_rows = self.lane_offsets[:-1][np.diff(self.lane_offsets) > 0]
+        self.capacity = np.array([env.lanes[x].length for x in self.lane_ids], dtype=float) / VEHLENGTH
+
+        # the share of the approach lanes every phase gives green
+        self.green_share = []
+        for agent, lanes in zip(self.agents, approach_lanes):
+            shares = {}
+            for phase in agent.phases.values():
+                green = {x for move_id in phase.movements for x in agent.movements[move_id].in_lanes}
+                shares[phase.ID] = len(green.intersection(lanes)) / max(len(lanes), 1)
+            self.green_share.append(shares)
+
+        self.features = np.zeros((len(self.agents), N_FEATURES))
+
+    @property
+    def size(self):
+        return self.hops * N_FEATURES
+
+    def intersection_features(self, lanes_count):
+        """
+        :param lanes_count: dictionary of lane id -> number of vehicles
+        :returns: array of the features of every agent's intersection
+        """
+        counts = np.fromiter((lanes_count.get(x, 0) for x in self.lane_ids), dtype=float, count=len(self.lane_ids))
+        density = counts / self.capacity
+        has_lanes = np.diff(self.lane_offsets) > 0
+        features = self.features
+        features[:] = 0
+        if len(self.lane_indices):
+            lane_density = density[self.lane_indices]
+            features[has_lanes, 0] = np.add.reduceat(lane_density, self._lane_rows) / np.diff(self.lane_offsets)[has_lanes]
+            features[has_lanes, 1] = np.maximum.reduceat(lane_density, self._lane_rows)
+        for i, agent in enumerate(self.agents):
+            clearing = agent.clearing_phase is not None and agent.phase is agent.clearing_phase
+            features[i, 2] = 0.0 if clearing else self.green_share[i].get(agent.phase.ID, 0.0)
+            features[i, 3] = clearing
+        return features
+
+    def observe(self, lanes_count):
+        """
+        computes the neighbourhood observations of all agents
+        :returns: dictionary of agent id -> array of hops * N_FEATURES values, hop 1 first
+        """
+        features = self.intersection_features(lanes_count)
+        observations = np.concatenate([mean_pool(features, offsets, indices) for offsets, indices in self.rings], axis=1)
+        return {agent.ID: observations[i] for i, agent in enumerate(self.agents)}
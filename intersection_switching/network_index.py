@@ -0,0 +1,155 @@
+import os
+import json
+import hashlib
+import numpy as np
+from geometry import polyline_lengths
+from run_store import Ragged, RunStore, write_run_store
+
+INDEX_FILE = 'network_index.npz'
+INDEX_VERSION = 1
+CACHE_DIR = '.cache'
+
+_INDEXES = {}
+
+
+def scenario_files(config):
+    """
+    :param config: the path of a simulation config
+    :returns: the paths of the roadnet and flow files of the config, the config dir is relative to the working directory
+    """
+    with open(config, 'r') as f:
+        config = json.load(f)
+    return os.path.join(config['dir'], config['roadnetFile']), os.path.join(config['dir'], config['flowFile'])
+
+
+def build_network_index(roadnet_file, flow_file):
+    """
+    Converts a roadnet and its flows into arrays, roads, intersections and flows are referred to by their row index
+    :returns: dictionary of table name -> dictionary of column name -> array or Ragged, as written by write_run_store
+    """
+    with open(roadnet_file, 'r') as f:
+        roadnet = json.load(f)
+    with open(flow_file, 'r') as f:
+        flow_data = json.load(f)
+
+    intersections = roadnet['intersections']
+    intersection_idx = {x['id']: i for i, x in enumerate(intersections)}
+    roadnet_roads = roadnet['roads']
+    road_idx = {x['id']: i for i, x in enumerate(roadnet_roads)}
+
+    start = np.array([intersection_idx[x['startIntersection']] for x in roadnet_roads], dtype=np.int64)
+    end = np.array([intersection_idx[x['endIntersection']] for x in roadnet_roads], dtype=np.int64)
+    xs = Ragged.from_rows([[p['x'] for p in x['points']] for x in roadnet_roads])
+    ys = Ragged.from_rows([[p['y'] for p in x['points']] for x in roadnet_roads])
+    length = polyline_lengths(xs.values, ys.values, xs.offsets)
+    max_speed = np.array([x['lanes'][0]['maxSpeed'] for x in roadnet_roads], dtype=float)
+
+    # adjacency in compressed sparse rows, the downstream row of an intersection lists its outgoing roads
+    order = np.argsort(start, kind='stable')
+    out_offsets = np.zeros(len(intersections) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(start, minlength=len(intersections)), out=out_offsets[1:])
+    order_in = np.argsort(end, kind='stable')
+    in_offsets = np.zeros(len(intersections) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(end, minlength=len(intersections)), out=in_offsets[1:])
+
+    routes = Ragged.from_rows([[road_idx[road] for road in flow['route']] for flow in flow_data], dtype=np.int64)
+    veh_max_speed = np.array([flow['vehicle']['maxSpeed'] for flow in flow_data], dtype=float)
+    flow_ids = np.repeat(np.arange(len(flow_data)), routes.lengths())
+    speeds = np.minimum(max_speed[routes.values], veh_max_speed[flow_ids])
+    freeflow_time = Ragged(length[routes.values] / speeds, routes.offsets).sums()
+    route_length = Ragged(length[routes.values], routes.offsets).sums()
+
+    return {
+        'roads': {
+            'id': np.array([x['id'] for x in roadnet_roads], dtype=str),
+            'start': start,
+            'end': end,
+            'num_lanes': np.array([len(x['lanes']) for x in roadnet_roads], dtype=np.int64),
+            'max_speed': max_speed,
+            'length': length,
+            'x': xs,
+            'y': ys,
+        },
+        'intersections': {
+            'id': np.array([x['id'] for x in intersections], dtype=str),
+            'virtual': np.array([x['virtual'] for x in intersections], dtype=bool),
+            'out_roads': Ragged(order, out_offsets),
+            'in_roads': Ragged(order_in, in_offsets),
+        },
+        'flows': {
+            'route': routes,
+            'start_time': np.array([flow['startTime'] for flow in flow_data], dtype=float),
+            'end_time': np.array([flow['endTime'] for flow in flow_data], dtype=float),
+            'interval': np.array([flow['interval'] for flow in flow_data], dtype=float),
+            'max_speed': veh_max_speed,
+            'route_length': route_length,
+            'freeflow_time': freeflow_time,
+        },
+    }
+
+
+def _digest(paths):
+    sha1 = hashlib.sha1(str(INDEX_VERSION).encode())
+    for path in paths:
+        with open(path, 'rb') as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()[:16]
+
+
+def load_network_index(config):
+    """
+    Loads the network index of a simulation config, built on first use and cached beside the scenario in
+    <dir>/.cache/<hash of the roadnet and flow files>/network_index.npz, the columns are memory-mapped
+    indexes are kept open for the lifetime of the process
+    :param config: the path of a simulation config
+    :returns: NetworkIndex
+    """
+    roadnet_file, flow_file = scenario_files(config)
+    key = (os.path.abspath(roadnet_file), os.path.abspath(flow_file))
+    if key not in _INDEXES:
+        path = os.path.join(os.path.dirname(key[0]), CACHE_DIR, _digest(key), INDEX_FILE)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_run_store(path, build_network_index(*key), meta={'roadnet': key[0], 'flow': key[1]},
+                            compress=False)
+        _INDEXES[key] = NetworkIndex(RunStore(path, mmap=True))
+    return _INDEXES[key]
+
+
+class NetworkIndex:
+    """
+    The arrays of a network index, road, intersection and flow attributes are columns indexed by their row,
+    e.g. index.roads['length'][index.road_idx['road_1_1_0']]
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.roads = store.table('roads')
+        self.intersections = store.table('intersections')
+        self.flows = store.table('flows')
+        self.road_ids = self.roads['id'].tolist()
+        self.intersection_ids = self.intersections['id'].tolist()
+        self.road_idx = {road_id: i for i, road_id in enumerate(self.road_ids)}
+
+    def road_points(self, i):
+        return np.stack([self.roads['x'][i], self.roads['y'][i]], axis=1)
+
+    def route(self, flow):
+        return [self.road_ids[i] for i in self.flows['route'][flow]]
+
+    def flow_pace(self, veh_ids, default=None):
+        """
+        the free-flow time per meter of the route of each vehicle, vehicle ids are flow_<flow>_<vehicle>
+        :param default: the pace of vehicles not generated by a flow of the index, 1 / the fastest road by default
+        """
+        if default is None:
+            default = 1 / self.roads['max_speed'].max()
+        pace = np.divide(self.flows['freeflow_time'], self.flows['route_length'],
+                         out=np.full(len(self.flows['route_length']), default),
+                         where=self.flows['route_length'] > 0)
+        output = np.full(len(veh_ids), default)
+        for i, veh_id in enumerate(veh_ids):
+            parts = veh_id.split('_')
+            if len(parts) == 3 and parts[0] == 'flow' and parts[1].isdigit() and int(parts[1]) < len(pace):
+                output[i] = pace[int(parts[1])]
+        return output
@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+from dataset import TransitionDataset
+from agents.switch_agent import PREFERENCES
+
+SEED = 2
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="trains a DQN from the transitions written with runner.py --dataset_dir, without the simulator")
+
+    parser.add_argument("--datasets", required=True, type=str, nargs='+',
+                        help="the dataset directories")
+    parser.add_argument("--reward_type", default='stops', type=str, choices=list(PREFERENCES) + ['multi'],
+                        help="the reward component the DQN is trained on, multi trains a multi-head DQN on every component")
+    parser.add_argument("--reward_weights", default=None, type=float, nargs=len(PREFERENCES),
+                        help=f"train a DQN on the weighted sum of the reward components {', '.join(PREFERENCES)} instead")
+    parser.add_argument("--updates", default=100000, type=int,
+                        help="the number of gradient steps")
+    parser.add_argument("--batch_size", default=64, type=int,
+                        help="the size of the mini-batches")
+    parser.add_argument("--lr", default=5e-4, type=float,
+                        help="the learning rate")
+    parser.add_argument("--gamma", default=0.8, type=float,
+                        help="gamma parameter for the DQN")
+    parser.add_argument("--tau", default=1e-3, type=float,
+                        help="the soft update rate of the target network")
+    parser.add_argument("--obs_size", default=None, type=int,
+                        help="train on the transitions of this observation size, needed when the agents of the network observe different numbers of lanes")
+    parser.add_argument("--min_time", default=50, type=int,
+                        help="skip the transitions of the first seconds of every episode, as online training does")
+    parser.add_argument("--load", default=None, type=str,
+                        help="path to the model to start from")
+    parser.add_argument("--out", default=None, type=str,
+                        help="directory of the trained model, ../saved_models/offline_<reward_type> by default")
+    parser.add_argument("--log_every", default=1000, type=int,
+                        help="print the mean loss every n updates")
+    parser.add_argument("--seed", default=SEED, type=int)
+
+    args = parser.parse_args(argv)
+    if args.out is None:
+        name = 'weighted' if args.reward_weights else args.reward_type
+        args.out = os.path.join('../saved_models', f'offline_{name}')
+    return args
+
+
+def load_transitions(args):
+    """
+    the transitions of the datasets with the rewards the model is trained on
+    :returns: dictionary of obs, action, reward, next_obs and done arrays, and the dataset
+    """
+    dataset = TransitionDataset(args.datasets, obs_size=args.obs_size)
+    if args.reward_weights:
+        reward = dataset.rewards(dict(zip(PREFERENCES, args.reward_weights)))[:, None]
+    elif args.reward_type == 'multi':
+        reward = dataset.rewards()
+    else:
+        reward = dataset.rewards({args.reward_type: 1})[:, None]
+    transitions = dataset.load()
+    transitions['reward'] = reward
+    keep = dataset.column('time') > args.min_time
+    return {name: np.ascontiguousarray(values[keep]) for name, values in transitions.items() if name != 'rewards'}, dataset
+
+
+def train(args):
+    import torch
+    from gym.spaces import Box, Discrete
+    from models.dqn import DQN
+    from models.multihead_dqn import MultiHeadDQN
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    transitions, dataset = load_transitions(args)
+    n = len(transitions['action'])
+    if n < args.batch_size:
+        raise ValueError(f'{n} transitions in {args.datasets}, fewer than a batch of {args.batch_size}')
+    print(f"{n} transitions of {len(dataset.paths)} chunks, recorded with {dataset.meta.get('agents_type')} agents on {dataset.meta.get('sim_config')}")
+
+    obs_space = Box(low=-np.inf, high=np.inf, shape=(transitions['obs'].shape[1],))
+    act_space = Discrete(dataset.n_actions)
+    if args.reward_type == 'multi' and not args.reward_weights:
+        policy = MultiHeadDQN(obs_space, act_space, heads=dataset.reward_names, seed=args.seed, lr=args.lr,
+                              batch_size=args.batch_size, load=args.load)
+    else:
+        policy = DQN(obs_space, act_space, seed=args.seed, lr=args.lr, batch_size=args.batch_size, load=args.load)
+
+    states = torch.from_numpy(transitions['obs']).to(device)
+    actions = torch.from_numpy(transitions['action']).view(-1, 1).to(device)
+    rewards = torch.from_numpy(transitions['reward']).to(device)
+    next_states = torch.from_numpy(transitions['next_obs']).to(device)
+    dones = torch.from_numpy(transitions['done']).view(-1, 1).to(device)
+
+    rng = np.random.default_rng(args.seed)
+    losses = []
+    start = time.perf_counter()
+    for update in range(1, args.updates + 1):
+        idx = torch.from_numpy(rng.integers(n, size=args.batch_size)).to(device)
+        batch = (states[idx], actions[idx], rewards[idx], next_states[idx], dones[idx])
+        losses.append(policy.learn(batch, gamma=args.gamma, tau=args.tau))
+        if update % args.log_every == 0:
+            print(f'update {update}\tloss {np.mean(losses[-args.log_every:]):.4f}\t{update / (time.perf_counter() - start):.0f} updates/s')
+
+    os.makedirs(args.out, exist_ok=True)
+    policy.save(args.out, None)
+    np.save(os.path.join(args.out, 'losses.npy'), np.array(losses, dtype=np.float32))
+    with open(os.path.join(args.out, 'offline_train.json'), 'w') as f:
+        json.dump({'args': vars(args), 'transitions': n, 'dataset': dataset.meta}, f, indent=2)
+    dataset.close()
+    print(f'model saved to {args.out}')
+    return policy
+
+
+def main(argv=None):
+    train(parse_args(argv))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
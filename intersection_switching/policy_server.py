@@ -0,0 +1,332 @@
+import os
+import sys
+import stat
+import json
+import socket
+import asyncio
+import argparse
+import numpy as np
+
+DEFAULT_ADDRESS = 'unix:/tmp/intersection_switching_policy.sock'
+SAVED_MODELS = '../saved_models'
+PREFERENCES = ('speed', 'stops', 'wait') # as agents.switch_agent.PREFERENCES, not imported to keep clients light
+
+
+def vote_model_paths(model_name, saved_models=SAVED_MODELS):
+    """
+    the models of vote mode, a multi-head model trained with --reward_type multi if there is one,
+    otherwise one model per preference
+    :param model_name: the vehicles of the flows, e.g. 22_11, or conditioned
+    :returns: dictionary of multi or preference -> path of the target network
+    """
+    multi_path = os.path.join(saved_models, f'{model_name}_multi', 'reward_target_net.pt')
+    if os.path.exists(multi_path):
+        return {'multi': multi_path}
+    return {pref: os.path.join(saved_models, f'{model_name}_{pref}', 'reward_target_net.pt') for pref in PREFERENCES}
+
+
+def parse_address(address):
+    """
+    :param address: unix:<path>, a path, or <host>:<port>
+    :returns: ('unix', path) or ('tcp', (host, port))
+    """
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):]
+    if '/' in address:
+        return 'unix', address
+    host, port = address.rsplit(':', 1)
+    return 'tcp', (host or '127.0.0.1', int(port))
+
+
+def unix_socket_in_use(path):
+    """
+    whether a server accepts connections on the unix socket at path, a socket left by a server that did not shut down
+    refuses them
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+class MicroBatcher:
+    """
+    Collects the observations of the requests to one model arriving within `window` seconds of the first one
+    and computes their Q-values in one forward pass, or as soon as `max_batch` observations are waiting
+    """
+
+    def __init__(self, policy, window=0.002, max_batch=256):
+        self.policy = policy
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.rows = 0
+        self._pending = [] # (observations, future)
+        self._size = 0
+        self._timer = None
+
+    def q_values(self, states):
+        """
+        :param states: array of observations, (batch, observations)
+        :returns: future of their Q-values
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((states, future))
+        self._size += len(states)
+        if self._size >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending, self._size = self._pending, [], 0
+        if not pending:
+            return
+        try:
+            values = self.policy.q_values(np.concatenate([states for states, _ in pending]))
+        except Exception as error:
+            for _, future in pending:
+                future.set_exception(error)
+            return
+        self.batches += 1
+        self.rows += len(values)
+        start = 0
+        for states, future in pending:
+            if not future.cancelled():
+                future.set_result(values[start:start + len(states)])
+            start += len(states)
+
+
+class PolicyServer:
+    """
+    Serves the Q-values and greedy actions of inference policies over json lines, one request per line:
+    {"id": 1, "model": "speed", "obs": [[...], ...], "q_values": false, "head": null} is answered with
+    {"id": 1, "actions": [...]} or {"id": 1, "q_values": [...]}, {"op": "models"} with the models served,
+    a client may send several requests before reading the responses, which carry the id of their request,
+    the requests of all clients are micro-batched per model
+    """
+
+    def __init__(self, policies, window=0.002, max_batch=256):
+        """
+        :param policies: dictionary of model name -> models.inference.InferencePolicy
+        :param window: the seconds a request waits for others to share its forward pass
+        :param max_batch: the number of observations that triggers a forward pass at once
+        """
+        self.policies = policies
+        self.batchers = {name: MicroBatcher(policy, window, max_batch) for name, policy in policies.items()}
+
+    def models(self):
+        return {name: {'heads': policy.heads, 'num_actions': policy.num_actions,
+                       'num_observations': policy.num_observations}
+                for name, policy in self.policies.items()}
+
+    async def answer(self, request):
+        if request.get('op') == 'models':
+            return {'id': request.get('id'), 'models': self.models()}
+        name = request.get('model') or next(iter(self.policies))
+        if name not in self.policies:
+            raise KeyError(f'unknown model {name}, serving {list(self.policies)}')
+        policy = self.policies[name]
+        states = np.asarray(request['obs'], dtype=np.float32).reshape(-1, policy.num_observations)
+        values = await self.batchers[name].q_values(states)
+        if request.get('q_values'):
+            return {'id': request.get('id'), 'q_values': values.tolist()}
+        head = request.get('head')
+        if policy.heads:
+            if head is None:
+                heads = np.random.randint(len(policy.heads), size=len(values))
+            else:
+                heads = np.full(len(values), head if isinstance(head, int) else policy.heads.index(head))
+            values = values[np.arange(len(values)), heads]
+        return {'id': request.get('id'), 'actions': np.argmax(values, axis=1).tolist()}
+
+    async def _respond(self, line, writer, lock):
+        request = None
+        try:
+            request = json.loads(line)
+            response = await self.answer(request)
+        except Exception as error:
+            request_id = request.get('id') if isinstance(request, dict) else None
+            response = {'id': request_id, 'error': f'{type(error).__name__}: {error}'}
+        async with lock:
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+
+    async def handle(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(self._respond(line, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def serve(self, address):
+        kind, target = parse_address(address)
+        if kind == 'unix':
+            if os.path.exists(target):
+                if not stat.S_ISSOCK(os.stat(target).st_mode):
+                    raise FileExistsError(f'{target} exists and is not a socket')
+                if unix_socket_in_use(target):
+                    raise RuntimeError(f'a server is already listening on {address}')
+                os.remove(target) # stale socket
+            server = await asyncio.start_unix_server(self.handle, path=target)
+        else:
+            server = await asyncio.start_server(self.handle, host=target[0], port=target[1])
+        print(f'serving {", ".join(self.policies)} on {address}')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if kind == 'unix' and os.path.exists(target):
+                os.remove(target)
+
+
+class PolicyClient:
+    """
+    Blocking client of a PolicyServer, one connection per process, numpy and json only so evaluation processes
+    do not import torch
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        kind, target = parse_address(address)
+        if kind == 'unix':
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(target)
+        else:
+            self.sock = socket.create_connection(target)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(timeout)
+        self._file = self.sock.makefile('rb')
+        self._next_id = 0
+        self.models = self.request({'op': 'models'})['models']
+
+    def request(self, request):
+        self._next_id += 1
+        request['id'] = self._next_id
+        self.sock.sendall(json.dumps(request).encode() + b'\n')
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('the policy server closed the connection')
+        response = json.loads(line)
+        if 'error' in response:
+            raise RuntimeError(f"policy server: {response['error']}")
+        return response
+
+    def q_values(self, states, model=None):
+        states = np.asarray(states, dtype=np.float32)
+        response = self.request({'model': model, 'obs': states.tolist(), 'q_values': True})
+        values = np.array(response['q_values'], dtype=np.float32)
+        return values[0] if states.ndim == 1 else values
+
+    def act_batch(self, states, model=None, head=None):
+        states = np.asarray(states, dtype=np.float32)
+        return np.array(self.request({'model': model, 'obs': states.tolist(), 'head': head})['actions'])
+
+    def policy(self, model=None):
+        """
+        a view of one served model usable in place of an InferencePolicy in run_exp
+        """
+        return RemotePolicy(self, model or next(iter(self.models)))
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
+
+
+class RemotePolicy:
+    """
+    One model of a PolicyServer with the interface of models.inference.InferencePolicy
+    """
+
+    def __init__(self, client, model):
+        self.client = client
+        self.model = model
+        self.heads = client.models[model]['heads']
+        self.num_actions = client.models[model]['num_actions']
+        self.num_observations = client.models[model]['num_observations']
+
+    def q_values(self, states):
+        return self.client.q_values(states, model=self.model)
+
+    def act(self, state, epsilon=0, head=None, **kwargs):
+        if epsilon > np.random.random():
+            return np.random.choice(self.num_actions)
+        if kwargs.get('as_probs'):
+            values = self.q_values(state)
+            if self.heads:
+                if head is None:
+                    head = np.random.randint(len(self.heads))
+                elif not isinstance(head, int):
+                    head = self.heads.index(head)
+                values = values[head]
+            return values
+        return int(self.act_batch([state], head=head)[0])
+
+    def act_batch(self, states, head=None):
+        return self.client.act_batch(states, model=self.model, head=head)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="serves trained switching policies to local processes, batching their requests")
+
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, type=str,
+                        help="unix:<socket path> or <host>:<port>, e.g. 127.0.0.1:5555")
+    parser.add_argument("--models", default=[], type=str, nargs='+',
+                        help="the models to serve as name=path of a network saved by DQN.save or MultiHeadDQN.save")
+    parser.add_argument("--vote_models", default=None, type=str,
+                        help="also serve the models of vote mode with this name (e.g. 22_11 or conditioned), see vote_model_paths")
+    parser.add_argument("--saved_models", default=SAVED_MODELS, type=str,
+                        help="the directory of the models of --vote_models")
+    parser.add_argument("--window_ms", default=2, type=float,
+                        help="the milliseconds a request waits for others to share its forward pass")
+    parser.add_argument("--max_batch", default=256, type=int,
+                        help="the number of observations that triggers a forward pass at once")
+    parser.add_argument("--inference_backend", default='torch', type=str, choices=('torch', 'numpy'),
+                        help="a frozen torch graph or numpy matmuls")
+    parser.add_argument("--quantize", action='store_true',
+                        help="quantize the linear layers to int8 (torch backend)")
+
+    args = parser.parse_args(argv)
+    if not args.models and not args.vote_models:
+        parser.error('nothing to serve, pass --models or --vote_models')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from models.inference import load_inference_policy
+
+    paths = dict(x.split('=', 1) for x in args.models)
+    if args.vote_models:
+        paths.update(vote_model_paths(args.vote_models, args.saved_models))
+    policies = {name: load_inference_policy(path, backend=args.inference_backend, quantize=args.quantize)
+                for name, path in paths.items()}
+    server = PolicyServer(policies, window=args.window_ms / 1e3, max_batch=args.max_batch)
+    try:
+        asyncio.run(server.serve(args.address))
+    except KeyboardInterrupt:
+        pass
+    for name, batcher in server.batchers.items():
+        print(f'{name}: {batcher.rows} observations in {batcher.batches} forward passes')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
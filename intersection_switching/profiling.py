@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import time
+from contextlib import nullcontext
+from metrics import QuantileSketch
+
+PHASES = ('engine', 'vehicles', 'lanes', 'stops', 'agents', 'observation', 'reward', 'inference', 'replay_insert', 'optimise')
+
+# packages with a noticeable import time, only loaded by the modes that need them
+HEAVY_MODULES = ('torch', 'matplotlib', 'pettingzoo', 'dill', 'shapely', 'cityflow')
+
+_NULL = nullcontext()
+
+
+class _Phase:
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+
+
+class PhaseTimer:
+    """
+    Times the phases of the training/evaluation loop, e.g. engine stepping or policy inference,
+    every timed call is added to a quantile sketch of the current episode, which is merged into the totals by end_episode
+    a disabled timer returns a shared null context so instrumented code costs a method call per phase
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.episode = {}
+        self.totals = {}
+        self.decisions = 0
+        self.total_decisions = 0
+        self._phases = {}
+
+    def phase(self, name):
+        """
+        returns a context manager timing its body as the given phase, e.g. with timer.phase('engine'): ...
+        """
+        if not self.enabled:
+            return _NULL
+        if name not in self._phases:
+            self._phases[name] = _Phase(self, name)
+        return self._phases[name]
+
+    def add(self, name, seconds):
+        if name not in self.episode:
+            self.episode[name] = QuantileSketch(alpha=0.02)
+        self.episode[name].add(seconds)
+
+    def tick(self):
+        """
+        counts a decision, the per decision times are the phase totals divided by the number of decisions
+        """
+        if self.enabled:
+            self.decisions += 1
+
+    def end_episode(self):
+        """
+        merges the sketches of the episode into the totals and starts a new episode
+        :returns: the summary of the episode
+        """
+        summary = self.summary(self.episode, self.decisions)
+        for name, sketch in self.episode.items():
+            self.totals.setdefault(name, QuantileSketch(alpha=0.02)).merge(sketch)
+        self.total_decisions += self.decisions
+        self.episode = {}
+        self.decisions = 0
+        return summary
+
+    @staticmethod
+    def summary(sketches, decisions):
+        output = {}
+        for name in sorted(sketches, key=lambda x: (PHASES.index(x) if x in PHASES else len(PHASES), x)):
+            sketch = sketches[name]
+            output[name] = {
+                'count': sketch.count,
+                'total': sketch.total,
+                'mean': sketch.total / sketch.count,
+                'p50': sketch.quantile(0.5),
+                'p95': sketch.quantile(0.95),
+                'p99': sketch.quantile(0.99),
+                'per_decision': sketch.total / decisions if decisions else 0.0,
+            }
+        return output
+
+    def format(self, summary=None):
+        """
+        formats a summary (by default the one of the current episode) as a table in milliseconds
+        """
+        if summary is None:
+            summary = self.summary(self.episode, self.decisions)
+        total = sum(x['total'] for x in summary.values()) or 1
+        lines = [f"{'phase':<14}{'calls':>8}{'total (s)':>11}{'share':>8}{'ms/dec':>9}{'p50':>9}{'p95':>9}{'p99':>9}"]
+        for name, x in summary.items():
+            lines.append(f"{name:<14}{x['count']:>8}{x['total']:>11.3f}{x['total']/total:>8.1%}"
+                         f"{x['per_decision']*1e3:>9.3f}{x['p50']*1e3:>9.3f}{x['p95']*1e3:>9.3f}{x['p99']*1e3:>9.3f}")
+        return '\n'.join(lines)
+
+    def export(self, path):
+        """
+        writes the summary of all finished episodes to a json file
+        """
+        with open(path, 'w') as f:
+            json.dump({'decisions': self.total_decisions,
+                       'phases': self.summary(self.totals, self.total_decisions)}, f, indent=2)
+
+
+class EpisodeProfiler:
+    """
+    Runs cProfile and tracemalloc between start and stop and saves the results in a run directory:
+    <name>.pstats (load with pstats or snakeviz), <name>_profile.txt and <name>_memory.txt
+    """
+
+    def __init__(self, log_path, name='episode', top=50):
+        """
+        :param log_path: the directory the artifacts are written to, e.g. Logger.log_path
+        :param name: the prefix of the artifact files
+        :param top: the number of functions and allocation sites listed in the text reports
+        """
+        self.log_path = log_path
+        self.name = name
+        self.top = top
+        self.profiler = None
+
+    def start(self):
+        import cProfile
+        import tracemalloc
+        tracemalloc.start()
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop(self):
+        import pstats
+        import tracemalloc
+        self.profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        prefix = os.path.join(self.log_path, self.name)
+        self.profiler.dump_stats(f'{prefix}.pstats')
+        with open(f'{prefix}_profile.txt', 'w') as f:
+            pstats.Stats(self.profiler, stream=f).sort_stats('cumulative').print_stats(self.top)
+        with open(f'{prefix}_memory.txt', 'w') as f:
+            f.write(f'current: {current / 2**20:.1f} MiB, peak: {peak / 2**20:.1f} MiB\n')
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                f.write(f'{stat}\n')
+        self.profiler = None
+        return prefix
+
+
+class StartupProfile:
+    """
+    Records named checkpoints from the start of a script, e.g. imports, argument parsing and setup,
+    for a per module breakdown of the imports run python -X importtime
+    """
+
+    def __init__(self, start=None):
+        """
+        :param start: the time.perf_counter() value the script started at
+        """
+        self.start = time.perf_counter() if start is None else start
+        self.marks = []
+
+    def mark(self, name):
+        self.marks.append((name, time.perf_counter()))
+
+    def format(self):
+        lines = ['startup profile']
+        previous = self.start
+        for name, t in self.marks:
+            lines.append(f'  {name:<14}{(t - previous)*1e3:>10.1f} ms')
+            previous = t
+        lines.append(f"  {'total':<14}{(previous - self.start)*1e3:>10.1f} ms")
+        heavy = [x for x in HEAVY_MODULES if x in sys.modules]
+        lines.append(f"  {len(sys.modules)} modules loaded, heavy: {', '.join(heavy) or 'none'}")
+        return '\n'.join(lines)
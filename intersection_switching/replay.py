@@ -0,0 +1,162 @@
+import os
+import json
+import numpy as np
+from run_store import Ragged, RunStore, write_run_store
+
+REPLAY_MODES = ('off', 'last', 'every')
+REPLAY_FORMATS = ('cityflow', 'compact')
+
+
+class CompactRecorder:
+    """
+    Records the lane and distance of every vehicle and the phase of every agent every `stride` steps,
+    the episode is written as a compressed run store with the tables
+    steps (time, phases, and the vehicle, lane and distance rows of every recorded step), vehicles, lanes and agents,
+    vehicles and lanes are stored as indices into the id tables
+    """
+
+    def __init__(self, path, agent_ids):
+        self.path = path
+        self.agent_ids = list(agent_ids)
+        self.vehicle_idx = {}
+        self.lane_idx = {}
+        self.times = []
+        self.phases = []
+        self.vehicles = []
+        self.lanes = []
+        self.distances = []
+
+    def record(self, env):
+        distance = env.eng.get_vehicle_distance()
+        vehicles = []
+        lanes = []
+        distances = []
+        for lane_id, veh_ids in env.lane_vehs.items():
+            if not veh_ids:
+                continue
+            lane = self.lane_idx.setdefault(lane_id, len(self.lane_idx))
+            for veh_id in veh_ids:
+                vehicles.append(self.vehicle_idx.setdefault(veh_id, len(self.vehicle_idx)))
+                lanes.append(lane)
+                distances.append(distance.get(veh_id, 0))
+        self.times.append(env.time)
+        self.phases.append([env._agents_dict[agent_id].phase.ID for agent_id in self.agent_ids])
+        self.vehicles.append(np.array(vehicles, dtype=np.int32))
+        self.lanes.append(np.array(lanes, dtype=np.int32))
+        self.distances.append(np.array(distances, dtype=np.float32))
+
+    def close(self, meta=None):
+        tables = {
+            'steps': {
+                'time': np.array(self.times, dtype=np.int32),
+                'phases': np.array(self.phases, dtype=np.int16).reshape(len(self.times), len(self.agent_ids)),
+                'vehicle': Ragged.from_rows(self.vehicles, dtype=np.int32),
+                'lane': Ragged.from_rows(self.lanes, dtype=np.int32),
+                'distance': Ragged.from_rows(self.distances, dtype=np.float32),
+            },
+            'vehicles': {'id': np.array(list(self.vehicle_idx), dtype=str)},
+            'lanes': {'id': np.array(list(self.lane_idx), dtype=str)},
+            'agents': {'id': np.array(self.agent_ids, dtype=str)},
+        }
+        return write_run_store(self.path, tables, meta=meta, compress=True)
+
+
+def read_compact_replay(path):
+    """
+    reads a replay written by CompactRecorder
+    :returns: dictionary of table name -> dictionary of column name -> array or Ragged, and the metadata
+    """
+    with RunStore(path) as store:
+        return {table: store.table(table) for table in store.schema}, store.meta
+
+
+class ReplayOutput:
+    """
+    Decides which episodes write a replay and writes it, either CityFlow's own replay for the frontend or
+    a compact recorder, nothing is written in mode off, the last episode is written in mode last and
+    every `every`-th episode (and the last) in mode every, only every `stride`-th simulation step is recorded
+    """
+
+    def __init__(self, env, mode='off', every=10, stride=1, format='cityflow'):
+        """
+        :param env: the environment, its engine and simulation config are used
+        :param mode: off, last or every
+        :param every: the episode interval of mode every
+        :param stride: the number of simulation steps between two recorded steps
+        :param format: cityflow (replay text file read by the CityFlow frontend) or compact
+        """
+        if mode not in REPLAY_MODES:
+            raise ValueError(f'unknown replay mode {mode}, expected one of {REPLAY_MODES}')
+        if format not in REPLAY_FORMATS:
+            raise ValueError(f'unknown replay format {format}, expected one of {REPLAY_FORMATS}')
+        self.env = env
+        self.mode = mode
+        self.every = max(every, 1)
+        self.stride = max(stride, 1)
+        self.format = format
+        with open(env.sim_config, 'r') as f:
+            self.config_dir = os.path.abspath(json.load(f)['dir'])
+        self.active = False
+        self.path = None
+        self.recorder = None
+
+    def records(self, i_episode, num_episodes):
+        if self.mode == 'off':
+            return False
+        if i_episode == num_episodes - 1:
+            return True
+        return self.mode == 'every' and i_episode % self.every == 0
+
+    def start_episode(self, i_episode, num_episodes, log_path):
+        """
+        called before the environment is reset for an episode, selects whether and where the episode is recorded
+        """
+        self.active = self.records(i_episode, num_episodes)
+        if not self.active:
+            self.path = None
+            return
+        name = 'replay_file' if self.mode == 'last' else f'replay_{i_episode}'
+        if self.format == 'cityflow':
+            self.path = os.path.join(log_path, f'{name}.txt')
+            # cityflow resolves the replay file relative to the config dir
+            self.env.eng.set_replay_file(os.path.relpath(os.path.abspath(self.path), self.config_dir))
+        else:
+            self.path = os.path.join(log_path, f'{name}.npz')
+
+    def begin(self):
+        """
+        called once the environment has been reset and warmed up, the warmup is never recorded
+        """
+        if not self.active:
+            return
+        if self.format == 'cityflow':
+            self.env.eng.set_save_replay((self.env.time + 1) % self.stride == 0)
+        else:
+            self.recorder = CompactRecorder(self.path, self.env.agent_ids)
+
+    def step(self):
+        """
+        called after every simulation step
+        """
+        time = self.env.time
+        if self.format == 'cityflow':
+            if self.stride > 1:
+                # cityflow writes a frame at every step while saving is on, it is switched on for the recorded steps
+                self.env.eng.set_save_replay((time + 1) % self.stride == 0)
+        elif time % self.stride == 0:
+            self.recorder.record(self.env)
+
+    def end_episode(self):
+        """
+        stops recording and writes the compact replay
+        :returns: the path of the replay, None if the episode was not recorded
+        """
+        if not self.active:
+            return None
+        self.active = False
+        if self.format == 'cityflow':
+            self.env.eng.set_save_replay(False)
+        else:
+            self.recorder.close(meta={'stride': self.stride})
+            self.recorder = None
+        return self.path
@@ -0,0 +1,94 @@
+import os
+
+CORES_ENV = 'INTERSECTION_CORES'
+_THREAD_ENVS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+def available_cpus():
+    """
+    the cpus the process may run on, all cpus where the affinity cannot be read
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def core_budget(cores=None):
+    """
+    the number of cores of the job, in order: the given number, $INTERSECTION_CORES, $SLURM_CPUS_PER_TASK,
+    or the cpus available to the process, it is never more than the available cpus
+    """
+    available = len(available_cpus())
+    for value in (cores, os.environ.get(CORES_ENV), os.environ.get('SLURM_CPUS_PER_TASK')):
+        if value:
+            return max(1, min(int(value), available))
+    return available
+
+
+class ThreadBudget:
+    """
+    Splits the core budget of a job between the simulation engine threads and the torch intra-op threads,
+    without torch the engine gets every core, with torch the engine gets half unless engine_threads is given and
+    torch the rest, a budget of one core is shared by one engine thread and one torch thread
+    """
+
+    def __init__(self, cores=None, engine_threads=None, uses_torch=True, pin=False, worker=None):
+        """
+        :param cores: the core budget, see core_budget
+        :param engine_threads: the threads of the engine, the remaining cores go to torch, at least one
+        :param uses_torch: whether the job runs networks
+        :param pin: restrict the process to `cores` cpus, the worker-th block of the available cpus
+        :param worker: the index of the job on the node, $SLURM_LOCALID by default
+        """
+        self.cores = core_budget(cores)
+        # with torch the engine leaves at least one core to it, both share the only core of a one core budget
+        max_engine = max(1, self.cores - 1) if uses_torch else self.cores
+        if engine_threads:
+            self.engine_threads = max(1, min(engine_threads, max_engine))
+        elif uses_torch:
+            self.engine_threads = max(1, self.cores // 2)
+        else:
+            self.engine_threads = self.cores
+        self.torch_threads = max(1, self.cores - self.engine_threads) if uses_torch else 0
+        self.shared = self.engine_threads + self.torch_threads > self.cores
+        self.pin = pin
+        self.worker = int(os.environ.get('SLURM_LOCALID', 0)) if worker is None else worker
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(cores=args.cores, engine_threads=args.engine_threads,
+                   uses_torch=(args.agents_type in ['learning'] or args.mode == 'vote') and not (
+                       args.policy_server and args.mode in ['test', 'vote']),
+                   pin=args.pin_cpus, worker=args.worker)
+
+    def cpus(self):
+        """
+        the block of available cpus of this worker, blocks wrap around when there are more workers than blocks
+        """
+        available = available_cpus()
+        start = (self.worker * self.cores) % len(available)
+        return [available[(start + i) % len(available)] for i in range(self.cores)]
+
+    def apply(self):
+        """
+        sets the thread counts of the OpenMP/BLAS pools (before torch is imported) and pins the process if asked
+        """
+        for name in _THREAD_ENVS:
+            os.environ.setdefault(name, str(max(self.torch_threads, 1)))
+        if self.pin and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, self.cpus())
+
+    def apply_torch(self, torch):
+        """
+        sets the intra-op and inter-op threads of torch
+        """
+        torch.set_num_threads(max(self.torch_threads, 1))
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError: # only allowed before torch starts its inter-op pool
+            pass
+
+    def __str__(self):
+        pinned = f", pinned to cpus {self.cpus()}" if self.pin else ''
+        shared = ' sharing the core' if self.shared else ''
+        return f'{self.cores} cores: {self.engine_threads} engine threads, {self.torch_threads} torch threads{shared}{pinned}'
@@ -0,0 +1,275 @@
+import os
+import json
+import pickle
+import struct
+import zipfile
+import numpy as np
+from stream_log import read_stream, read_columns, STREAM_LOG
+
+RUN_STORE = 'run_store.npz'
+META = '__meta__.json'
+FORMAT_VERSION = 1
+
+_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+
+
+class Ragged:
+    """
+    A column of variable length rows stored as one flat values array and row offsets, row i is values[offsets[i]:offsets[i+1]]
+    """
+
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = offsets
+
+    @classmethod
+    def from_rows(cls, rows, dtype=float):
+        lengths = np.fromiter((len(x) for x in rows), dtype=np.int64, count=len(rows))
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        values = np.concatenate([np.asarray(x, dtype=dtype) for x in rows]) if offsets[-1] else np.zeros(0, dtype=dtype)
+        return cls(values, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.values[self.offsets[i]:self.offsets[i+1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def sums(self):
+        """
+        sums every row, empty rows sum to 0
+        """
+        cumsum = np.concatenate([[0], np.cumsum(self.values, dtype=float)])
+        return cumsum[self.offsets[1:]] - cumsum[self.offsets[:-1]]
+
+    def means(self, empty=np.nan):
+        """
+        averages every row, empty rows are set to `empty`
+        """
+        lengths = self.lengths()
+        means = np.full(len(self), empty, dtype=float)
+        np.divide(self.sums(), lengths, out=means, where=lengths > 0)
+        return means
+
+    def tolist(self):
+        return [self[i].tolist() for i in range(len(self))]
+
+
+def write_run_store(path, tables, meta=None, compress=True):
+    """
+    Writes the tables of a run into a single zip container of .npy columns with a json metadata header,
+    the file is written to a temporary path first and moved in place so readers never see a partial store
+    :param path: the path of the store
+    :param tables: dictionary of table name -> dictionary of column name -> array or Ragged
+    :param meta: json serialisable metadata saved in the header
+    :param compress: deflate the columns, uncompressed stores can be memory-mapped on read
+    """
+    schema = {}
+    members = []
+    for table, columns in tables.items():
+        schema[table] = {}
+        for column, data in columns.items():
+            name = f'{table}/{column}'
+            if isinstance(data, Ragged):
+                schema[table][column] = 'ragged'
+                members.append((f'{name}.values.npy', data.values))
+                members.append((f'{name}.offsets.npy', data.offsets))
+            else:
+                schema[table][column] = 'array'
+                members.append((f'{name}.npy', np.asarray(data)))
+
+    header = {'version': FORMAT_VERSION, 'tables': schema, 'meta': meta or {}}
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with zipfile.ZipFile(tmp_path, 'w', compression=compression, allowZip64=True) as zf:
+        zf.writestr(META, json.dumps(header, default=str))
+        for name, array in members:
+            with zf.open(name, 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, array, allow_pickle=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+class RunStore:
+    """
+    Reads a store written by write_run_store, columns are loaded lazily and cached
+    """
+
+    def __init__(self, path, mmap=False):
+        """
+        :param path: the path of the store, or of the run directory holding run_store.npz
+        :param mmap: memory-map uncompressed columns instead of reading them into memory
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, RUN_STORE)
+        self.path = path
+        self.mmap = mmap
+        self._zf = zipfile.ZipFile(path, 'r')
+        header = json.loads(self._zf.read(META))
+        self.version = header['version']
+        self.schema = header['tables']
+        self.meta = header['meta']
+        self._cache = {}
+
+    def close(self):
+        self._zf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, table):
+        return table in self.schema
+
+    def column(self, table, column):
+        key = (table, column)
+        if key not in self._cache:
+            name = f'{table}/{column}'
+            if self.schema[table][column] == 'ragged':
+                data = Ragged(self._read(f'{name}.values.npy'), self._read(f'{name}.offsets.npy'))
+            else:
+                data = self._read(f'{name}.npy')
+            self._cache[key] = data
+        return self._cache[key]
+
+    def table(self, table):
+        return {column: self.column(table, column) for column in self.schema[table]}
+
+    def _read(self, name):
+        info = self._zf.getinfo(name)
+        if self.mmap and info.compress_type == zipfile.ZIP_STORED:
+            with open(self.path, 'rb') as f:
+                f.seek(info.header_offset)
+                fields = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+                f.seek(info.header_offset + _LOCAL_HEADER.size + fields[-2] + fields[-1])
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                offset = f.tell()
+            if not np.prod(shape):
+                return np.zeros(shape, dtype=dtype)
+            return np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                             order='F' if fortran_order else 'C')
+        with self._zf.open(name) as f:
+            return np.lib.format.read_array(f, allow_pickle=False)
+
+
+_LEGACY_FILES = {
+    'agent_history': 'agent_history.dill',
+}
+
+
+def load_run_data(run_dir, name):
+    """
+    Loads one of the per-run objects previously written as separate pickle files by Logger.serialise_data,
+    runs written before the run store existed are read from their pickle files
+    :param run_dir: the run directory
+    :param name: the name of the legacy file without extension, e.g. veh_speed_hist or veh_wait_time
+    :returns: the object in the same layout as the legacy pickle
+    """
+    legacy_path = os.path.join(run_dir, _LEGACY_FILES.get(name, f'{name}.pickle'))
+    if os.path.exists(legacy_path):
+        with open(legacy_path, 'rb') as f:
+            return pickle.load(f)
+    stream_path = os.path.join(run_dir, STREAM_LOG)
+    if not os.path.exists(os.path.join(run_dir, RUN_STORE)) and os.path.exists(stream_path):
+        return _stream_view(stream_path, name)
+    with RunStore(run_dir) as store:
+        return _legacy_view(store, name)
+
+
+def _stream_view(path, name):
+    """
+    Reads the episode level objects from the stream log of a run that has not been serialised, e.g. after a crash
+    """
+    if name in ('delays', 'travel_times'):
+        return read_columns(path, 'delays', keys=[name])[name]
+    if name == 'obj_alignment':
+        return [{k: v for k, v in x.items() if k not in ('kind', 'episode')} for x in read_stream(path, 'decision')]
+    keys = {'episode_rewards': 'reward', 'episode_veh_count': 'veh_count', 'episode_travel_time': 'travel_time'}
+    if name in keys:
+        return read_columns(path, 'episode', keys=[keys[name]])[keys[name]]
+    raise KeyError(f'{name} is only available once the run has been serialised')
+
+
+def _legacy_view(store, name):
+    if name.startswith('veh_'):
+        vehicles = store.table('vehicles')
+        ids = vehicles['id'].tolist()
+        if name == 'veh_speed_hist':
+            if 'speeds' in vehicles:
+                rows = vehicles['speeds'].tolist()
+            else: # summarised run, the mean stands in for the series
+                rows = [[x] for x in vehicles['mean_speed'].tolist()]
+        elif name == 'veh_wait_time':
+            if 'wait_times' in vehicles:
+                rows = vehicles['wait_times'].tolist()
+            else:
+                rows = [[x] if n else [] for x, n in zip(vehicles['mean_wait'].tolist(), vehicles['n_waits'].tolist())]
+        elif name == 'veh_stops':
+            rows = vehicles['stops'].tolist()
+        elif name == 'veh_delays':
+            rows = vehicles['delay'].tolist()
+        else:
+            raise KeyError(name)
+        return dict(zip(ids, rows))
+
+    if name in ('speeds', 'stops'):
+        if 'network' not in store:
+            raise KeyError(f'{name} is only stored for runs logged with --detailed_log')
+        return store.column('network', name).tolist()
+
+    if name in ('delays', 'travel_times'):
+        return store.column('episodes', name).tolist()
+    if name == 'episode_rewards':
+        return store.column('episodes', 'reward').tolist()
+    if name == 'episode_veh_count':
+        return store.column('episodes', 'veh_count').tolist()
+    if name == 'episode_travel_time':
+        return store.column('episodes', 'travel_time').tolist()
+
+    if name == 'agents_rewards':
+        agents = store.table('agents')
+        heads = store.meta.get('reward_heads')
+        if heads: # reward type multi, the rewards of every head of a step in one row
+            rows = [[list(x) for x in zip(*per_head)]
+                    for per_head in zip(*[agents[f'rewards_{head}'].tolist() for head in heads])]
+            return dict(zip(agents['id'].tolist(), rows))
+        return dict(zip(agents['id'].tolist(), agents['rewards'].tolist()))
+
+    if name == 'waiting_time':
+        moves = store.table('movements')
+        output = {}
+        for agent_id, move_id, max_wait, waits in zip(moves['agent_id'].tolist(), moves['move_id'].tolist(),
+                                                      moves['max_waiting_time'].tolist(),
+                                                      moves['waiting_times'].tolist()):
+            output.setdefault(agent_id, {})[move_id] = (max_wait, waits)
+        return output
+
+    if name == 'mfd':
+        if 'mfd' not in store:
+            return {}
+        mfd = store.table('mfd')
+        return {road_id: {'speed': speed, 'density': density}
+                for road_id, speed, density in zip(mfd['road_id'].tolist(), mfd['speed'], mfd['density'])}
+
+    if name == 'obj_alignment':
+        if 'alignment' not in store:
+            return []
+        columns = {k: v.tolist() for k, v in store.table('alignment').items()}
+        return [{k: v[i] for k, v in columns.items() if v[i] != -1}
+                for i in range(len(next(iter(columns.values()), [])))]
+
+    if name == 'agent_history':
+        return store.column('agent_history', 'action').tolist()
+
+    raise KeyError(name)
@@ -1,4 +1,3 @@
-
 import os
 
 low_balanced = [11, 11]
@@ -15,7 +14,14 @@ traffic_conditions = [low_balanced, low_unbalanced, medium_balanced, medium_unba
 # reward_types = ["stops", "speed", "wait"]
 reward_types = ['both']
 
+# True trains one traffic conditioned model per reward on all the conditions above (see conditions.TRAFFIC_CONDITIONS)
+# instead of one model per condition, vote mode then needs --conditioned
+conditioned = False
+
 for reward in reward_types:
+    if conditioned:
+        os.system("python runner.py --sim_config '../scenarios/loop_intersection/rings.config' --num_sim_steps 3600 --eps_start 1 --lr 0.0005 --mode train --agents_type learning --num_episodes 150 --replay True --mfd False --reward_type " + reward + " --conditioned --conditions " + " ".join(f"{x[0]},{x[1]}" for x in traffic_conditions))
+        continue
     for traffic in traffic_conditions:
         os.system("python runner.py --sim_config '../scenarios/loop_intersection/rings.config' --num_sim_steps 3600 --eps_start 1 --lr 0.0005 --mode train --agents_type learning --num_episodes 150 --replay True --mfd False --reward_type " + reward + " --n_vehs " + str(traffic[0]) + " " + str(traffic[1]))
 
@@ -23,4 +29,4 @@ for reward in reward_types:
 
         # os.system("sbatch -n 8 --time=8:00:00 --wrap \"python runner.py --sim_config '../scenarios/loop_intersection/rings.config' --num_sim_steps 3600 --eps_start 1 --lr 0.0005 --mode train --agents_type learning --num_episodes 150 --replay True --mfd False --reward_type " + reward + " --n_vehs " + str(traffic[0]) + " " + str(traffic[1]) + "\"" )
         
-sbatch -n 8 --time=8:00:00 --wrap "python runner.py --sim_config ../scenarios/hangzhou/1.config --num_sim_steps 3600 --eps_start 1 --lr 0.0005 --mode train --agents_type learning --num_episodes 150 --replay False --mfd False --reward_type wait"
+# sbatch -n 8 --time=8:00:00 --wrap "python runner.py --sim_config ../scenarios/hangzhou/1.config --num_sim_steps 3600 --eps_start 1 --lr 0.0005 --mode train --agents_type learning --num_episodes 150 --replay False --mfd False --reward_type wait"
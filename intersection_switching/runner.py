@@ -1,15 +1,40 @@
+import time
+_START = time.perf_counter()
+
+import os
 import numpy as np
 import random
 import argparse
 
-from models.dqn import DQN
 from environ import Environment
 from logger import Logger
+from agents.controller_bank import ControllerBank
+from engine.factory import ENGINES
+from replay import REPLAY_MODES, REPLAY_FORMATS
+from resources import ThreadBudget, CORES_ENV
+from conditions import TRAFFIC_CONDITIONS, SAMPLING, ConditionSampler, parse_condition
+from dataset import TransitionWriter, CHUNK_SIZE
+from checkpoint import save_checkpoint, load_checkpoint, restore_training
+from agents.switch_agent import PREFERENCES
+from profiling import EpisodeProfiler, StartupProfile
 from importlib import import_module
-import torch
 
 SEED = 2
 
+# torch is only imported by the modes running a network, see load_torch
+torch = None
+device = None
+
+
+def load_torch():
+    """
+    imports torch and sets the device the networks run on
+    """
+    global torch, device
+    import torch
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    return torch
+
 
 def import_string(dotted_path):
     """
@@ -32,7 +57,20 @@ def import_string(dotted_path):
         raise ImportError(msg)
 
 
-def parse_args():
+def str2bool(value):
+    """
+    parses the boolean flags given as True/False, bool('False') is True
+    """
+    if isinstance(value, bool):
+        return value
+    if value.lower() in ('true', 't', 'yes', '1'):
+        return True
+    if value.lower() in ('false', 'f', 'no', '0'):
+        return False
+    raise argparse.ArgumentTypeError(f'expected a boolean, got {value}')
+
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--sim_config", default='../scenarios/2x2/1.config',
@@ -44,7 +82,7 @@ def parse_args():
     parser.add_argument("--num_sim_steps", default=1800, type=int,
                         help="the number of simulation steps, one step corresponds to 1 second")
     parser.add_argument("--agents_type", default='analytical', type=str,
-                        help="the type of agents learning/policy/analytical/hybrid/demand")
+                        help="the type of agents learning/policy/analytical/hybrid/demand or a baseline max_pressure/fixed_time/green_time")
     parser.add_argument("--rl_model", default='dqn', type=str,
                         help="rl algorithm used, defaults to deep Q-learning")
     parser.add_argument("--update_freq", default=10, type=int,
@@ -66,7 +104,15 @@ def parse_args():
     parser.add_argument("--mode", default='train', type=str,
                         help="mode of the run train/test")
     parser.add_argument("--replay", default=False,
-                        type=bool, help="saving replay")
+                        type=str2bool, help="saving the replay of the last episode, same as --replay_mode last")
+    parser.add_argument("--replay_mode", default='off', type=str, choices=REPLAY_MODES,
+                        help="the episodes written as replays: off, last or every --replay_every episodes and the last")
+    parser.add_argument("--replay_every", default=10, type=int,
+                        help="the episode interval of --replay_mode every")
+    parser.add_argument("--replay_stride", default=1, type=int,
+                        help="record every n-th simulation step of the replayed episodes")
+    parser.add_argument("--replay_format", default='cityflow', type=str, choices=REPLAY_FORMATS,
+                        help="cityflow (the frontend replay file) or compact (compressed vehicle lanes, distances and phases)")
     parser.add_argument("--mfd", default=False, type=bool,
                         help="saving mfd data")
     parser.add_argument("--path", default='../runs/', type=str,
@@ -80,15 +126,64 @@ def parse_args():
     parser.add_argument("--gamma", default=0.8, type=float,
                         help="gamma parameter for the DQN")
     parser.add_argument("--reward_type", default='stops', type=str,
-                        help="reward function for the agent")
+                        help="reward function for the agent, multi trains one Q-value head per preference (speed, stops, wait) in a single run")
     parser.add_argument("--n_vehs", default=None, type=int, nargs=2,
                         help="number of vehicles in the scenario")
     parser.add_argument("--vote_weights", default=[1,0, 0 ], type=float, nargs=3,
                         help="number of vehicles in the scenario")
     parser.add_argument("--vote_type", default='proportional', type=str,
                         help="type of voting used")
-
-    return parser.parse_args()
+    parser.add_argument("--engine", default='cityflow', type=str, choices=ENGINES,
+                        help="the simulation engine, cityflow, mock (an in-memory stand-in for load testing and profiling) or replay")
+    parser.add_argument("--trace", default=None, type=str,
+                        help="path of an engine trace, recorded when running cityflow/mock and replayed with --engine replay")
+    parser.add_argument("--detailed_log", action='store_true',
+                        help="keep and save the full per step and per vehicle series, by default only their statistics are kept")
+    parser.add_argument("--timers", action='store_true',
+                        help="time the phases of every decision, print a breakdown per episode and save it to timers.json")
+    parser.add_argument("--profile_episode", default=None, type=int,
+                        help="run this episode under cProfile and tracemalloc and save the reports in the run directory")
+    parser.add_argument("--print_startup_profile", action='store_true',
+                        help="print the time spent on imports and setup before the first episode")
+    parser.add_argument("--neighbour_hops", default=0, type=int,
+                        help="append the mean pooled lane densities and phases of the intersections up to this many hops away to the observations, 0 disables it")
+    parser.add_argument("--cores", default=None, type=int,
+                        help=f"the cores of the job split between the engine and torch, by default ${CORES_ENV}, $SLURM_CPUS_PER_TASK or all available cpus")
+    parser.add_argument("--engine_threads", default=None, type=int,
+                        help="the threads of the simulation engine, the rest of the cores go to torch, half of the cores by default")
+    parser.add_argument("--pin_cpus", action='store_true',
+                        help="pin the job to its own block of --cores cpus")
+    parser.add_argument("--worker", default=None, type=int,
+                        help="the index of the job on the node selecting its cpu block, $SLURM_LOCALID by default")
+    parser.add_argument("--conditioned", action='store_true',
+                        help="condition the policy on the demand of the traffic, without --n_vehs the traffic condition of every episode is drawn from --conditions and the model is saved as conditioned_<reward_type>")
+    parser.add_argument("--conditions", default=list(TRAFFIC_CONDITIONS), type=str, nargs='+',
+                        help="the traffic conditions of a conditioned run, names of conditions.TRAFFIC_CONDITIONS or vehicles per flow, e.g. 22,11")
+    parser.add_argument("--condition_sampling", default='random', type=str, choices=SAMPLING,
+                        help="draw the condition of every episode at random or cycle through them (offset by --worker)")
+    parser.add_argument("--log_flush", default=100, type=int,
+                        help="number of records buffered before the stream log is written, it is always written at the end of an episode")
+    parser.add_argument("--inference_backend", default='torch', type=str, choices=('torch', 'numpy'),
+                        help="the backend of the networks in test and vote mode, a frozen torch graph or numpy matmuls")
+    parser.add_argument("--quantize", action='store_true',
+                        help="quantize the linear layers of the networks to int8 in test and vote mode (torch backend)")
+    parser.add_argument("--policy_server", default=None, type=str,
+                        help="in test and vote mode, get the actions and Q-values from a policy_server.py process at this address (unix:<path> or <host>:<port>) instead of loading the networks and torch")
+    parser.add_argument("--server_model", default=None, type=str,
+                        help="the served model of test mode, the first model of the server by default")
+    parser.add_argument("--checkpoint_every", default=10, type=int,
+                        help="write the full training state (networks, optimizer, replay memory, epsilon, random generators, logger) to checkpoint.pt in the run directory every n episodes, 0 disables it")
+    parser.add_argument("--resume", action='store_true',
+                        help="continue the latest run of the experiment (or the run of --ID) from its checkpoint, the run starts from scratch if it has none")
+    parser.add_argument("--dataset_dir", default=None, type=str,
+                        help="write the transitions of the run (observations, actions, the rewards of every preference, next observations, dones) to this directory for offline_train.py")
+    parser.add_argument("--dataset_chunk", default=CHUNK_SIZE, type=int,
+                        help="number of transitions per chunk of the dataset")
+
+    args = parser.parse_args(argv)
+    if args.replay and args.replay_mode == 'off':
+        args.replay_mode = 'last'
+    return args
 
 
 def get_vote_action(environ):
@@ -115,11 +210,25 @@ def get_vote_action(environ):
         raw_net.update({"reference" : act})
         actions[agent_id] = act
         # print(np.array(raw_net)==act)
-        logger.objective_alignment.append(raw_net)
+        logger.log_decision(raw_net)
                     
 
+def preference_q_values(policy_map, states, prefs):
+    """
+    the Q-values of every preference for a list of states, one batched forward pass per model
+    :param policy_map: an InferencePolicy of a multi-head model or a dictionary of preference -> InferencePolicy
+    :returns: list of dictionaries of preference -> array of Q-values, one per state
+    """
+    states = np.array(states, dtype=np.float32)
+    if isinstance(policy_map, dict):
+        qvals = {pref: policy_map[pref].q_values(states) for pref in prefs}
+        return [{pref: qvals[pref][i] for pref in prefs} for i in range(len(states))]
+    qvals = policy_map.q_values(states)
+    return [dict(zip(policy_map.heads, x)) for x in qvals]
+
+
 def run_exp(environ, args, num_episodes, num_sim_steps, logger,
-            policy, policy_map=None, detailed_log=False):
+            policy, policy_map=None, detailed_log=False, inference=None):
     step = 0
     best_time = 999999
     best_veh_count = 0
@@ -127,7 +236,6 @@ def run_exp(environ, args, num_episodes, num_sim_steps, logger,
     saved_model = None
     environ.best_epoch = 0
 
-    environ.eng.set_save_replay(open=False)
     # environ.eng.set_random_seed(SEED)
     # random.seed(SEED)
     # np.random.seed(SEED)
@@ -137,16 +245,48 @@ def run_exp(environ, args, num_episodes, num_sim_steps, logger,
 
     log_phases = False
 
+    sampler = None
+    if environ.conditioned and args.n_vehs is None:
+        sampler = ConditionSampler([parse_condition(x) for x in args.conditions], sampling=args.condition_sampling,
+                                   worker=args.worker)
+
+    dataset = None
+    if args.dataset_dir:
+        dataset = TransitionWriter(args.dataset_dir, PREFERENCES, environ.agents[0].n_actions,
+                                   chunk_size=args.dataset_chunk,
+                                   meta={'sim_config': args.sim_config, 'agents_type': args.agents_type,
+                                         'mode': args.mode, 'reward_type': args.reward_type,
+                                         'conditioned': environ.conditioned, 'neighbour_hops': args.neighbour_hops})
+
+    start_episode = 0
+    if logger.resuming and policy is not None:
+        state = load_checkpoint(logger.log_path)
+        if state is not None:
+            start_episode, best, step = restore_training(state, policy, environ, logger, sampler=sampler,
+                                                         device=device)
+            best_time, best_veh_count, best_reward = best['time'], best['veh_count'], best['reward']
+            environ.best_epoch = best['epoch']
+            print(f'resuming from episode {start_episode}')
+    if start_episode >= num_episodes:
+        print(f'the run has already completed its {num_episodes} episodes')
+        return
+
     print(f'actions: {list(environ.intersections.values())[0].action_space.n}')
-    for i_episode in range(num_episodes):
+    for i_episode in range(start_episode, num_episodes):
         logger.losses = []
-        if i_episode == num_episodes-1 and args.replay:
-            environ.eng.set_save_replay(open=True)
-            environ.eng.set_replay_file(f"../{logger.log_path}/replay_file.txt")
+        if sampler:
+            environ.set_traffic(sampler.sample(i_episode))
+            print("traffic condition ", environ.n_vehs)
+        environ.replay.start_episode(i_episode, num_episodes, logger.log_path)
 
         print("episode ", i_episode)
+        profiler = None
+        if i_episode == args.profile_episode:
+            profiler = EpisodeProfiler(logger.log_path, name=f'episode_{i_episode}')
+            profiler.start()
 
         obs = environ.reset()
+        decisions = {} # the last action of every agent, agents act at different times
         pref_types = ['speed', 'stops', 'wait']
         weights = args.vote_weights
         # preferences_dict = {id: np.random.choice(pref_types) for id in environ.vehicles.keys()}
@@ -159,42 +299,51 @@ def run_exp(environ, args, num_episodes, num_sim_steps, logger,
             # Dispatch the observations to the model to get the tuple of actions
             # actions = {id: 1*(np.random.random()>0.5) for id in environ.agent_ids} # random policy
 
-            if args.mode == 'train' and environ.agents_type in ['learning']:
-                actions = {}
-                for agent_id in environ.agent_ids:
-                    act = policy.act(torch.FloatTensor(
-                        obs[agent_id], device=device), epsilon=environ.eps)
-                    actions[agent_id] = act
-
-
-            if args.mode=='vote':
-                votes = environ.vote_drivers()
-                actions = {}
-                for agent_id in environ.agent_ids:
-                    actprob = np.zeros(environ.agents[0].n_actions)
-                    raw_net = {}
-                    for pref, weight in votes.items():#zip(weights, pref_types):
-                        _act = policy_map[pref].act(torch.FloatTensor(
-                            obs[agent_id], device=device), 
-                            epsilon=environ.eps,
-                            as_probs=True)
-                        _act = _act.numpy().squeeze()
-                        raw_net.update({pref : np.argmax(_act)})
-
-                        if args.vote_type=='majority':
-                            weight = 1*(weight==np.max(list(votes.values()))) # zeros out the losing vote
-
-                        normed_act = environ._agents_dict[agent_id].rescale_preferences(pref, _act)
-                        actprob += weight*normed_act
-                        # print(pref, _act, normed_act)
-                    act = np.argmax(actprob/sum(votes.values()))
-                    raw_net.update({"reference" : act})
-                    actions[agent_id] = act
-                    # print(np.array(raw_net)==act)
-                    logger.objective_alignment.append(raw_net)
+            with environ.timer.phase('inference'):
+                if args.mode == 'train' and environ.agents_type in ['learning']:
+                    actions = {}
+                    for agent_id in environ.ready_agents:
+                        act = policy.act(torch.FloatTensor(
+                            obs[agent_id], device=device), epsilon=environ.eps)
+                        actions[agent_id] = act
+
+                if args.mode == 'test' and inference is not None:
+                    ready = list(environ.ready_agents)
+                    actions = dict(zip(ready, inference.act_batch([obs[agent_id] for agent_id in ready])))
+
+                if environ.agents_type in ControllerBank.policies:
+                    actions = {}
+                    for agent_id, act in environ.controller_bank.act(environ.agents_type).items():
+                        actions[agent_id] = act
+
+                if args.mode=='vote':
+                    votes = environ.vote_drivers()
+                    actions = {}
+                    qvals = preference_q_values(policy_map, [obs[agent_id] for agent_id in environ.ready_agents],
+                                                votes)
+                    for agent_id, agent_qvals in zip(environ.ready_agents, qvals):
+                        actprob = np.zeros(environ.agents[0].n_actions)
+                        raw_net = {}
+                        for pref, weight in votes.items():#zip(weights, pref_types):
+                            _act = agent_qvals[pref]
+                            raw_net.update({pref : np.argmax(_act)})
+
+                            if args.vote_type=='majority':
+                                weight = 1*(weight==np.max(list(votes.values()))) # zeros out the losing vote
+
+                            normed_act = environ._agents_dict[agent_id].rescale_preferences(pref, _act)
+                            actprob += weight*normed_act
+                            # print(pref, _act, normed_act)
+                        act = np.argmax(actprob/sum(votes.values()))
+                        raw_net.update({"reference" : act})
+                        actions[agent_id] = act
+                        # print(np.array(raw_net)==act)
+                        logger.log_decision(raw_net)
                     
 
             # Execute the actions
+            acted = list(environ.ready_agents)
+            decisions.update(actions)
             next_obs, rewards, dones, info = environ.step(actions)
             # print(next_obs, rewards)
 
@@ -203,31 +352,44 @@ def run_exp(environ, args, num_episodes, num_sim_steps, logger,
             if args.mode=='train' and environ.agents_type in ['learning']:
                 step = (step+1) % environ.update_freq
                 if environ.time > 50:
-                    for agent_id in rewards.keys():
-                        state = torch.FloatTensor(obs[agent_id], device=device)
-                        reward = torch.tensor(
-                            [rewards[agent_id]], dtype=torch.float, device=device)
-                        done = torch.tensor(
-                            [dones[agent_id]], dtype=torch.bool, device=device)
-                        action = torch.tensor(
-                            [actions[agent_id]], device=device)
-                        next_state = torch.FloatTensor(
-                            next_obs[agent_id], device=device)
-                        policy.memory.add(
-                            state, action, reward, next_state, done)
+                    with environ.timer.phase('replay_insert'):
+                        for agent_id in rewards.keys():
+                            state = torch.FloatTensor(obs[agent_id], device=device)
+                            reward = torch.tensor( # one reward per head with --reward_type multi
+                                np.atleast_1d(rewards[agent_id]), dtype=torch.float, device=device)
+                            done = torch.tensor(
+                                [dones[agent_id]], dtype=torch.bool, device=device)
+                            action = torch.tensor(
+                                [decisions[agent_id]], device=device)
+                            next_state = torch.FloatTensor(
+                                next_obs[agent_id], device=device)
+                            policy.memory.add(
+                                state, action, reward, next_state, done)
 
                 if step == 0:
                     tau = 1e-3
                     _loss = 0
-                    _loss -= policy.optimize_model(
-                        gamma=args.gamma, tau=tau)
+                    with environ.timer.phase('optimise'):
+                        _loss -= policy.optimize_model(
+                            gamma=args.gamma, tau=tau)
                     logger.losses.append(-_loss)
                     environ.eps = max(environ.eps-environ.eps_decay, environ.eps_end)
-            obs = next_obs
+            if dataset:
+                with environ.timer.phase('dataset'):
+                    components = environ.reward_components(rewards.keys())
+                    for agent_id in rewards.keys():
+                        dataset.add(obs[agent_id], decisions[agent_id], components[agent_id], next_obs[agent_id],
+                                    dones[agent_id], agent_id, episode=i_episode, time=environ.time,
+                                    n_vehs=environ.n_vehs)
+            obs.update(next_obs) # the agents that are not due keep the observation of their last decision
 
-            environ.agent_history.append(act)
+            environ.agent_history.extend(actions[agent_id] for agent_id in acted) # one action per decision
 
-        if environ.agents_type in ['learning']:
+        replay_path = environ.replay.end_episode()
+        if replay_path:
+            print(f'replay saved to {replay_path}')
+
+        if environ.agents_type in ['learning'] and policy is not None:
             if environ.eng.get_average_travel_time() < best_time:
                 best_time = environ.eng.get_average_travel_time()
                 logger.save_models([policy], flag=False)
@@ -243,32 +405,73 @@ def run_exp(environ, args, num_episodes, num_sim_steps, logger,
             logger.save_models([policy], flag=None)
         logger.log_measures(environ)
         logger.log_delays(args.sim_config, environ)
+        if profiler:
+            print(f'profile saved to {profiler.stop()}_*')
 
-        print_string = (f'Rew: {logger.reward:.4f}\t'
+        print_string = (f'Rew: {logger.format_reward()}\t'
                         f'Vehicles: {len(environ.vehicles):.0f}\t'
-                        f'Speed (m/s): {np.mean(environ.speeds):.2f}\t'
-                        f'Stops (total): {np.sum(environ.stops):.2f}\t'
-                        f'WaitTimes (sec): {np.mean(environ.waiting_times):.2f}\t'
+                        f'Speed (m/s): {environ.speed_stats.mean:.2f}\t'
+                        f'Stops (total): {environ.stop_stats.total:.2f}\t'
+                        f'WaitTimes (sec): {environ.wait_stats.mean:.2f}\t'
                         )
         if True:
             print_string += f'Delay (sec/km): {np.mean(logger.delays[-1]):.2f}'
         print(print_string)
-
+        checkpoint_due = args.checkpoint_every and (i_episode + 1) % args.checkpoint_every == 0
+        if args.mode == 'train' and policy is not None and checkpoint_due:
+            with environ.timer.phase('checkpoint'):
+                best = {'time': best_time, 'veh_count': best_veh_count, 'reward': best_reward,
+                        'epoch': environ.best_epoch}
+                save_checkpoint(logger.log_path, policy, environ, logger, i_episode + 1, best, step=step,
+                                sampler=sampler, writer=logger.checkpoints)
+
+        if args.timers:
+            print(environ.timer.format())
+        environ.timer.end_episode()
+
+    if dataset:
+        dataset.close()
+        print(f'{dataset.count} transitions saved to {dataset.directory}')
+    if sampler:
+        print(logger.format_conditions())
+    if args.timers:
+        environ.timer.export(os.path.join(logger.log_path, 'timers.json'))
     # logger.save_log_file(environ)
     logger.serialise_data(environ, policies[0])
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
 if __name__ == "__main__":
+    startup = StartupProfile(start=_START)
+    startup.mark('imports')
     args = parse_args()
+    args.detailed_log = args.detailed_log or args.mode == 'test'
+    startup.mark('arguments')
+    budget = ThreadBudget.from_args(args)
+    budget.apply()
+    print(budget)
     logger = Logger(args)
+    startup.mark('logger')
 
     environ = Environment(args, reward_type=args.reward_type)
+    startup.mark('environment')
 
     act_space = environ.action_space
     obs_space = environ.observation_space
 
-    if args.agents_type in ['learning']:
+    remote = args.policy_server is not None and args.mode in ['test', 'vote'] # the networks run in policy_server.py
+    if (args.agents_type in ['learning'] or args.mode == 'vote') and not remote:
+        load_torch()
+        budget.apply_torch(torch)
+        from models.dqn import DQN
+        startup.mark('torch')
+
+    if remote:
+        from policy_server import PolicyClient
+        print(f'using the policies served on {args.policy_server}')
+        policy = None
+    elif args.agents_type in ['learning'] and args.reward_type == 'multi':
+        from models.multihead_dqn import MultiHeadDQN
+        policy = MultiHeadDQN(obs_space, act_space, seed=SEED, load=args.load)
+    elif args.agents_type in ['learning']:
         policy = DQN(obs_space, act_space, seed=SEED, load=args.load)
     else:
         print('not using a policy')
@@ -281,18 +484,53 @@ if __name__ == "__main__":
             n_vehs = [-1,-1]
         else: 
             n_vehs = args.n_vehs
-        policy_map = {}
-        for pref in saved_preferences:
-            load_path = f'../saved_models/{n_vehs[0]}_{n_vehs[1]}_{pref}/reward_target_net.pt'
-            policy_map[pref] = DQN(obs_space, act_space, 
-                                   seed=SEED, load=load_path)
+        # a conditioned model covers every traffic condition, the others are trained per condition
+        model_name = 'conditioned' if args.conditioned else f'{n_vehs[0]}_{n_vehs[1]}'
+        if remote: # the server runs the models of the same name, policy_server.py --vote_models <model_name>
+            client = PolicyClient(args.policy_server)
+            if 'multi' in client.models:
+                policy_map = client.policy('multi')
+            else:
+                policy_map = {pref: client.policy(pref) for pref in saved_preferences}
+        else:
+            from policy_server import vote_model_paths
+            paths = vote_model_paths(model_name)
+            if 'multi' in paths: # trained with --reward_type multi, one forward pass gives every preference
+                from models.multihead_dqn import MultiHeadDQN
+                policy_map = MultiHeadDQN(obs_space, act_space, heads=saved_preferences, seed=SEED, load=paths['multi'])
+            else:
+                policy_map = {}
+                for pref in saved_preferences:
+                    policy_map[pref] = DQN(obs_space, act_space,
+                                           seed=SEED, load=paths[pref])
     else:
         policy_map=None
 
+    inference = None
+    if remote:
+        if args.mode == 'test' and args.agents_type in ['learning']:
+            inference = PolicyClient(args.policy_server).policy(args.server_model)
+    elif args.mode in ['test', 'vote'] and (policy is not None or policy_map is not None):
+        # test and vote runs only evaluate the networks, they run inference-only copies
+        from models.inference import InferencePolicy
+
+        def to_inference(x):
+            return InferencePolicy.from_policy(x, backend=args.inference_backend, quantize=args.quantize)
+
+        if args.mode == 'test' and policy is not None:
+            inference = to_inference(policy)
+        if isinstance(policy_map, dict):
+            policy_map = {pref: to_inference(x) for pref, x in policy_map.items()}
+        elif policy_map is not None:
+            policy_map = to_inference(policy_map)
+    startup.mark('policies')
+    if args.print_startup_profile:
+        print(startup.format())
+
     num_episodes = args.num_episodes
     num_sim_steps = args.num_sim_steps
 
 
-    detailed_log = args.mode == 'test'
-    run_exp(environ, args, num_episodes, num_sim_steps, logger, policies[0], policy_map, detailed_log)
+    detailed_log = args.detailed_log
+    run_exp(environ, args, num_episodes, num_sim_steps, logger, policies[0], policy_map, detailed_log, inference)
 
@@ -0,0 +1,113 @@
+import os
+import json
+import numpy as np
+
+STREAM_LOG = 'stream.jsonl'
+
+
+def _to_builtin(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (set, tuple)):
+        return list(obj)
+    raise TypeError(f'{type(obj).__name__} is not json serialisable')
+
+
+class StreamLog:
+    """
+    An append-only log of json records, one per line, written as records are produced
+    records are buffered and written every `flush_every` records, or when flush is called
+    """
+
+    def __init__(self, path, flush_every=100, fsync=False):
+        """
+        :param path: the path of the log, appended to if it exists
+        :param flush_every: the number of buffered records that triggers a write
+        :param fsync: also fsync the file on every flush
+        """
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        self.fsync = fsync
+        self.counts = {}
+        self._buffer = []
+        _drop_partial_line(path)
+        self._f = open(path, 'a')
+
+    def write(self, kind, **record):
+        """
+        appends a record of the given kind, e.g. episode or decision
+        """
+        record['kind'] = kind
+        self._buffer.append(json.dumps(record, default=_to_builtin))
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._f.write('\n'.join(self._buffer) + '\n')
+            self._buffer = []
+        self._f.flush()
+        if self.fsync:
+            os.fsync(self._f.fileno())
+
+    def close(self):
+        if not self._f.closed:
+            self.flush()
+            self._f.close()
+
+
+def _drop_partial_line(path):
+    """
+    truncates a partially written last line so records appended to an existing log stay readable
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if not size:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+        pos = size
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            idx = f.read(step).rfind(b'\n')
+            if idx >= 0:
+                f.truncate(pos - step + idx + 1)
+                return
+            pos -= step
+        f.truncate(0)
+
+
+def read_stream(path, kind=None):
+    """
+    Reads the records of a stream log, a partially written last line (e.g. after a crash) is ignored
+    :param path: the path of the log
+    :param kind: only yield records of this kind
+    """
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if kind is None or record['kind'] == kind:
+                yield record
+
+
+def read_columns(path, kind, keys=None):
+    """
+    Reads the records of one kind as columns
+    :returns: dictionary of key -> list of values, records missing a key get None
+    """
+    records = list(read_stream(path, kind))
+    if keys is None:
+        keys = list(dict.fromkeys(k for x in records for k in x if k != 'kind'))
+    return {k: [x.get(k) for x in records] for k in keys}
@@ -1,5 +1,6 @@
 import json
 import os
+import hashlib
 
 DEFAULT_VEHICLE = {
       "length": 5.0,
@@ -14,41 +15,76 @@ DEFAULT_VEHICLE = {
     }
 
 
-def config_creator(dir, n_vehs, reward='speed', logpath=None):
+CACHE_DIR = '.cache'
+
+
+def cache_file(dir, name, text):
+    """
+    writes a generated scenario file into a content-addressed cache, <dir>/.cache/<hash of text>/<name>,
+    existing files are reused and new ones are written to a temporary file first and moved in place,
+    so runs started in parallel never read a partially written file
+    :param dir: the scenario directory
+    :param name: the file name
+    :param text: the content of the file
+    :returns: the path of the file
+    """
+    digest = hashlib.sha1(text.encode()).hexdigest()[:16]
+    path = os.path.join(dir, CACHE_DIR, digest, name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    return path
+
+
+def config_creator(dir, n_vehs, reward='speed', logpath=None, flow_file=None):
+    """
+    creates the simulation config of a generated flow file
+    :param dir: the scenario directory holding roadnet.json
+    :param n_vehs: the number of vehicles of each flow
+    :param flow_file: the path of the flow file, created with flow_creator if not given
+    :returns: the path of the cached config
+    """
     dir = os.path.abspath(dir)
-    
+    if flow_file is None:
+        flow_file = flow_creator(dir, n_vehs=n_vehs, reward=reward)
+
     config =  {
         "interval": 1,
         "seed": 0,
         "dir": f'{dir}/',
         "roadnetFile": "roadnet.json",
-        "flowFile": f"flow_{'_'.join(map(str, n_vehs))}_{reward}.json",
+        "flowFile": os.path.relpath(flow_file, dir),
         "rlTrafficLight": True,
         "saveReplay": True,
         "roadnetLogFile": f"frontend/test_sphere.json",
         "replayLogFile": f"frontend/replay_file.txt",
         "laneChange": True
     }
-    sim_config = f"{dir}/rings_{'_'.join(map(str, n_vehs))}_{reward}.config"
-    with open(sim_config, 'w') as f:
-        f.write(json.dumps(config, indent=2))
-    return sim_config
+    return cache_file(dir, f"rings_{'_'.join(map(str, n_vehs))}.config", json.dumps(config, indent=2))
 
 
-def flow_creator(dir, n_vehs=[11,5], reward='speed', routes=[['road_1','road_2'], ['road_3','road_4']], 
-                 loops=200, vehicle_params=DEFAULT_VEHICLE.copy()):
+def flow_creator(dir, n_vehs=(11, 5), reward='speed', routes=(('road_1', 'road_2'), ('road_3', 'road_4')),
+                 loops=200, vehicle_params=None):
+    """
+    creates the flows of the loop scenario, flow i has n_vehs[i] vehicles driving `loops` times around routes[i],
+    the file only depends on its content, the reward is kept for compatibility
+    :returns: the path of the cached flow file
+    """
+    if vehicle_params is None:
+        vehicle_params = DEFAULT_VEHICLE
     flow_list = []
     for n_veh, route in zip(n_vehs, routes):
-        route *= loops
         params = {
-            'vehicle': vehicle_params,
+            'vehicle': dict(vehicle_params),
             'interval': 1,
             'startTime': 0,
             'endTime': n_veh-1,
-            'route': route
+            'route': list(route) * loops
         }
         flow_list.append(params)
 
-    with open(f"{dir}/flow_{'_'.join(map(str, n_vehs))}_{reward}.json", 'w') as f:
-        f.write(json.dumps(flow_list, indent=2))
-    return
+    text = json.dumps(flow_list, separators=(',', ':'))
+    return cache_file(dir, f"flow_{'_'.join(map(str, n_vehs))}.json", text)